@@ -1,10 +1,25 @@
 // include product model
 const Log = require('./log');
 
-// create a new Log.
+// create a new Log, or one per value when data is an array (batches from
+// telemetry.py, possibly gzip-compressed JSON).
 exports.log_create = function (req, res) {
     // validate request
-    console.log(req.body)
+    if (Array.isArray(req.body.data)) {
+        return Log.insertMany(req.body.data.map(value => ({ data: value })))
+            .then(data => {
+                res.send({
+                    success: true,
+                    message: data.length + ' logs successfully created'
+                });
+            }).catch(err => {
+                res.status(500).send({
+                    success: false,
+                    message: err.message || "Some error occurred while creating logs."
+                });
+            });
+    }
+
     if (!req.body.data) {
         return res.status(400).send({
             success: false,
@@ -1,3 +1,5 @@
+import os
+import sys
 import threading
 from datetime import datetime
 import torch
@@ -10,6 +12,11 @@ from model import NeuralNet
 import torchvision
 import torchvision.transforms as transforms
 
+# The repository root, for the telemetry exporter shared with client.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..'))
+from telemetry import TelemetryExporter
+
 # # --------------- server ----------------------
 # from flask_socketio import SocketIO, emit
 # from flask import Flask
@@ -24,7 +31,6 @@ import torchvision.transforms as transforms
 # app.config['SECRET_KEY'] = 'secret!'
 # socketio = SocketIO(app, cors_allowed_origins='*')
 # CORS(app)
-import requests
 from firebase import firebase
 firebase = firebase.FirebaseApplication(
     "https://cnextra-f152b-default-rtdb.firebaseio.com/", None)
@@ -92,6 +98,9 @@ def train(cpu, args):
         sampler=train_sampler
     )
 
+    # Losses are posted in batches by a background thread
+    exporter = TelemetryExporter(url) if cpu == 0 else None
+
     start = datetime.now()
     total_step = len(train_loader)
     lossVal = []
@@ -113,13 +122,11 @@ def train(cpu, args):
                 #lossVal.append(lossValue)
                 #result = firebase.post('/lossdata', lossValue)
                 #print(result)
-                myobj = {'data': loss.item()}
-
-                x = requests.post(url, data = myobj)
-                # print(x)
+                exporter.record(loss.item())
 
     #result = firebase.post('/lossdata', lossVal)
     if cpu == 0:
+        exporter.close()
         print("Training completed in: " + str(datetime.now() - start))
 
 
@@ -0,0 +1,203 @@
+import itertools
+import os
+import threading
+
+import torch
+
+
+class ShardedAccumulator:
+    """Weighted sum of flat update vectors, split over independent shards.
+
+    Each worker adds into its own shard under that shard's lock, in place
+    (`add_(value, alpha=weight)`, no temporaries), so concurrent updates only
+    contend when two workers share a shard, and torch releases the GIL while
+    adding. The partial sums are reduced once, at round close.
+
+    Every update carries the round it was computed for. The round is checked
+    under the shard lock and `reduce` takes all shard locks, so an update can
+    never end up in a round it does not belong to.
+
+    Updates may also be deltas against the round's reference model, dense
+    (`add_delta`) or sparse (`add_sparse_delta`, a scatter-add of only the
+    sent elements). Their weights are tracked separately and `reduce` adds
+    the reference once for all of them, so sum and total weight come out as
+    if every update had been sent in full.
+
+    With `max_weight`, the weight of each update is capped at that.
+
+    Threads are assigned shards round-robin. With a multiprocessing
+    `context`, all state lives in shared memory behind process locks and the
+    accumulator can be handed to worker processes, which pass their shard
+    explicitly.
+    """
+
+    def __init__(self, size, round_id=0, n_shards=None, context=None,
+                 max_weight=0.0):
+        if n_shards is None:
+            n_shards = os.cpu_count() or 1
+        self.max_weight = max_weight
+
+        self.partials = torch.zeros(n_shards, size)
+        self.weights = torch.zeros(n_shards, dtype=torch.float64)
+        self.delta_weights = torch.zeros(n_shards, dtype=torch.float64)
+        self._round_id = torch.tensor([round_id], dtype=torch.int64)
+
+        if context is None:
+            self._locks = [threading.Lock() for _ in range(n_shards)]
+        else:
+            self._locks = [context.Lock() for _ in range(n_shards)]
+            self.partials.share_memory_()
+            self.weights.share_memory_()
+            self.delta_weights.share_memory_()
+            self._round_id.share_memory_()
+
+        self._init_thread_shards()
+
+    def _init_thread_shards(self):
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_next_shard']
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_thread_shards()
+
+    @property
+    def n_shards(self):
+        return len(self._locks)
+
+    @property
+    def round_id(self):
+        return self._round_id.item()
+
+    @property
+    def total_weight(self):
+        """Weight added to the current round so far."""
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            return self.weights.sum().item()
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+    def _shard(self):
+        """Return this thread's shard, assigned round-robin on first use."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            self._local.shard = next(self._next_shard) % self.n_shards
+            return self._local.shard
+
+    def _capped(self, weight):
+        if self.max_weight > 0:
+            return min(weight, self.max_weight)
+        return weight
+
+    def add(self, round_id, value, weight, shard=None):
+        """Add `weight * value` to the round. Return False if the update
+        belongs to another round.
+        """
+        if shard is None:
+            shard = self._shard()
+        weight = self._capped(weight)
+
+        with self._locks[shard]:
+            if round_id != self._round_id.item():
+                return False
+
+            self.partials[shard].add_(value, alpha=weight)
+            self.weights[shard] += weight
+
+        return True
+
+    def add_delta(self, round_id, delta, weight, shard=None, scale=1.0):
+        """Add the update `reference + scale * delta` with `weight`.
+
+        `delta` may be float16 or int8. Return False if the update belongs
+        to another round.
+        """
+        if shard is None:
+            shard = self._shard()
+        weight = self._capped(weight)
+
+        with self._locks[shard]:
+            if round_id != self._round_id.item():
+                return False
+
+            self.partials[shard].add_(delta, alpha=weight * scale)
+            self.weights[shard] += weight
+            self.delta_weights[shard] += weight
+
+        return True
+
+    def add_sparse_delta(self, round_id, indices, values, weight,
+                         shard=None, scale=1.0):
+        """Add the update `reference + scale * delta` with `weight`, where
+        `delta` is zero except for `values` at `indices`.
+
+        Return False if the update belongs to another round.
+        """
+        if shard is None:
+            shard = self._shard()
+        weight = self._capped(weight)
+
+        # Outside the lock: only k elements, and `values` is left untouched
+        indices = indices.long()
+        values = values.to(torch.float32, copy=True).mul_(weight * scale)
+
+        with self._locks[shard]:
+            if round_id != self._round_id.item():
+                return False
+
+            self.partials[shard].index_add_(0, indices, values)
+            self.weights[shard] += weight
+            self.delta_weights[shard] += weight
+
+        return True
+
+    def reduce(self, next_round_id, out=None, reference=None):
+        """Close the round and start `next_round_id`.
+
+        Return (weighted sum, total weight) of the closed round. `reference`
+        is the model the round's deltas were taken against; it is required
+        if any were added.
+        """
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            total = torch.sum(self.partials, 0, out=out)
+            total_weight = self.weights.sum().item()
+            delta_weight = self.delta_weights.sum().item()
+            self._clear(next_round_id)
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+        if delta_weight != 0:
+            if reference is None:
+                raise ValueError("Deltas were added but no reference given")
+            total.add_(reference, alpha=delta_weight)
+
+        return total, total_weight
+
+    def reset(self, round_id):
+        """Discard the current round and start `round_id`."""
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._clear(round_id)
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+    def _clear(self, round_id):
+        self.partials.zero_()
+        self.weights.zero_()
+        self.delta_weights.zero_()
+        self._round_id.fill_(round_id)
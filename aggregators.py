@@ -0,0 +1,222 @@
+import threading
+
+import torch
+
+# Coordinates sorted at a time by the order-statistic rules, bounding their
+# temporaries to (updates x COLUMN_CHUNK) elements
+COLUMN_CHUNK = 1 << 16
+
+
+def weighted_mean(deltas, weights, trim_ratio=0.0):
+    """The weighted average of the rows."""
+    weights = weights.to(deltas.dtype)
+    return torch.mv(deltas.t(), weights).div_(weights.sum())
+
+
+def trimmed_mean(deltas, weights, trim_ratio=0.1):
+    """Per coordinate, the mean of the rows left after dropping the
+    `trim_ratio` smallest and largest. Every row counts once.
+    """
+    n_rows = deltas.shape[0]
+    n_trimmed = int(n_rows * trim_ratio)
+    if n_rows - 2 * n_trimmed <= 0:
+        return coordinate_median(deltas, weights)
+
+    result = torch.empty(deltas.shape[1])
+    for start in range(0, deltas.shape[1], COLUMN_CHUNK):
+        block = deltas[:, start:start + COLUMN_CHUNK].sort(0).values
+        torch.mean(block[n_trimmed:n_rows - n_trimmed], 0,
+                   out=result[start:start + COLUMN_CHUNK])
+    return result
+
+
+def coordinate_median(deltas, weights, trim_ratio=0.0):
+    """Per coordinate, the median of the rows (the mean of the middle two
+    for an even count). Every row counts once.
+    """
+    n_rows = deltas.shape[0]
+    result = torch.empty(deltas.shape[1])
+    for start in range(0, deltas.shape[1], COLUMN_CHUNK):
+        block = deltas[:, start:start + COLUMN_CHUNK].sort(0).values
+        middle = block[(n_rows - 1) // 2:n_rows // 2 + 1]
+        torch.mean(middle, 0, out=result[start:start + COLUMN_CHUNK])
+    return result
+
+
+AGGREGATORS = {
+    'mean': weighted_mean,
+    'trimmed-mean': trimmed_mean,
+    'median': coordinate_median,
+}
+
+
+def clip_norms(deltas, max_norm):
+    """Scale down, in place, the rows whose L2 norm exceeds `max_norm`."""
+    norms = torch.linalg.vector_norm(deltas, dim=1)
+    factors = (max_norm / norms.clamp(min=1e-12)).clamp(max=1.0)
+    deltas.mul_(factors.unsqueeze(1))
+
+
+class RobustAccumulator:
+    """Keep a round's updates, each as a row, and aggregate them with a
+    rule that needs all of them at once.
+
+    A drop-in for ShardedAccumulator (same methods, same return values),
+    for rounds that must survive bad participants:
+
+    - updates with NaN or infinite values are rejected (`accumulate` in
+      compression.py already drops those it decodes, and invalid
+      weights); with `max_weight`, weights are capped at that;
+    - with `clip_norm`, each update's difference from the round's
+      reference is scaled down to at most that L2 norm;
+    - `rule` (see AGGREGATORS) combines the differences: the weighted
+      mean, or the coordinate-wise trimmed mean or median, which count
+      every participant once whatever weight it reports.
+
+    Memory is bounded: rows live in one preallocated [`capacity`, size]
+    matrix, updates beyond it are rejected, and the order-statistic rules
+    sort `COLUMN_CHUNK` coordinates at a time. `reduce` returns the
+    aggregate times the round's weight, so dividing by the weight gives
+    the aggregate, as with the streaming sum. The round's weight, sent
+    upstream, is the sum of the (capped) weights for the mean, and the
+    number of updates for the rules that count each once.
+    """
+
+    def __init__(self, size, round_id=0, rule='mean', trim_ratio=0.1,
+                 clip_norm=0.0, capacity=256, max_weight=0.0):
+        if rule not in AGGREGATORS:
+            raise ValueError("Unknown aggregator: " + rule)
+        if not 0 <= trim_ratio < 0.5:
+            raise ValueError("trim_ratio must be in [0, 0.5)")
+
+        self.rule = AGGREGATORS[rule]
+        self.weighted = self.rule is weighted_mean
+        self.trim_ratio = trim_ratio
+        self.clip_norm = clip_norm
+        self.max_weight = max_weight
+
+        self.rows = torch.zeros(capacity, size)
+        self.weights = torch.zeros(capacity, dtype=torch.float64)
+        # Rows holding differences from the reference rather than models
+        self.is_delta = [False] * capacity
+        self.n_rows = 0
+        self.n_rejected = 0
+        self._round_id = round_id
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return self.rows.shape[0]
+
+    @property
+    def round_id(self):
+        return self._round_id
+
+    @property
+    def total_weight(self):
+        """Weight added to the current round so far, as `reduce` would
+        return it.
+        """
+        with self._lock:
+            if self.weighted:
+                return self.weights[:self.n_rows].sum().item()
+            return float(self.n_rows)
+
+    def _append(self, round_id, weight, is_delta, fill):
+        """Fill the next row with `fill(row)` if the update belongs to the
+        round, fits and is finite. Return whether it was kept.
+        """
+        if self.max_weight > 0:
+            weight = min(weight, self.max_weight)
+
+        with self._lock:
+            if round_id != self._round_id:
+                return False
+            if self.n_rows == self.capacity:
+                self.n_rejected += 1
+                return False
+
+            row = self.rows[self.n_rows]
+            fill(row)
+            if not torch.isfinite(row).all():
+                self.n_rejected += 1
+                return False
+
+            self.weights[self.n_rows] = weight
+            self.is_delta[self.n_rows] = is_delta
+            self.n_rows += 1
+        return True
+
+    def add(self, round_id, value, weight, shard=None):
+        """Add a whole model. Return False if it was not kept."""
+        return self._append(round_id, weight, False, lambda row:
+                            row.copy_(value))
+
+    def add_delta(self, round_id, delta, weight, shard=None, scale=1.0):
+        """Add the update `reference + scale * delta`. Return False if it
+        was not kept.
+        """
+        return self._append(round_id, weight, True, lambda row:
+                            row.copy_(delta).mul_(scale))
+
+    def add_sparse_delta(self, round_id, indices, values, weight,
+                         shard=None, scale=1.0):
+        """Add the update `reference + scale * delta`, where `delta` is
+        zero except for `values` at `indices`. Return False if it was not
+        kept.
+        """
+        def fill(row):
+            row.zero_()
+            row.index_put_((indices.long(),),
+                           values.to(torch.float32) * scale,
+                           accumulate=True)
+
+        return self._append(round_id, weight, True, fill)
+
+    def reduce(self, next_round_id, out=None, reference=None):
+        """Close the round and start `next_round_id`.
+
+        Return (aggregate * weight, weight) of the closed round (see the
+        class). `reference` is the model the round's participants trained
+        from; it is required if any update was added.
+        """
+        with self._lock:
+            n_rows = self.n_rows
+            if self.weighted:
+                total_weight = self.weights[:n_rows].sum().item()
+            else:
+                total_weight = float(n_rows)
+            if out is None:
+                out = torch.zeros(self.rows.shape[1])
+
+            if n_rows == 0:
+                out.zero_()
+            else:
+                if reference is None:
+                    raise ValueError("Updates were added but no reference "
+                                     "given")
+
+                deltas = self.rows[:n_rows]
+                for i in range(n_rows):
+                    if not self.is_delta[i]:
+                        deltas[i].sub_(reference)
+                if self.clip_norm > 0:
+                    clip_norms(deltas, self.clip_norm)
+
+                aggregate = self.rule(
+                    deltas, self.weights[:n_rows], self.trim_ratio
+                )
+                torch.add(reference, aggregate, out=out)
+                out.mul_(total_weight)
+
+            self._clear(next_round_id)
+        return out, total_weight
+
+    def reset(self, round_id):
+        """Discard the current round and start `round_id`."""
+        with self._lock:
+            self._clear(round_id)
+
+    def _clear(self, round_id):
+        self.n_rows = 0
+        self._round_id = round_id
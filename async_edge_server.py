@@ -0,0 +1,268 @@
+import asyncio
+import time
+
+from utils import UPDATE_LOG_EVERY, logger
+from codec import encode_ack, decode_ack, decode_hello
+from compression import KIND_NAMES, decode_update
+from connection import UpstreamConnection, shutdown_quietly
+from edge_server import EdgeServer
+from fanout import DELIVERY_SECONDS
+from framing import (
+    FrameReader, ProtocolError, send_frame_async, MSG_ACK, MSG_CLOSE,
+    MSG_HELLO
+)
+from node import (
+    HELLO_TIMEOUT, CLIENTS, DECODE_SECONDS, MODEL_DECODE_SECONDS
+)
+
+
+class AsyncEdgeServer(EdgeServer):
+    """Edge server running clients, the upper server connection and the
+    aggregation schedule as coroutines on one asyncio event loop, instead of
+    one OS thread per client.
+
+    Everything runs on the loop's thread, so `_key_lock` is never contended;
+    it is still taken to keep the shared EdgeServer methods' contract.
+
+    Broadcasts never wait for clients: each connection has at most one send
+    in flight, and a model queued behind it replaces any older one still
+    waiting, so a slow client only ever gets the latest model.
+    """
+
+    def __init__(self, upper_server_ip, upper_server_port, port,
+                 **kwargs):
+        if kwargs.get('n_workers', 0) > 0 or kwargs.get('train_weight', 0):
+            raise ValueError("The asyncio mode serves clients on its own "
+                             "loop, without workers or training")
+
+        super().__init__(upper_server_ip, upper_server_port, port, **kwargs)
+
+        self.loop = None
+        self._tasks = set()
+        # Connections with a send in flight -> (version, time queued)
+        # waiting behind it
+        self._pending = {}
+        # Connection -> last version it acknowledged
+        self._acked = {}
+        self._upper_send_lock_async = None
+
+    def _start_task(self, coro):
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def handle_request_async(self, client_conn, peer_addr):
+        """Handle request from clients."""
+        reader = FrameReader(client_conn)
+        try:
+            client_addr, n_tenants = await asyncio.wait_for(
+                self.greet_client_async(client_conn, reader), HELLO_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.info("No hello from %s: %r", peer_addr, e)
+            client_conn.close()
+            return
+
+        while True:
+            try:
+                msg_type, payload = await reader.recv_frame_async(self.loop)
+
+                if msg_type == MSG_CLOSE:
+                    break
+
+                if msg_type == MSG_ACK:
+                    self._acked[client_conn] = decode_ack(payload)
+                    continue
+
+                with DECODE_SECONDS.time():
+                    data_rcv = decode_update(
+                        msg_type, payload, self.state.size, n_tenants
+                    )
+
+                logger.debug("Received %s from %s: seqnum %d, weight %s",
+                             KIND_NAMES[data_rcv['kind']], client_addr,
+                             data_rcv['seqnum'], data_rcv['weight'],
+                             every=UPDATE_LOG_EVERY)
+
+                accepted = self.add_update(client_addr, data_rcv)
+                self.report_update(client_addr, accepted)
+            except (OSError, ConnectionError):
+                break
+
+        self.remove_client(client_addr, client_conn)
+        self._acked.pop(client_conn, None)
+        client_conn.close()
+
+    async def greet_client_async(self, client_conn, reader):
+        """Coroutine version of `greet_client`."""
+        msg_type, payload = await reader.recv_frame_async(self.loop)
+        if msg_type != MSG_HELLO:
+            raise ProtocolError("Expected a hello, got message type "
+                                + str(msg_type))
+        client_id, acked, n_tenants = decode_hello(payload)
+
+        with self._key_lock:
+            old_conn = self.client_conns.get(client_id)
+            if old_conn is not None:
+                # Its task sees the connection end and closes it
+                shutdown_quietly(old_conn)
+
+            self.client_conns[client_id] = client_conn
+            self.client_tenants[client_id] = n_tenants
+            CLIENTS.set(len(self.client_conns))
+            self.scheduler.notify()
+
+            # Queued before any later broadcast can reach the client, as
+            # steps from the version it holds, or nothing if up to date
+            self._acked[client_conn] = acked
+            self.queue_to_client(self.seqnum, client_conn, client_id)
+
+            logger.info("%s %s", client_id,
+                        "connected" if old_conn is None else "reconnected")
+
+        return client_id, n_tenants
+
+    def queue_to_client(self, seqnum, client_conn, client_addr):
+        """Send model version `seqnum` to the client without waiting for
+        it.
+        """
+        queued = (seqnum, time.perf_counter())
+        if client_conn in self._pending:
+            # Sent when the send in flight is done, instead of anything older
+            self._pending[client_conn] = queued
+            return
+
+        self._pending[client_conn] = None
+        self._start_task(
+            self.send_to_client_async(queued, client_conn, client_addr)
+        )
+
+    async def send_to_client_async(self, queued, client_conn, client_addr):
+        """Send model version `seqnum` of `queued` = (seqnum, time queued)
+        to the client, as steps from the version it acknowledged or whole
+        (see `ModelHistory.frames`), then the latest version queued for it
+        meanwhile, if any.
+        """
+        try:
+            while queued is not None:
+                seqnum, queued_time = queued
+                frames = self.history.frames(
+                    self._acked.get(client_conn), seqnum
+                )
+                for msg_type, buffers in frames:
+                    await send_frame_async(
+                        self.loop, client_conn, msg_type, *buffers
+                    )
+                DELIVERY_SECONDS.observe(time.perf_counter() - queued_time)
+                queued = self._pending[client_conn]
+                self._pending[client_conn] = None
+        except (OSError, ConnectionError):
+            # Its reader task sees the connection end and closes it
+            shutdown_quietly(client_conn)
+            self.remove_client(client_addr, client_conn)
+        finally:
+            del self._pending[client_conn]
+
+    def broadcast_to_clients(self, data):
+        """Queue model data for all clients."""
+        with self._key_lock:
+            for addr, conn in self.client_conns.items():
+                self.queue_to_client(data['seqnum'], conn, addr)
+
+    async def send_to_upper_server_async(self, data):
+        """Send aggregated update to upper server."""
+        logger.debug("Sent data: seqnum %d, weight %s, value %s",
+                     data['seqnum'], data['weight'], data['value'])
+        msg_type, buffers = self.encode_update(data)
+        self.startSendTime_upper = time.time()
+        async with self._upper_send_lock_async:
+            sent = await self.upper.send_async(
+                self.loop, msg_type, *buffers
+            )
+        if not sent:
+            logger.warning("Upper server unreachable, update for model %d "
+                           "dropped", data['seqnum'])
+
+    async def ack_upper_server_async(self, seqnum):
+        """Tell the upper server which model we hold."""
+        async with self._upper_send_lock_async:
+            await self.upper.send_async(
+                self.loop, MSG_ACK, *encode_ack(seqnum)
+            )
+
+    async def send_to_upper_server_on_schedule_async(self):
+        """Send to upper server as soon as a round closes."""
+        while True:
+            all_responded = await self.scheduler.wait_for_round_async(
+                self.round_complete, self.has_clients
+            )
+
+            with self._key_lock:
+                data = self.end_round(all_responded)
+                if data is None:
+                    continue
+                wait_time = self.scheduler.wait_times[-1]
+
+            logger.info("Round closed after %d ms%s", int(wait_time*1000),
+                        " (all responded)" if all_responded else "")
+            await self.send_to_upper_server_async(data)
+
+    async def wait_for_clients_async(self):
+        """Accept clients and start one task serving each of them."""
+        while True:
+            # Wait for client
+            accepted = await self.loop.sock_accept(self.socket)
+            client_conn, (client_ip, client_port) = accepted
+            client_conn.setblocking(False)
+
+            # Registered once it said who it is
+            self._start_task(self.handle_request_async(
+                client_conn, client_ip + ":" + str(client_port)
+            ))
+
+    async def wait_for_upper_server_async(self):
+        """Wait receive new avg."""
+        # Reconnects and resumes our session as needed
+        async for msg_type, payload in self.upper.frames_async(self.loop):
+            # Receive input parameter from server
+            self.latency_upper = time.time() - self.startSendTime_upper
+            with MODEL_DECODE_SECONDS.time():
+                data_rcv = self.receive_model(msg_type, payload)
+            if data_rcv is None:
+                # Steps will be sent from the version we have
+                await self.ack_upper_server_async(self.seqnum)
+                continue
+
+            self.report_upper_model(data_rcv)
+
+            with self._key_lock:
+                self.set_global_model(data_rcv)
+            await self.ack_upper_server_async(data_rcv['seqnum'])
+
+            # Send number to all clients
+            self.broadcast_to_clients(data_rcv)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._upper_send_lock_async = asyncio.Lock()
+        self.socket.setblocking(False)
+        await self.upper.connect_async(self.loop)
+
+        await asyncio.gather(
+            self.wait_for_clients_async(),
+            self.wait_for_upper_server_async(),
+            self.send_to_upper_server_on_schedule_async()
+        )
+
+    def set_up_conn_to_upper_server(self):
+        """Prepare the connection to the upper server; it is made on the
+        event loop by `serve`.
+        """
+        self.upper = UpstreamConnection(
+            self.upper_server_ip, self.upper_server_port, self.client_id,
+            lambda: self.seqnum
+        )
+
+    def run(self):
+        """Call this method to run the server."""
+        asyncio.run(self.serve())
@@ -0,0 +1,84 @@
+"""Aggregation time and bytes per round: fc-only against the full state.
+
+Run from the repository root:
+
+    python -m benchmarks.aggregation [<n_updates>]
+"""
+import sys
+import time
+
+import torch
+
+from codec import encode_update
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+N_ROUNDS = 20
+
+
+def bytes_per_update(value):
+    buffers = encode_update(value, 1, 0)
+    return sum(memoryview(buffer).nbytes for buffer in buffers)
+
+
+def time_rounds(aggregate_round):
+    start_time = time.perf_counter()
+    for _ in range(N_ROUNDS):
+        aggregate_round()
+    return (time.perf_counter() - start_time) / N_ROUNDS
+
+
+def main():
+    n_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    model = NeuralNet()
+    fc_updates = [torch.randn(model.fc.weight.shape) for _ in range(n_updates)]
+    state_dicts = [
+        {
+            name: torch.randn(tensor.shape)
+            for name, tensor in model.state_dict().items()
+            if tensor.is_floating_point()
+        }
+        for _ in range(n_updates)
+    ]
+    state = FlatState(model)
+    flat_updates = [torch.randn(state.size) for _ in range(n_updates)]
+
+    def fc_only():
+        # Previous path: one temporary per update, fc.weight only
+        total = torch.zeros(model.fc.weight.shape)
+        for value in fc_updates:
+            total += 1 * value.data.clone()
+        return total / n_updates
+
+    def per_tensor():
+        totals = {
+            name: torch.zeros(tensor.shape)
+            for name, tensor in state_dicts[0].items()
+        }
+        for update in state_dicts:
+            for name, tensor in update.items():
+                totals[name].add_(tensor)
+        for total in totals.values():
+            total.div_(n_updates)
+
+    def flat():
+        total = torch.zeros(state.size)
+        for value in flat_updates:
+            total.add_(value, alpha=1)
+        torch.div(total, n_updates, out=state.vector)
+
+    print("Updates per round: " + str(n_updates))
+    print("{:<22}{:>14}{:>18}".format('path', 'ms / round', 'bytes / update'))
+    rows = [
+        ('fc.weight only', fc_only, bytes_per_update(fc_updates[0])),
+        ('full, per tensor', per_tensor, bytes_per_update(flat_updates[0])),
+        ('full, flat vector', flat, bytes_per_update(flat_updates[0])),
+    ]
+    for name, aggregate_round, n_bytes in rows:
+        print("{:<22}{:>14.3f}{:>18}".format(
+            name, time_rounds(aggregate_round) * 1000, n_bytes))
+
+
+if __name__ == '__main__':
+    main()
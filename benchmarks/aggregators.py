@@ -0,0 +1,86 @@
+"""Cost per round of each aggregator as participants grow, and how far each
+lands from the honest mean when a tenth of the updates are malicious.
+
+Honest updates are the reference plus small noise; malicious ones are the
+reference minus 100 times an honest change. The error column is the
+distance to the mean of the honest updates, relative to the norm of that
+mean's change. Each round adds every update and reduces.
+
+Run from the repository root:
+
+    python -m benchmarks.aggregators [<max_participants>]
+"""
+import sys
+import time
+
+import torch
+
+from accumulator import ShardedAccumulator
+from aggregators import RobustAccumulator
+from params import FlatState, neural_net_schema
+
+N_ROUNDS = 5
+PARTICIPANTS = [10, 30, 100, 300, 1000, 3000]
+MALICIOUS_FRACTION = 0.1
+ACCUMULATORS = [
+    ('streaming mean', None),
+    ('mean, clipped', {'rule': 'mean', 'clip_norm': 2.0}),
+    ('trimmed-mean', {'rule': 'trimmed-mean', 'trim_ratio': 0.2}),
+    ('median', {'rule': 'median'}),
+]
+
+
+def make_updates(reference, n_participants):
+    torch.manual_seed(0)
+    changes = 0.01 * torch.randn(n_participants, reference.numel())
+    honest_mean = reference + changes.mean(0)
+    n_malicious = int(n_participants * MALICIOUS_FRACTION)
+    changes[:n_malicious] *= -100
+    return reference + changes, honest_mean
+
+
+def run(options, reference, updates):
+    """Return (ms per round, aggregate)."""
+    n_participants, size = updates.shape
+    if options is None:
+        accumulator = ShardedAccumulator(size, 0, n_shards=1)
+    else:
+        accumulator = RobustAccumulator(size, 0, capacity=n_participants,
+                                        **options)
+
+    out = torch.empty(size)
+    start_time = time.perf_counter()
+    for round_id in range(N_ROUNDS):
+        for value in updates:
+            accumulator.add(round_id, value, 1.0)
+        _, total_weight = accumulator.reduce(
+            round_id + 1, out=out, reference=reference
+        )
+    elapsed = (time.perf_counter() - start_time) / N_ROUNDS
+    return elapsed * 1000, out / total_weight
+
+
+def main():
+    max_participants = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    reference = FlatState.from_schema(neural_net_schema()).snapshot()
+    reference.normal_()
+
+    print("Model of {} values, {:.0%} of updates malicious".format(
+        reference.numel(), MALICIOUS_FRACTION))
+    print("{:>14}{:>18}{:>14}{:>14}{:>12}".format(
+        'participants', 'aggregator', 'ms / round', 'buffer MB', 'error'))
+    for n_participants in PARTICIPANTS:
+        if n_participants > max_participants:
+            break
+        updates, honest_mean = make_updates(reference, n_participants)
+        honest_change = torch.dist(honest_mean, reference).item()
+        for name, options in ACCUMULATORS:
+            ms, aggregate = run(options, reference, updates)
+            buffer_mb = 0 if options is None else updates.nbytes / 2 ** 20
+            error = torch.dist(aggregate, honest_mean).item() / honest_change
+            print("{:>14}{:>18}{:>14.2f}{:>14.1f}{:>12.3g}".format(
+                n_participants, name, ms, buffer_mb, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Uplink bytes per round and convergence of each compression scheme against
+the uncompressed baseline.
+
+Every client pulls the global model part of the way towards its own optimum
+each round, plus noise, so the federated optimum is the mean of the clients'
+optima. Updates go through the real encode, decode and accumulate path; the
+error column is the final distance to the optimum, relative to its norm.
+
+Run from the repository root:
+
+    python -m benchmarks.compression [<n_clients>] [<n_rounds>]
+"""
+import sys
+import time
+
+import torch
+
+from accumulator import ShardedAccumulator
+from compression import SCHEMES, Compressor, accumulate, decode_update
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+LOCAL_STEP = 0.1
+NOISE = 0.01
+TOPK_RATIO = 0.01
+
+
+def run(scheme, optima, n_rounds):
+    n_clients, size = optima.shape
+    torch.manual_seed(1)
+
+    model = torch.zeros(size)
+    compressors = [Compressor(scheme, TOPK_RATIO) for _ in range(n_clients)]
+    accumulator = ShardedAccumulator(size, 0, n_shards=1)
+    n_bytes = 0
+
+    start_time = time.perf_counter()
+    for round_id in range(n_rounds):
+        for optimum, compressor in zip(optima, compressors):
+            value = model + LOCAL_STEP * (optimum - model)
+            value.add_(torch.randn(size), alpha=NOISE)
+
+            msg_type, buffers = compressor.encode(value, model, 1, round_id)
+            payload = bytearray(b''.join(buffers))
+            n_bytes += len(payload)
+            accumulate(accumulator, decode_update(msg_type, payload, size))
+
+        total, total_weight = accumulator.reduce(
+            round_id + 1, reference=model
+        )
+        model = total / total_weight
+    elapsed = time.perf_counter() - start_time
+
+    optimum = optima.mean(0)
+    error = float((model - optimum).norm() / optimum.norm())
+    return n_bytes / n_rounds, error, elapsed / n_rounds
+
+
+def main():
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    n_rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    size = FlatState(NeuralNet()).size
+    torch.manual_seed(0)
+    optima = torch.randn(n_clients, size)
+
+    print("Clients: {}, rounds: {}, model size: {}, top-k ratio: {}".format(
+        n_clients, n_rounds, size, TOPK_RATIO))
+    print("{:<12}{:>14}{:>10}{:>12}{:>14}".format(
+        'scheme', 'KB / round', 'ratio', 'error', 'ms / round'))
+
+    baseline_bytes = None
+    for scheme in SCHEMES:
+        bytes_per_round, error, round_time = run(scheme, optima, n_rounds)
+        if baseline_bytes is None:
+            baseline_bytes = bytes_per_round
+        print("{:<12}{:>14.1f}{:>10.1f}{:>12.2e}{:>14.2f}".format(
+            scheme, bytes_per_round / 1024, baseline_bytes / bytes_per_round,
+            error, round_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Update ingest rate of the global-lock sum against ShardedAccumulator as
+the number of concurrently reporting clients grows.
+
+Run from the repository root:
+
+    python -m benchmarks.contention [<max_clients>]
+"""
+import sys
+import threading
+import time
+
+import torch
+
+from accumulator import ShardedAccumulator
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+N_UPDATES_PER_CLIENT = 500
+
+
+def global_lock(n_clients, value):
+    total = torch.zeros(value.numel())
+    lock = threading.Lock()
+
+    def add():
+        nonlocal total
+        with lock:
+            # Previous path: two temporaries, every worker serialized
+            total += 1 * value.data.clone()
+
+    return add
+
+
+def sharded(n_clients, value):
+    accumulator = ShardedAccumulator(value.numel(), round_id=0)
+
+    def add():
+        accumulator.add(0, value, 1)
+
+    return add
+
+
+def run(make_add, n_clients, value):
+    add = make_add(n_clients, value)
+
+    def client():
+        for _ in range(N_UPDATES_PER_CLIENT):
+            add()
+
+    threads = [threading.Thread(target=client) for _ in range(n_clients)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start_time
+
+    return n_clients * N_UPDATES_PER_CLIENT / elapsed
+
+
+def main():
+    max_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+
+    # Parallelism has to come from the client threads, not from torch
+    torch.set_num_threads(1)
+    value = torch.randn(FlatState(NeuralNet()).size)
+
+    print("{:>10}{:>22}{:>22}".format(
+        'clients', 'global lock upd/s', 'sharded upd/s'))
+    n_clients = 1
+    while n_clients <= max_clients:
+        print("{:>10}{:>22.0f}{:>22.0f}".format(
+            n_clients,
+            run(global_lock, n_clients, value),
+            run(sharded, n_clients, value)
+        ))
+        n_clients *= 2
+
+
+if __name__ == '__main__':
+    main()
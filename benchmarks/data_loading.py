@@ -0,0 +1,71 @@
+"""Training-set batches per second: torchvision MNIST with ToTensor and a
+DataLoader, as clients used to load it, against the tensor cache of
+data.py, whole and as one shard of 100.
+
+Each pass takes the 101 batches of 100 samples a client trains on per
+round. Build the cache first (it is built on first use otherwise).
+
+Run from the repository root:
+
+    python -m benchmarks.data_loading [<n_passes>]
+"""
+import sys
+import time
+
+import torch
+import torchvision
+
+from data import BatchLoader, build_cache, load_mnist, shard_indices
+
+N_BATCHES = 101
+BATCH_SIZE = 100
+
+
+def samples_per_second(loader, n_passes):
+    n_samples = 0
+    start_time = time.perf_counter()
+    for _ in range(n_passes):
+        for i, (data, target) in enumerate(loader):
+            if i >= N_BATCHES:
+                break
+            n_samples += len(target)
+    return n_samples / (time.perf_counter() - start_time)
+
+
+def main():
+    n_passes = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    start_time = time.perf_counter()
+    build_cache()
+    build_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    images, labels = load_mnist()
+    load_time = time.perf_counter() - start_time
+
+    dataset = torchvision.datasets.MNIST(
+        root='./data', transform=torchvision.transforms.ToTensor()
+    )
+    data_loader = torch.utils.data.DataLoader(
+        dataset=dataset, batch_size=BATCH_SIZE, shuffle=False
+    )
+
+    print("Cache built in {:.2f} s, loaded in {:.4f} s".format(
+        build_time, load_time))
+    print("{:<32}{:>16}".format('loader', 'samples / s'))
+    for name, loader in [
+        ('torchvision + DataLoader', data_loader),
+        ('cache, in order', BatchLoader(images, labels, BATCH_SIZE,
+                                        shuffle=False)),
+        ('cache, shuffled', BatchLoader(images, labels, BATCH_SIZE)),
+        ('cache, shuffled shard of 100', BatchLoader(
+            images, labels, BATCH_SIZE,
+            indices=shard_indices(labels, 0, 100, non_iid=True)
+        )),
+    ]:
+        print("{:<32}{:>16,.0f}".format(
+            name, samples_per_second(loader, n_passes)))
+
+
+if __name__ == '__main__':
+    main()
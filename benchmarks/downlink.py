@@ -0,0 +1,71 @@
+"""Downlink bytes per client and round, whole model against compressed steps
+from the version the client acknowledged.
+
+The global model moves by a small random step each round. "in sync" is a
+client that acknowledged the previous version, "behind" one that last
+acknowledged the version `<lag>` rounds back. "drift" is how far the
+model clients rebuild is from the exact average at the end, relative to
+its norm.
+
+Run from the repository root:
+
+    python -m benchmarks.downlink [<n_rounds>] [<lag>]
+"""
+import sys
+
+import torch
+
+from compression import SCHEMES
+from history import ModelHistory
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+STEP_SIZE = 0.01
+TOPK_RATIO = 0.01
+
+
+def frames_size(frames):
+    return sum(
+        memoryview(buffer).nbytes
+        for _, buffers in frames
+        for buffer in buffers
+    )
+
+
+def run(scheme, initial, n_rounds, lag):
+    torch.manual_seed(1)
+    target = initial.clone()
+    history = ModelHistory(initial.clone(), 0, scheme, TOPK_RATIO)
+
+    in_sync_bytes = 0
+    behind_bytes = 0
+    for seqnum in range(1, n_rounds + 1):
+        target.add_(torch.randn(target.numel()), alpha=STEP_SIZE)
+        history.advance(seqnum, target)
+        in_sync_bytes += frames_size(history.frames(seqnum - 1, seqnum))
+        behind_bytes += frames_size(
+            history.frames(max(seqnum - lag, 0), seqnum)
+        )
+
+    drift = float((history.latest_model - target).norm() / target.norm())
+    return in_sync_bytes / n_rounds, behind_bytes / n_rounds, drift
+
+
+def main():
+    n_rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    lag = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    initial = FlatState(NeuralNet()).snapshot()
+
+    print("Rounds: {}, lag of the client behind: {}, top-k ratio: {}".format(
+        n_rounds, lag, TOPK_RATIO))
+    print("{:<12}{:>18}{:>18}{:>12}".format(
+        'scheme', 'in sync (KB)', 'behind (KB)', 'drift'))
+    for scheme in SCHEMES:
+        in_sync, behind, drift = run(scheme, initial, n_rounds, lag)
+        print("{:<12}{:>18.1f}{:>18.1f}{:>12.2e}".format(
+            scheme, in_sync / 1024, behind / 1024, drift))
+
+
+if __name__ == '__main__':
+    main()
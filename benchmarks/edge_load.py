@@ -0,0 +1,224 @@
+"""Load generator for the edge server: thread mode against asyncio mode.
+
+Starts a fake upper server and N simulated clients in this process (all on
+one asyncio loop) and an edge server in a subprocess. Each round the fake
+upper server broadcasts a model; the simulated clients acknowledge it and
+answer at once, and the round ends when the edge's aggregate for that round
+arrives upstream. The first round, during which clients are still
+connecting, is not timed.
+
+Run from the repository root:
+
+    python -m benchmarks.edge_load --clients 1000 --rounds 10
+
+Several thousand clients need a higher open-file limit (`ulimit -n`).
+"""
+import argparse
+import asyncio
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import torch
+
+from codec import (
+    encode_ack, encode_hello, encode_model, encode_update, decode_model,
+    decode_update
+)
+from compression import apply_delta, decode_model_delta
+from framing import (
+    FrameReader, send_frame_async, MSG_ACK, MSG_HELLO, MSG_MODEL,
+    MSG_MODEL_DELTA, MSG_UPDATE
+)
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def thread_count(pid):
+    """Number of OS threads of a process (Linux only)."""
+    try:
+        with open('/proc/' + str(pid) + '/status') as status:
+            for line in status:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+async def simulated_client(loop, port, size, connect_slots, on_ready,
+                           stats):
+    """Connect to the edge, then acknowledge every model, sent whole or
+    as a step from the one we hold, and answer it with an update.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    async with connect_slots:
+        await loop.sock_connect(sock, ('127.0.0.1', port))
+    await send_frame_async(loop, sock, MSG_HELLO, *encode_hello(
+        'client:' + str(sock.getsockname()[1]), -1
+    ))
+
+    reader = FrameReader(sock)
+    model = None
+    seqnum = -1
+    ready = False
+    try:
+        while True:
+            msg_type, payload = await reader.recv_frame_async(loop)
+            if msg_type == MSG_MODEL_DELTA:
+                step = decode_model_delta(payload, size)
+                if step['base'] != seqnum:
+                    # Steps will be sent from the version we have
+                    await send_frame_async(
+                        loop, sock, MSG_ACK, *encode_ack(seqnum)
+                    )
+                    continue
+                apply_delta(model, step['kind'], step['tensors'])
+                seqnum = step['seqnum']
+            else:
+                data_rcv = decode_model(payload)
+                model = data_rcv['avg'].clone()
+                seqnum = data_rcv['seqnum']
+
+            await send_frame_async(loop, sock, MSG_ACK, *encode_ack(seqnum))
+            if not ready:
+                ready = True
+                on_ready()
+
+            await send_frame_async(
+                loop, sock, MSG_UPDATE, *encode_update(model, 1, seqnum)
+            )
+            stats['updates'] += 1
+    finally:
+        sock.close()
+
+
+async def run_mode(mode, n_clients, n_rounds):
+    loop = asyncio.get_running_loop()
+
+    upper = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    upper.bind(('127.0.0.1', 0))
+    upper.listen(1)
+    upper.setblocking(False)
+    edge_port = free_port()
+
+    edge = subprocess.Popen(
+        [
+            sys.executable, 'edge_server.py',
+            '127.0.0.1', str(upper.getsockname()[1]), str(edge_port),
+            '--mode', mode
+        ],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL
+    )
+
+    clients = []
+    try:
+        edge_conn, _ = await loop.sock_accept(upper)
+        edge_conn.setblocking(False)
+
+        n_ready = [0]
+        all_ready = asyncio.Event()
+
+        def on_ready():
+            n_ready[0] += 1
+            if n_ready[0] == n_clients:
+                all_ready.set()
+
+        avg = FlatState(NeuralNet()).snapshot()
+        reader = FrameReader(edge_conn)
+
+        async def send_round(seqnum):
+            await send_frame_async(
+                loop, edge_conn, MSG_MODEL, *encode_model(avg, seqnum)
+            )
+
+        async def wait_for_update(seqnum):
+            while True:
+                msg_type, payload = await reader.recv_frame_async(loop)
+                # Skip the edge's hello and acks, and late aggregates
+                if (msg_type == MSG_UPDATE
+                        and decode_update(payload)['seqnum'] == seqnum):
+                    return
+
+        # Warm-up round: clients get model 0 on connecting, or with the
+        # broadcast if they connected before it
+        await send_round(0)
+        stats = {'updates': 0}
+        connect_slots = asyncio.Semaphore(64)
+        clients = [
+            loop.create_task(simulated_client(
+                loop, edge_port, avg.numel(), connect_slots, on_ready, stats
+            ))
+            for _ in range(n_clients)
+        ]
+        await all_ready.wait()
+        await wait_for_update(0)
+
+        stats['updates'] = 0
+        latencies = []
+        start_time = time.perf_counter()
+        for seqnum in range(1, n_rounds + 1):
+            round_start_time = time.perf_counter()
+            await send_round(seqnum)
+            await wait_for_update(seqnum)
+            latencies.append(time.perf_counter() - round_start_time)
+        elapsed = time.perf_counter() - start_time
+
+        return {
+            'mode': mode,
+            'updates/s': stats['updates'] / elapsed,
+            'p50 round (s)': percentile(latencies, 0.5),
+            'p99 round (s)': percentile(latencies, 0.99),
+            'edge threads': thread_count(edge.pid),
+        }
+    finally:
+        for client in clients:
+            client.cancel()
+        edge.terminate()
+        edge.wait()
+        upper.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument(
+        '--modes', nargs='+', default=['thread', 'asyncio'],
+        choices=['thread', 'asyncio']
+    )
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    print("Clients: " + str(args.clients) + ", rounds: " + str(args.rounds))
+    for mode in args.modes:
+        result = asyncio.run(run_mode(mode, args.clients, args.rounds))
+        print(", ".join(
+            key + ": " + (
+                '{:.3f}'.format(value) if isinstance(value, float)
+                else str(value)
+            )
+            for key, value in result.items()
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Broadcast completion time for many clients, sending to each in turn (as
+before) against the Broadcaster's writer pool, with and without a few
+throttled clients.
+
+Clients are socket pairs in this process. Throttled clients have small
+socket buffers and read 1 KB every 10 ms; they are registered first, the
+worst case for sending in turn. "call" is how long the broadcasting thread
+is held up, "fast clients" is when every unthrottled client has the model.
+
+Run from the repository root:
+
+    python -m benchmarks.fanout [<n_clients>] [<n_throttled>]
+"""
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import torch
+
+from codec import encode_model
+from fanout import Broadcaster
+from framing import HEADER, MSG_MODEL, send_frame
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+THROTTLED_BUFFER_SIZE = 4096
+THROTTLED_CHUNK_SIZE = 1024
+THROTTLED_INTERVAL = 0.01
+
+
+def read_fast(client_socks, frame_size, done, stop):
+    """Drain the unthrottled clients; set `done` when all have a frame."""
+    selector = selectors.DefaultSelector()
+    n_bytes = {}
+    for sock in client_socks:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        n_bytes[sock] = 0
+
+    buffer = bytearray(1 << 20)
+    remaining = len(client_socks)
+    while remaining > 0 and not stop.is_set():
+        for key, _ in selector.select(timeout=0.1):
+            sock = key.fileobj
+            try:
+                n_bytes[sock] += sock.recv_into(buffer)
+            except BlockingIOError:
+                continue
+            if n_bytes[sock] >= frame_size:
+                selector.unregister(sock)
+                remaining -= 1
+    done.set()
+
+
+def read_throttled(client_socks, stop):
+    for sock in client_socks:
+        sock.setblocking(False)
+    while not stop.is_set():
+        for sock in client_socks:
+            try:
+                sock.recv(THROTTLED_CHUNK_SIZE)
+            except (BlockingIOError, OSError):
+                pass
+        time.sleep(THROTTLED_INTERVAL)
+
+
+def run(mode, n_clients, n_throttled, buffers, frame_size):
+    pairs = [socket.socketpair() for _ in range(n_clients)]
+    for server_sock, client_sock in pairs[:n_throttled]:
+        server_sock.setsockopt(
+            socket.SOL_SOCKET, socket.SO_SNDBUF, THROTTLED_BUFFER_SIZE
+        )
+        client_sock.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, THROTTLED_BUFFER_SIZE
+        )
+
+    done = threading.Event()
+    stop = threading.Event()
+    readers = [
+        threading.Thread(target=read_fast, args=(
+            [client_sock for _, client_sock in pairs[n_throttled:]],
+            frame_size, done, stop
+        )),
+        threading.Thread(target=read_throttled, args=(
+            [client_sock for _, client_sock in pairs[:n_throttled]], stop
+        )),
+    ]
+    for reader in readers:
+        reader.start()
+
+    broadcaster = Broadcaster()
+    for index, (server_sock, _) in enumerate(pairs):
+        broadcaster.add(server_sock, str(index))
+
+    start_time = time.perf_counter()
+    if mode == 'sequential':
+        for server_sock, _ in pairs:
+            send_frame(server_sock, MSG_MODEL, *buffers)
+    else:
+        broadcaster.broadcast((MSG_MODEL, buffers))
+    call_time = time.perf_counter() - start_time
+    done.wait()
+    fast_time = time.perf_counter() - start_time
+
+    stop.set()
+    for reader in readers:
+        reader.join()
+    for server_sock, client_sock in pairs:
+        broadcaster.remove(server_sock)
+        server_sock.close()
+        client_sock.close()
+
+    return call_time, fast_time
+
+
+def main():
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_throttled = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    avg = torch.zeros(FlatState(NeuralNet()).size)
+    buffers = encode_model(avg, 0)
+    frame_size = HEADER.size + sum(
+        memoryview(buffer).nbytes for buffer in buffers
+    )
+
+    print("Clients: {}, model frame: {} bytes".format(n_clients, frame_size))
+    print("{:<14}{:>11}{:>12}{:>18}".format(
+        'mode', 'throttled', 'call (ms)', 'fast clients (ms)'))
+    for throttled in (0, n_throttled):
+        for mode in ('sequential', 'broadcaster'):
+            call_time, fast_time = run(
+                mode, n_clients, throttled, buffers, frame_size
+            )
+            print("{:<14}{:>11}{:>12.1f}{:>18.1f}".format(
+                mode, throttled, call_time * 1000, fast_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Receive throughput of the framed protocol against the old recv loop.
+
+Run from the repository root:
+
+    python -m benchmarks.framing
+"""
+import pickle
+import socket
+import threading
+import time
+
+from framing import FrameReader, send_frame, MSG_UPDATE
+
+# 10 x 7*7*32 float32 for fc.weight, every float tensor of NeuralNet's
+# state_dict for the full model
+FC_BYTES = 10 * 7 * 7 * 32 * 4
+FULL_MODEL_BYTES = 29130 * 4
+
+N_MESSAGES = 200
+
+
+def recv_legacy(sock):
+    """The original receive loop: append 4 KiB chunks, retry unpickling."""
+    data_rcv = b''
+    while True:
+        try:
+            data_rcv += sock.recv(4096)
+            return pickle.loads(data_rcv)
+        except (pickle.UnpicklingError, EOFError):
+            pass
+
+
+def recv_framed(reader):
+    _, payload = reader.recv_frame()
+    return pickle.loads(payload)
+
+
+def run(size, framed):
+    """Ping-pong N_MESSAGES messages of `size` bytes, return MB/s received.
+
+    Each message is acknowledged before the next is sent, because the
+    legacy loop cannot separate two messages that arrive in one read.
+    """
+    sender, receiver = socket.socketpair()
+    message = pickle.dumps(bytes(size))
+
+    def send():
+        for _ in range(N_MESSAGES):
+            if framed:
+                send_frame(sender, MSG_UPDATE, message)
+            else:
+                sender.sendall(message)
+            sender.recv(1)
+
+    sender_thread = threading.Thread(target=send)
+    sender_thread.daemon = True
+
+    reader = FrameReader(receiver)
+    start_time = time.perf_counter()
+    sender_thread.start()
+    for _ in range(N_MESSAGES):
+        if framed:
+            recv_framed(reader)
+        else:
+            recv_legacy(receiver)
+        receiver.sendall(b'\x00')
+    elapsed = time.perf_counter() - start_time
+
+    sender_thread.join()
+    sender.close()
+    receiver.close()
+
+    return len(message) * N_MESSAGES / elapsed / 1e6
+
+
+def main():
+    sizes = [
+        ('fc.weight', FC_BYTES),
+        ('full model', FULL_MODEL_BYTES),
+        ('10x full model', 10 * FULL_MODEL_BYTES),
+    ]
+    print("{:<16}{:>12}{:>16}{:>16}".format(
+        'payload', 'bytes', 'legacy MB/s', 'framed MB/s'))
+    for name, size in sizes:
+        print("{:<16}{:>12}{:>16.1f}{:>16.1f}".format(
+            name, size, run(size, framed=False), run(size, framed=True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Aggregation throughput with logging off, on (async logger) and as before
+(str(self.sum) printed while holding the lock).
+
+Run from the repository root:
+
+    python -m benchmarks.log_overhead [<n_threads>]
+"""
+import contextlib
+import os
+import sys
+import threading
+import time
+
+import torch
+
+from params import FlatState
+from utils import DEBUG, OFF, Logger, print_msg
+from DDP.model.model import NeuralNet
+
+N_UPDATES_PER_THREAD = 200
+
+
+def run(n_threads, mode, devnull):
+    size = FlatState(NeuralNet()).size
+    total = torch.zeros(size)
+    value = torch.randn(size)
+    lock = threading.Lock()
+    logger = Logger(DEBUG if mode == 'async' else OFF, stream=devnull)
+
+    def worker():
+        for _ in range(N_UPDATES_PER_THREAD):
+            with lock:
+                total.add_(value, alpha=1)
+                if mode == 'legacy':
+                    print_msg("Current sum: " + str(total))
+            if mode == 'async':
+                logger.debug("Received update, value %s", value)
+                logger.debug("Current sum: %s", total, every=100)
+
+    threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(devnull):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.flush()
+    elapsed = time.perf_counter() - start_time
+
+    return n_threads * N_UPDATES_PER_THREAD / elapsed
+
+
+def main():
+    n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+
+    print("Threads: " + str(n_threads))
+    print("{:<34}{:>14}".format('logging', 'updates / s'))
+    with open(os.devnull, 'w') as devnull:
+        for mode, name in [
+            ('off', 'off'),
+            ('async', 'async, summaries, sampled'),
+            ('legacy', 'print(str(sum)) under lock'),
+        ]:
+            updates_per_s = run(n_threads, mode, devnull)
+            print("{:<34}{:>14.0f}".format(name, updates_per_s))
+
+
+if __name__ == '__main__':
+    main()
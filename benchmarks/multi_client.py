@@ -0,0 +1,115 @@
+"""Training throughput and memory of K clients: K processes, each training
+its own NeuralNet with SGD as client.py does, against one MultiClient
+process training all K at once (vectorized.py).
+
+The K processes run concurrently, with the CPU threads split among them,
+after loading MNIST each; the clock starts once all have loaded. Memory is
+the sum of the processes' peak RSS.
+
+Run from the repository root:
+
+    python -m benchmarks.multi_client [<K> ...]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import torch
+
+from data import load_mnist, split_shards
+from params import FlatState
+from vectorized import VectorizedTrainer
+from DDP.model.model import NeuralNet
+
+N_STEPS = 20
+BATCH_SIZE = 100
+
+
+def peak_rss_mb():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def train_alone(n_threads, barrier, results):
+    torch.set_num_threads(n_threads)
+    images, labels = load_mnist(train=True)
+    model = NeuralNet()
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), 0.0001)
+    criterion = torch.nn.CrossEntropyLoss()
+
+    barrier.wait()
+    start_time = time.perf_counter()
+    for step in range(N_STEPS):
+        batch = slice(step * BATCH_SIZE, (step + 1) * BATCH_SIZE)
+        loss = criterion(model(images[batch]), labels[batch])
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    results.put((time.perf_counter() - start_time, peak_rss_mb()))
+
+
+def train_together(n_clients, results):
+    images, labels = load_mnist(train=True)
+    shards = split_shards(
+        labels, n_clients, False, torch.Generator().manual_seed(0)
+    )
+    trainer = VectorizedTrainer(
+        images, labels, shards, N_STEPS, BATCH_SIZE, 0.0001,
+        chunk_size=64, seed=0
+    )
+    model = FlatState(NeuralNet()).snapshot()
+
+    start_time = time.perf_counter()
+    trainer.train([(client, model) for client in range(n_clients)])
+    results.put((time.perf_counter() - start_time, peak_rss_mb()))
+
+
+def run_processes(context, n_clients):
+    n_threads = max(1, (os.cpu_count() or 1) // n_clients)
+    barrier = context.Barrier(n_clients)
+    results = context.Queue()
+    processes = [
+        context.Process(target=train_alone,
+                        args=(n_threads, barrier, results))
+        for _ in range(n_clients)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return (max(elapsed for elapsed, _ in outcomes),
+            sum(rss for _, rss in outcomes))
+
+
+def run_multi_client(context, n_clients):
+    results = context.Queue()
+    process = context.Process(target=train_together,
+                              args=(n_clients, results))
+    process.start()
+    outcome = results.get()
+    process.join()
+    return outcome
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [8, 32]
+    context = multiprocessing.get_context('spawn')
+
+    print("{} SGD steps of {} samples per client".format(
+        N_STEPS, BATCH_SIZE))
+    print("{:>6}  {:<14}{:>14}{:>14}".format(
+        'K', 'mode', 'clients / s', 'peak RSS MB'))
+    for n_clients in counts:
+        for mode, run in [('processes', run_processes),
+                          ('multi-client', run_multi_client)]:
+            elapsed, rss = run(context, n_clients)
+            print("{:>6}  {:<14}{:>14.2f}{:>14.0f}".format(
+                n_clients, mode, n_clients / elapsed, rss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Versions, virtual time and network bytes to reach a target accuracy with
+each server optimizer, on the simulator.
+
+Every run uses the same seed, clients and links; only the root's step
+differs. Options after the script name go to the simulator, e.g. to change
+the target or the data split:
+
+    python -m benchmarks.server_opt [<simulator options>]
+
+The default is 100 non-IID clients under 4 edges, up to 100 versions, and
+a 95% target.
+"""
+import sys
+
+from simulator import Simulation, make_parser
+
+DEFAULTS = ['--clients', '100', '--edges', '4', '--non-iid', '--rounds',
+            '100', '--target-accuracy', '0.95']
+CONFIGS = [
+    ('none (FedAvg)', ['--server-optimizer', 'none']),
+    ('momentum, lr 1', ['--server-optimizer', 'momentum',
+                        '--server-lr', '1.0', '--server-momentum', '0.9']),
+    ('adam, lr 0.01', ['--server-optimizer', 'adam',
+                       '--server-lr', '0.01']),
+]
+
+
+def run(argv):
+    """Return (versions, virtual seconds, bytes, accuracy, reached) at
+    the first evaluation reaching the target, or at the last one if none
+    did.
+    """
+    args = make_parser().parse_args(argv)
+    simulation = Simulation(args)
+    simulation.run()
+    evaluations = simulation.evaluations
+    reached = [evaluation for evaluation in evaluations
+               if evaluation['accuracy'] >= args.target_accuracy]
+    evaluation = reached[0] if reached else evaluations[-1]
+    return (evaluation['seqnum'], evaluation['time'], evaluation['bytes'],
+            evaluation['accuracy'], bool(reached))
+
+
+def main():
+    argv = DEFAULTS + sys.argv[1:]
+    results = [(name, run(argv + options)) for name, options in CONFIGS]
+
+    print("Simulator options: " + ' '.join(argv))
+    print("{:<18}{:>10}{:>14}{:>12}{:>12}".format(
+        'server optimizer', 'versions', 'virtual s', 'MB', 'accuracy'))
+    for name, (versions, seconds, n_bytes, accuracy, reached) in results:
+        print("{:<18}{:>10}{:>14.1f}{:>12.1f}{:>12.4f}{}".format(
+            name, versions, seconds, n_bytes / 2 ** 20, accuracy,
+            '' if reached else '  (target not reached)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Simulated time-to-accuracy: synchronous rounds that drop outdated updates
+(as before) against buffered asynchronous aggregation with
+staleness-decayed weights.
+
+Clients pull the model part of the way towards their own optimum each time
+they train; a fifth of them are 5x slower. Time is virtual, in units of a
+fast client's training time, and updates go through the real accumulator,
+history and staleness policy. The error is the distance to the clients'
+mean optimum relative to its norm.
+
+Run from the repository root:
+
+    python -m benchmarks.staleness [<n_clients>] [<target_error>]
+"""
+import heapq
+import sys
+
+import torch
+
+from accumulator import ShardedAccumulator
+from history import ModelHistory
+from staleness import StalenessPolicy, accumulate_stale
+
+SIZE = 10000
+LOCAL_STEP = 0.2
+SPREAD = 0.3
+SLOW_FRACTION = 0.2
+SLOW_FACTOR = 5.0
+DEADLINE = 3.0
+MAX_TIME = 2000.0
+
+
+class Simulation:
+    def __init__(self, n_clients, policy, buffer_size):
+        torch.manual_seed(0)
+        center = torch.randn(SIZE)
+        self.optima = center + SPREAD * torch.randn(n_clients, SIZE)
+        self.optimum = self.optima.mean(0)
+        n_slow = int(n_clients * SLOW_FRACTION)
+        self.speeds = [SLOW_FACTOR] * n_slow + [1.0] * (n_clients - n_slow)
+
+        self.policy = policy
+        self.buffer_size = buffer_size
+        self.seqnum = 0
+        self.model = torch.zeros(SIZE)
+        self.history = ModelHistory(
+            self.model, self.seqnum,
+            max_versions=max(8, policy.max_staleness + 1)
+        )
+        self.accumulator = ShardedAccumulator(SIZE, self.seqnum, n_shards=1)
+        self.responded = set()
+        self.n_buffered = 0
+        self.n_dropped = 0
+
+        self.now = 0.0
+        self.events = []
+        self.generator = torch.Generator().manual_seed(1)
+
+    def error(self):
+        return float((self.model - self.optimum).norm() / self.optimum.norm())
+
+    def start_training(self, client):
+        duration = self.speeds[client] * (
+            0.5 + torch.rand((), generator=self.generator).item()
+        )
+        heapq.heappush(
+            self.events, (self.now + duration, 'done', client, self.seqnum)
+        )
+
+    def close_round(self):
+        total, total_weight = self.accumulator.reduce(
+            self.seqnum + 1, reference=self.model
+        )
+        self.seqnum += 1
+        self.model = self.history.add_model(self.seqnum, total / total_weight)
+        self.responded = set()
+        self.n_buffered = 0
+        heapq.heappush(
+            self.events, (self.now + DEADLINE, 'deadline', -1, self.seqnum)
+        )
+
+    def run(self, target_error):
+        for client in range(len(self.speeds)):
+            self.start_training(client)
+        heapq.heappush(self.events, (DEADLINE, 'deadline', -1, 0))
+
+        while self.events and self.now < MAX_TIME:
+            self.now, event, client, seqnum = heapq.heappop(self.events)
+
+            if event == 'deadline':
+                if seqnum != self.seqnum:
+                    continue
+                if self.n_buffered > 0:
+                    self.close_round()
+                else:
+                    heapq.heappush(self.events, (
+                        self.now + DEADLINE, 'deadline', -1, seqnum
+                    ))
+                continue
+
+            optimum = self.optima[client]
+            base = self.history.model(seqnum)
+            value = base + LOCAL_STEP * (optimum - base)
+            staleness = accumulate_stale(
+                self.accumulator, self.history, self.policy,
+                {'value': value, 'weight': 1, 'seqnum': seqnum},
+                self.seqnum
+            )
+            if staleness is None:
+                self.n_dropped += 1
+            else:
+                self.responded.add(client)
+                self.n_buffered += 1
+
+            if self.buffer_size > 0:
+                complete = self.n_buffered >= self.buffer_size
+            else:
+                complete = len(self.responded) == len(self.speeds)
+            if complete:
+                self.close_round()
+                if self.error() < target_error:
+                    return self.now
+
+            # Train again from the latest model
+            self.start_training(client)
+
+        return None
+
+
+def main():
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    target_error = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+
+    print("Clients: {} ({:.0%} {}x slower), target error: {}".format(
+        n_clients, SLOW_FRACTION, SLOW_FACTOR, target_error))
+    print("{:<34}{:>10}{:>10}{:>12}".format(
+        'policy', 'time', 'versions', 'dropped'))
+    buffer_size = max(1, n_clients // 5)
+    for name, policy, size in [
+        ('sync, drop outdated', StalenessPolicy(0), 0),
+        ('buffered K={}, drop outdated'.format(buffer_size),
+         StalenessPolicy(0), buffer_size),
+        ('buffered K={}, staleness <= 8'.format(buffer_size),
+         StalenessPolicy(8), buffer_size),
+    ]:
+        simulation = Simulation(n_clients, policy, size)
+        elapsed = simulation.run(target_error)
+        print("{:<34}{:>10}{:>10}{:>12}".format(
+            name,
+            'n/a' if elapsed is None else '{:.1f}'.format(elapsed),
+            simulation.seqnum, simulation.n_dropped))
+
+
+if __name__ == '__main__':
+    main()
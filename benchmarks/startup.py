@@ -0,0 +1,115 @@
+"""Startup time and memory of each role.
+
+Starts each role as a subprocess, as it would be run, and times it until
+it is ready: until its port accepts connections for the server and edges,
+and until it connects for the client. The upper server of the edges and
+the edge of the client are plain listening sockets of this process. The
+resident set size is read from /proc once ready (Linux only).
+
+Run from the repository root:
+
+    python -m benchmarks.startup [<n_runs>]
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT = 120.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def listener():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    return sock
+
+
+def rss_mb(pid):
+    with open('/proc/{}/status'.format(pid)) as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def wait_for_port(port, process):
+    while process.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError("Exited with code " + str(process.returncode))
+
+
+def wait_for_connection(sock, process):
+    sock.settimeout(0.1)
+    while process.poll() is None:
+        try:
+            conn, _ = sock.accept()
+            conn.close()
+            return
+        except socket.timeout:
+            pass
+    raise RuntimeError("Exited with code " + str(process.returncode))
+
+
+def start(role):
+    """Start a role and wait until it is ready. Return (seconds, RSS MB)."""
+    port = free_port()
+    upstream = listener()
+    upper_port = upstream.getsockname()[1]
+    commands = {
+        'server': ['server.py', str(port)],
+        'server, --train-weight': ['server.py', str(port),
+                                   '--train-weight', '1'],
+        'edge': ['edge_server.py', '127.0.0.1', str(upper_port), str(port)],
+        'edge, asyncio': ['edge_server.py', '127.0.0.1', str(upper_port),
+                          str(port), '--mode', 'asyncio'],
+        'client': ['client.py', '127.0.0.1', str(upper_port)],
+    }
+
+    env = dict(os.environ, LOG_LEVEL='OFF')
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable] + commands[role], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if role == 'client':
+            wait_for_connection(upstream, process)
+        else:
+            wait_for_port(port, process)
+        elapsed = time.perf_counter() - start_time
+        return elapsed, rss_mb(process.pid)
+    finally:
+        process.kill()
+        process.wait()
+        upstream.close()
+
+
+def main():
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print("Median of {} runs".format(n_runs))
+    print("{:<26}{:>12}{:>12}".format('role', 'startup s', 'RSS MB'))
+    for role in ['server', 'server, --train-weight', 'edge',
+                 'edge, asyncio', 'client']:
+        runs = [start(role) for _ in range(n_runs)]
+        print("{:<26}{:>12.2f}{:>12.0f}".format(
+            role,
+            statistics.median(elapsed for elapsed, _ in runs),
+            statistics.median(rss for _, rss in runs)))
+
+
+if __name__ == '__main__':
+    main()
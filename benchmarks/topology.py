@@ -0,0 +1,410 @@
+"""End-to-end load test of the whole topology on localhost: a server, M
+edge servers and N synthetic clients.
+
+The server and edges are the real scripts, each in its own process.
+Synthetic clients skip MNIST and training: they answer every model with
+a random update shaped like NeuralNet's state after a think time
+(exponentially distributed with mean `--think-time`), and run on asyncio
+loops in `--client-processes` processes. Round times are the gaps between
+the first arrivals of consecutive model versions at any client; ingest
+rates come from the nodes' metrics endpoints; CPU and RSS per tier are
+read from /proc (Linux only).
+
+Run from the repository root:
+
+    python -m benchmarks.topology --edges 4 --clients 1000 --duration 30 \\
+        --output topology.json [--baseline previous.json]
+
+Extra options for the nodes go through `--server-args` and `--edge-args`,
+e.g. `--edge-args="--compression topk-int8"`. Several thousand clients
+need a higher open-file limit than the default on some systems; the soft
+limit is raised to the hard one.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import torch
+
+from codec import encode_ack, encode_hello, encode_update, decode_model
+from compression import decode_model_delta
+from framing import (
+    FrameReader, send_frame_async, MSG_ACK, MSG_HELLO, MSG_MODEL,
+    MSG_MODEL_DELTA, MSG_UPDATE
+)
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONNECT_SLOTS = 64
+START_TIMEOUT = 60.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=START_TIMEOUT):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1.0):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Nothing listening on port " + str(port))
+
+
+def raise_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def process_usage(pid):
+    """Return (CPU seconds, RSS in bytes) of a process, or None off
+    Linux.
+    """
+    try:
+        with open('/proc/' + str(pid) + '/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+        with open('/proc/' + str(pid) + '/status') as status:
+            rss = next(
+                int(line.split()[1]) * 1024
+                for line in status if line.startswith('VmRSS:')
+            )
+    except (OSError, StopIteration):
+        return None
+
+    # utime and stime, fields 14 and 15 of stat
+    ticks = int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf('SC_CLK_TCK'), rss
+
+
+def scrape(port):
+    """Return {(name, labels): value} from a node's metrics endpoint."""
+    url = 'http://127.0.0.1:' + str(port) + '/metrics'
+    samples = {}
+    with urllib.request.urlopen(url, timeout=5.0) as response:
+        for line in response.read().decode('utf-8').splitlines():
+            if not line or line.startswith('#'):
+                continue
+            key, value = line.rsplit(' ', 1)
+            name, _, labels = key.partition('{')
+            samples[(name, labels.rstrip('}'))] = float(value)
+    return samples
+
+
+def accepted_updates(samples):
+    return samples.get(('fl_updates_total', 'outcome="accepted"'), 0.0)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(round(fraction * len(values))) - 1)]
+
+
+async def synthetic_client(loop, port, client_id, value, size, think_time,
+                           connect_slots, stats):
+    """Answer every model from the edge with `value` as an update."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    send_lock = asyncio.Lock()
+
+    async def send(msg_type, *buffers):
+        # The reply task and the reader both send
+        async with send_lock:
+            await send_frame_async(loop, sock, msg_type, *buffers)
+
+    async def reply(seqnum):
+        if think_time > 0:
+            await asyncio.sleep(random.expovariate(1.0 / think_time))
+        await send(MSG_UPDATE, *encode_update(value, 1, seqnum))
+        stats['updates'] += 1
+
+    async with connect_slots:
+        await loop.sock_connect(sock, ('127.0.0.1', port))
+        await send(MSG_HELLO, *encode_hello(client_id, -1))
+    stats['connected'] += 1
+
+    reader = FrameReader(sock)
+    pending = None
+    try:
+        while True:
+            msg_type, payload = await reader.recv_frame_async(loop)
+            if msg_type == MSG_MODEL:
+                seqnum = decode_model(payload)['seqnum']
+            elif msg_type == MSG_MODEL_DELTA:
+                seqnum = decode_model_delta(payload, size)['seqnum']
+            else:
+                continue
+
+            stats['arrivals'].setdefault(seqnum, time.time())
+            await send(MSG_ACK, *encode_ack(seqnum))
+            if seqnum < 0:
+                # The edge has not heard from the server yet
+                continue
+
+            # Only the latest model is answered
+            if pending is not None:
+                pending.cancel()
+            pending = loop.create_task(reply(seqnum))
+    except (OSError, asyncio.CancelledError):
+        pass
+    finally:
+        if pending is not None:
+            pending.cancel()
+        sock.close()
+
+
+async def run_clients_async(index, edge_ports, n_clients, size, think_time,
+                            n_connected, stop, results):
+    loop = asyncio.get_running_loop()
+    torch.manual_seed(index)
+    value = torch.randn(size)
+    stats = {'connected': 0, 'updates': 0, 'arrivals': {}}
+    connect_slots = asyncio.Semaphore(CONNECT_SLOTS)
+
+    tasks = [
+        loop.create_task(synthetic_client(
+            loop, edge_ports[client % len(edge_ports)],
+            'synthetic-{}-{}'.format(index, client), value, size,
+            think_time, connect_slots, stats
+        ))
+        for client in range(n_clients)
+    ]
+
+    reported = 0
+    while not stop.is_set():
+        await asyncio.sleep(0.1)
+        with n_connected.get_lock():
+            n_connected.value += stats['connected'] - reported
+        reported = stats['connected']
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    results.put((stats['updates'], stats['arrivals']))
+
+
+def run_clients(*args):
+    raise_file_limit()
+    asyncio.run(run_clients_async(*args))
+
+
+def run(args):
+    raise_file_limit()
+    size = FlatState(NeuralNet()).size
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    context = multiprocessing.get_context('spawn')
+
+    server_port = free_port()
+    server_metrics_port = free_port()
+    edge_ports = [free_port() for _ in range(args.edges)]
+    edge_metrics_ports = [free_port() for _ in range(args.edges)]
+
+    nodes = []
+    client_processes = []
+    try:
+        server = subprocess.Popen(
+            [sys.executable, 'server.py', str(server_port),
+             '--metrics-port', str(server_metrics_port)]
+            + shlex.split(args.server_args),
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL
+        )
+        nodes.append(server)
+        wait_for_port(server_port)
+
+        edges = []
+        for port, metrics_port in zip(edge_ports, edge_metrics_ports):
+            edges.append(subprocess.Popen(
+                [sys.executable, 'edge_server.py',
+                 '127.0.0.1', str(server_port), str(port),
+                 '--mode', args.edge_mode,
+                 '--metrics-port', str(metrics_port)]
+                + shlex.split(args.edge_args),
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL
+            ))
+        nodes.extend(edges)
+        for port in edge_ports:
+            wait_for_port(port)
+
+        n_connected = context.Value('i', 0)
+        stop = context.Event()
+        results = context.Queue()
+        n_processes = min(args.client_processes, args.clients)
+        for index in range(n_processes):
+            n_clients = (args.clients + index) // n_processes
+            process = context.Process(target=run_clients, args=(
+                index, edge_ports, n_clients, size, args.think_time,
+                n_connected, stop, results
+            ))
+            process.start()
+            client_processes.append(process)
+
+        deadline = time.time() + START_TIMEOUT
+        while n_connected.value < args.clients:
+            if time.time() > deadline:
+                raise RuntimeError("Only {} of {} clients connected".format(
+                    n_connected.value, args.clients))
+            time.sleep(0.1)
+        time.sleep(args.warmup)
+
+        def usage():
+            return {
+                'server': [process_usage(server.pid)],
+                'edges': [process_usage(edge.pid) for edge in edges],
+                'clients': [
+                    process_usage(process.pid)
+                    for process in client_processes
+                ],
+            }
+
+        start_usage = usage()
+        start_server = scrape(server_metrics_port)
+        start_edges = [scrape(port) for port in edge_metrics_ports]
+        start_time = time.time()
+        time.sleep(args.duration)
+        end_time = time.time()
+        end_usage = usage()
+        end_server = scrape(server_metrics_port)
+        end_edges = [scrape(port) for port in edge_metrics_ports]
+
+        stop.set()
+        n_updates = 0
+        arrivals = {}
+        for _ in client_processes:
+            process_updates, process_arrivals = results.get()
+            n_updates += process_updates
+            for seqnum, arrival in process_arrivals.items():
+                arrivals[seqnum] = min(arrivals.get(seqnum, arrival), arrival)
+    finally:
+        for process in client_processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+        for node in nodes:
+            node.terminate()
+            node.wait()
+
+    elapsed = end_time - start_time
+    times = sorted(
+        arrival for seqnum, arrival in arrivals.items()
+        if seqnum >= 0 and start_time <= arrival <= end_time
+    )
+    round_times = [later - earlier for earlier, later in zip(times, times[1:])]
+
+    tiers = {}
+    for tier in ('server', 'edges', 'clients'):
+        pairs = [
+            (start, end)
+            for start, end in zip(start_usage[tier], end_usage[tier])
+            if start is not None and end is not None
+        ]
+        if not pairs:
+            tiers[tier] = None
+            continue
+        tiers[tier] = {
+            'processes': len(pairs),
+            'cpu_percent': 100.0 * sum(
+                end[0] - start[0] for start, end in pairs
+            ) / elapsed,
+            'rss_mb': sum(end[1] for _, end in pairs) / 2**20,
+        }
+
+    return {
+        'config': vars(args),
+        'duration_s': elapsed,
+        'rounds': len(times),
+        'rounds_per_s': len(times) / elapsed,
+        'round_p50_s': percentile(round_times, 0.5),
+        'round_p99_s': percentile(round_times, 0.99),
+        'client_updates_per_s': n_updates / elapsed,
+        'edge_ingest_per_s': sum(
+            accepted_updates(end) - accepted_updates(start)
+            for start, end in zip(start_edges, end_edges)
+        ) / elapsed,
+        'server_ingest_per_s': (
+            accepted_updates(end_server) - accepted_updates(start_server)
+        ) / elapsed,
+        'tiers': tiers,
+    }
+
+
+def flatten(result, prefix=''):
+    """Yield (key, number) for every number of a result, nested keys
+    joined with dots.
+    """
+    for key, value in result.items():
+        if key == 'config':
+            continue
+        if isinstance(value, dict):
+            yield from flatten(value, prefix + key + '.')
+        elif isinstance(value, (int, float)):
+            yield prefix + key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--edges', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--client-processes', type=int, default=4)
+    parser.add_argument(
+        '--think-time', type=float, default=0.1,
+        help="mean seconds between a model and the client's update"
+    )
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument(
+        '--warmup', type=float, default=5.0,
+        help="seconds between the last connection and the measurement"
+    )
+    parser.add_argument(
+        '--edge-mode', choices=['thread', 'asyncio'], default='thread'
+    )
+    parser.add_argument('--server-args', default='')
+    parser.add_argument('--edge-args', default='')
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument(
+        '--baseline', help="JSON results to compare against"
+    )
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    result = run(args)
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = dict(flatten(json.load(file)))
+
+    print("Edges: {}, clients: {}, duration: {:.0f} s".format(
+        args.edges, args.clients, result['duration_s']))
+    for key, value in flatten(result):
+        line = '{:<28}{:>12.4g}'.format(key, value)
+        if baseline.get(key):
+            line += '{:>+10.1%}'.format(value / baseline[key] - 1)
+        print(line)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
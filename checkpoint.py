@@ -0,0 +1,98 @@
+import os
+import threading
+
+import codec
+from framing import ProtocolError
+from utils import logger
+
+# File format: MAGIC, then an `encode_tensors` payload (codec.py) whose
+# seqnum is the model version and whose tensors are the flat model and,
+# for nodes compressing their updates, the error-feedback residual.
+# Nothing is unpickled on load.
+MAGIC = b'FLCKPT01'
+
+
+def save_checkpoint(path, seqnum, tensors):
+    """Write a checkpoint, replacing `path` atomically: a crash leaves the
+    previous checkpoint or the new one, never a partial file.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(MAGIC)
+        for buffer in codec.encode_tensors(seqnum, 0.0, tensors):
+            file.write(buffer)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path):
+    """Return (seqnum, tensors) saved at `path`, or None if there is no
+    checkpoint. The tensors own their memory.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as file:
+        data = bytearray(file.read())
+    if data[:len(MAGIC)] != MAGIC:
+        raise ProtocolError("Not a checkpoint: " + path)
+
+    seqnum, _, tensors = codec.decode_tensors(
+        memoryview(data)[len(MAGIC):]
+    )
+    return seqnum, [tensor.clone() for tensor in tensors]
+
+
+class Checkpointer:
+    """Save checkpoints from a background thread.
+
+    `submit` only hands the version and its tensors over, so the round loop
+    never waits for the disk; the tensors must not be modified afterwards.
+    Versions submitted while one is being written replace each other: only
+    the latest is written next.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_seqnum = None
+
+        self._pending = None
+        self._writing = False
+        self._condition = threading.Condition()
+
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, seqnum, tensors):
+        with self._condition:
+            self._pending = (seqnum, tensors)
+            self._condition.notify_all()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                seqnum, tensors = self._pending
+                self._pending = None
+                self._writing = True
+
+            try:
+                save_checkpoint(self.path, seqnum, tensors)
+                self.last_seqnum = seqnum
+                logger.debug("Checkpointed model %d", seqnum)
+            except OSError as e:
+                logger.warning("Checkpoint of model %d failed: %s",
+                               seqnum, e)
+
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def flush(self):
+        """Wait until everything submitted is written."""
+        with self._condition:
+            while self._pending is not None or self._writing:
+                self._condition.wait()
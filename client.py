@@ -1,51 +1,80 @@
-import sys
-import socket
-import pickle
+import argparse
 import threading
 import time
+import uuid
 import torch
-import torchvision
 
-from utils import print_msg
+from utils import logger, print_msg
+from codec import encode_ack, decode_model
+from compression import (
+    SCHEMES, Compressor, apply_delta, decode_model_delta
+)
+import metrics
+from connection import UpstreamConnection
+from data import BatchLoader, load_mnist, shard_indices
+from framing import MSG_ACK, MSG_MODEL_DELTA
+from metrics import registry
+from params import FlatState
+import telemetry
+from telemetry import TelemetryExporter
 from DDP.model.model import NeuralNet
 
-# import requests
-# from firebase import firebase
-# firebase = firebase.FirebaseApplication(
-#     "https://cnextra-f152b-default-rtdb.firebaseio.com/", None)
-# # # ---------------------------------------------
-# url = "http://localhost:9000/log/create"
+MODEL_DECODE_SECONDS = registry.histogram(
+    'fl_decode_seconds', "Time to decode a received message",
+    message='model'
+)
+TRAIN_SECONDS = registry.histogram(
+    'fl_train_seconds', "Time to train on one model"
+)
+REPLY_SECONDS = registry.histogram(
+    'fl_upper_reply_seconds',
+    "Time from sending an update upstream to the next model"
+)
 
 
 class Client:
+    # Tenants whose updates share the connection (see multi_client.py)
+    n_tenants = 0
+
     def __init__(
         self,
         server_ip,
-        server_port
+        server_port,
+        compression='none',
+        topk_ratio=0.01,
+        client_id=None,
+        shard=0,
+        n_shards=1,
+        non_iid=False,
+        telemetry_url=None
     ):
         self.server_ip = server_ip
         self.server_port = server_port
         self.server = None
+        # Our session at the edge, kept across reconnections
+        self.client_id = client_id or uuid.uuid4().hex
+        # Part of the training set this client trains on
+        self.shard = shard
+        self.n_shards = n_shards
+        self.non_iid = non_iid
 
         self.model = NeuralNet()
+        self.state = FlatState(self.model)
+        self.set_up_training()
 
-        # attribute for train method only
-        self.optimizer = torch.optim.SGD(self.model.parameters(), 0.0001)
-        self.criterion = torch.nn.CrossEntropyLoss()
-        self.ds = torchvision.datasets.MNIST(
-            root='./data',
-            transform=torchvision.transforms.ToTensor()
-        )
-        self.dl = torch.utils.data.DataLoader(
-            dataset=self.ds,
-            batch_size=100,
-            shuffle=False
-        )
+        # Losses go to the backend in batches, off the training loop
+        self.telemetry = None
+        if telemetry_url is not None:
+            self.telemetry = TelemetryExporter(telemetry_url)
 
-        self.server_avg = torch.zeros(self.model.fc.weight.shape)
+        # Last model received. Replaced, never modified in place: updates
+        # are compressed against the model they were trained from.
+        self.server_avg = torch.zeros(self.state.size)
         self.seqnum = -1
+        self.compressor = Compressor(compression, topk_ratio)
 
         self._key_lock = threading.Lock()
+        self._model_received = threading.Condition(self._key_lock)
 
         self.set_up()
 
@@ -58,58 +87,86 @@ class Client:
 
     def wait_for_server(self):
         """Receive new avg and update accordingly."""
-        while True:
+        # Reconnects and resumes our session as needed
+        for msg_type, payload in self.server.frames():
             # Receive input parameter from server
-            data_rcv = b''
-            while True:
-                try:
-                    data_rcv += self.server.recv(4096)
-                    self.latency = time.time() - self.startSendTime
-                    data_rcv = pickle.loads(data_rcv)
-                    break
-                except pickle.UnpicklingError:
-                    pass
-
-            print_msg("Received from server: " + str(data_rcv))
-            print_msg("Reply from ip:"
-                      + str(self.server_ip)
-                      + " port: "
-                      + str(self.server_port)
-                      + " : time="
-                      + str(int(self.latency*1000))
-                      + " ms")
-            print_msg("------------------------------------")
+            self.latency = time.time() - self.startSendTime
+            with MODEL_DECODE_SECONDS.time():
+                data_rcv = self.receive_model(msg_type, payload)
+            if data_rcv is None:
+                # Steps will be sent from the version we have
+                self.ack(self.seqnum)
+                continue
+
+            REPLY_SECONDS.observe(self.latency)
+            logger.info("Received model %d from server %s:%s: time=%d ms",
+                        data_rcv['seqnum'], self.server_ip,
+                        self.server_port, int(self.latency*1000))
+            logger.debug("Model %d: %s", data_rcv['seqnum'],
+                         data_rcv['avg'])
 
             with self._key_lock:
-                self.server_avg = data_rcv['avg'].data.clone()
+                self.server_avg = data_rcv['avg']
                 self.seqnum = data_rcv['seqnum']
+                self._model_received.notify()
+            self.ack(data_rcv['seqnum'])
+
+    def receive_model(self, msg_type, payload):
+        """Decode a model, sent whole or as a step from the current one.
+
+        Return {'avg', 'seqnum'}, with a model that no longer shares memory
+        with the payload, or None if the step does not start from the
+        current model.
+        """
+        if msg_type == MSG_MODEL_DELTA:
+            step = decode_model_delta(payload, self.state.size)
+            if step['base'] != self.seqnum:
+                return None
+
+            model = self.server_avg.clone()
+            apply_delta(model, step['kind'], step['tensors'])
+            return {'avg': model, 'seqnum': step['seqnum']}
+
+        data_rcv = decode_model(payload)
+        return {'avg': data_rcv['avg'].clone(), 'seqnum': data_rcv['seqnum']}
+
+    def ack(self, seqnum):
+        """Tell the server which model we hold."""
+        self.server.send(MSG_ACK, *encode_ack(seqnum))
 
     def send_to_server(self, data):
-        """Send pickled data to server."""
-        print_msg("Sent data: " + str(data))
+        """Send trained update to server."""
+        logger.debug("Sent data: seqnum %d, weight %s, value %s",
+                     data['seqnum'], data['weight'], data['value'])
+        msg_type, buffers = self.compressor.encode(
+            data['value'], data['reference'], data['weight'], data['seqnum']
+        )
         self.startSendTime = time.time()
-        self.server.sendall(pickle.dumps(data))
-        print_msg("------------------------------------")
+        if not self.server.send(msg_type, *buffers):
+            logger.warning("Server unreachable, update for model %d "
+                           "dropped", data['seqnum'])
 
     def train(self):
         with self._key_lock:
             old_seqnum = self.seqnum
 
         while True:
-            if old_seqnum == self.seqnum:
-                time.sleep(0.1)
-                continue
-
-            with self._key_lock:
-                self.model.fc.weight.data = self.server_avg.data.clone()
+            with self._model_received:
+                # Wake up as soon as a new model arrives
+                while old_seqnum == self.seqnum:
+                    self._model_received.wait()
+
+                reference = self.server_avg
+                old_seqnum = self.seqnum
+                self.state.load(reference)
                 self.model.train()
 
             train_loss = 0.0
+            n_batches = 0
             timeStartTrain = time.time()
-            timeTrain = 0
+            # At most 101 batches; a shard may hold fewer
             for i, (data, target) in enumerate(self.dl):
                 if i > 100:
-                    timeTrain = time.time() - timeStartTrain
                     break
 
                 with self._key_lock:
@@ -119,33 +176,50 @@ class Client:
                     loss.backward()
                     self.optimizer.step()
 
-                    train_loss += loss.item() / 100
+                    loss_value = loss.item()
+                    train_loss += loss_value
+                    n_batches += 1
 
-                myobj = {'data': loss.item()}
-                x = requests.post(url, data=myobj)
+                if self.telemetry is not None:
+                    self.telemetry.record(loss_value)
 
-            print_msg("Current loss value: " + str(train_loss))
-            print_msg("Training time: " + '{:.2f}'.format(timeTrain) + ' s')
-            print_msg("------------------------------------")
+            timeTrain = time.time() - timeStartTrain
+            train_loss /= max(n_batches, 1)
+            TRAIN_SECONDS.observe(timeTrain)
+            logger.info("Current loss value: %s", train_loss)
+            logger.info("Training time: %.2f s", timeTrain)
 
-            # Send avg to server
+            # Send avg to server, for the round it was trained in
             self.send_to_server({
-                'value': self.model.fc.weight.data.clone(),
+                'value': self.state.snapshot(),
                 'weight': 1,
-                'seqnum': self.seqnum
+                'seqnum': old_seqnum,
+                'reference': reference
             })
 
-            old_seqnum = self.seqnum
+    def set_up_training(self):
+        """Set up the attributes of the train method."""
+        self.optimizer = torch.optim.SGD(self.model.parameters(), 0.0001)
+        self.criterion = torch.nn.CrossEntropyLoss()
+        images, labels = load_mnist()
+        self.dl = BatchLoader(
+            images, labels, batch_size=100,
+            indices=shard_indices(
+                labels, self.shard, self.n_shards, self.non_iid
+            )
+        )
 
     def set_up(self):
-        """Set up connection with server"""
+        """Set up connection with server, waiting for it if need be"""
         print_msg("Creating connection to server")
 
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server = UpstreamConnection(
+            self.server_ip, self.server_port, self.client_id,
+            lambda: self.seqnum, n_tenants=self.n_tenants
+        )
         self.startSendTime = time.time()
-        self.server.connect((self.server_ip, self.server_port))
+        self.server.connect()
 
-        print_msg("Connection established")
         print_msg("------------------------------------")
 
     def run(self):
@@ -162,38 +236,56 @@ class Client:
         """Properly shut down client."""
         print_msg("Shutting down socket in client")
 
-        data_to_send = pickle.dumps('close')
-        self.server.sendall(data_to_send)
-
-        self.server.shutdown(socket.SHUT_RDWR)
         self.server.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
 
 
 def main():
-    # This is extended to allow default server socket
-    supposed_sys_argv = {
-        'client.py': None,
-        '<server_ip>': 'localhost',
-        '<server_port>': 4001
-    }
-
-    try:
-        # Parsing command line arguments
-        _, server_ip, server_port = sys.argv
-        server_port = int(server_port)
-    except ValueError:
-        if len(sys.argv) > len(supposed_sys_argv):
-            # Falling back to default values not possible
-            # Print out usage syntax
-            help_text = "[Usage: " + " ".join(supposed_sys_argv) + "\n"
-            print(help_text)
-            return
-
-        # Defaulting
-        server_ip = supposed_sys_argv['<server_ip>']
-        server_port = supposed_sys_argv['<server_port>']
-
-    client = Client(server_ip, server_port)
+    parser = argparse.ArgumentParser(description="Client")
+    parser.add_argument('server_ip', nargs='?', default='localhost')
+    parser.add_argument('server_port', nargs='?', type=int, default=4001)
+    parser.add_argument(
+        '--compression', choices=SCHEMES, default='none',
+        help="how updates are sent to the edge server (default: none, the "
+             "whole model)"
+    )
+    parser.add_argument(
+        '--topk-ratio', type=float, default=0.01,
+        help="fraction of the delta sent by the topk schemes "
+             "(default: 0.01)"
+    )
+    parser.add_argument(
+        '--client-id',
+        help="session ID at the edge server, kept across reconnections "
+             "(default: random)"
+    )
+    parser.add_argument(
+        '--shard', type=int, default=0,
+        help="train on this shard of the training set (default: 0)"
+    )
+    parser.add_argument(
+        '--shards', type=int, default=1,
+        help="number of shards the training set is split into, the same "
+             "for every client (default: 1, all of it)"
+    )
+    parser.add_argument(
+        '--non-iid', action='store_true',
+        help="split by label, two runs of label-sorted data per shard, "
+             "instead of at random"
+    )
+    metrics.add_arguments(parser)
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+
+    metrics.start(args)
+
+    client = Client(
+        args.server_ip, args.server_port,
+        compression=args.compression, topk_ratio=args.topk_ratio,
+        client_id=args.client_id, shard=args.shard, n_shards=args.shards,
+        non_iid=args.non_iid, telemetry_url=args.telemetry_url
+    )
     client.run()
 
 
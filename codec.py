@@ -0,0 +1,212 @@
+import struct
+
+import torch
+
+from framing import ProtocolError, MSG_TENANT
+
+# Payload of every frame type but MSG_CLOSE and MSG_TENANT:
+#
+#   seqnum (q) | weight (d) | number of tensors (I)
+#   per tensor: dtype code (B) | ndim (B) | dims (ndim x I)
+#   zero padding up to a multiple of 8 bytes
+#   per tensor: raw contiguous data, padded up to a multiple of 8 bytes
+#
+# Tensor data is sent in the host's native (little-endian) byte order and
+# decoded with torch.frombuffer straight out of the receive buffer, so nothing
+# is ever unpickled. The tensors carried by delta frames are described in
+# compression.py.
+#
+# A MSG_TENANT frame wraps an update frame sent on behalf of one tenant of
+# a multi-client (see multi_client.py):
+#
+#   tenant (I) | wrapped message type (B) | zero padding up to 8 bytes
+#   the wrapped frame's payload
+MESSAGE_HEADER = struct.Struct('<qdI')
+TENSOR_HEADER = struct.Struct('<BB')
+TENANT_HEADER = struct.Struct('<IB3x')
+ALIGNMENT = 8
+MAX_TENSORS = 64
+MAX_DIMS = 8
+MAX_CLIENT_ID_SIZE = 256
+MAX_TENANTS = 1 << 16
+
+DTYPES = [
+    torch.float32,
+    torch.float16,
+    torch.int8,
+    torch.uint8,
+    torch.int32,
+    torch.int64,
+]
+DTYPE_CODES = {dtype: code for code, dtype in enumerate(DTYPES)}
+
+_PADDING = bytes(ALIGNMENT)
+
+
+def _padding(n_bytes):
+    return -n_bytes % ALIGNMENT
+
+
+def encode_tensors(seqnum, weight, tensors):
+    """Encode the tensors into a list of buffers for `send_frame`.
+
+    The data buffers are views of the tensors' memory, not copies.
+    """
+    header = bytearray(MESSAGE_HEADER.pack(seqnum, weight, len(tensors)))
+    data = []
+    for tensor in tensors:
+        tensor = tensor.detach().contiguous()
+        header += TENSOR_HEADER.pack(DTYPE_CODES[tensor.dtype], tensor.dim())
+        header += struct.pack('<%dI' % tensor.dim(), *tensor.shape)
+
+        if tensor.numel() > 0:
+            view = memoryview(tensor.reshape(-1).view(torch.uint8).numpy())
+            data.append(view)
+            data.append(_PADDING[:_padding(view.nbytes)])
+    header += _PADDING[:_padding(len(header))]
+
+    return [header] + data
+
+
+def decode_tensors(payload):
+    """Decode a payload produced by `encode_tensors`.
+
+    Return (seqnum, weight, tensors). The tensors share memory with the
+    payload, so they must be consumed or copied before the buffer is reused.
+    """
+    try:
+        seqnum, weight, n_tensors = MESSAGE_HEADER.unpack_from(payload)
+        if n_tensors > MAX_TENSORS:
+            raise ProtocolError("Too many tensors: " + str(n_tensors))
+
+        offset = MESSAGE_HEADER.size
+        specs = []
+        for _ in range(n_tensors):
+            dtype_code, ndim = TENSOR_HEADER.unpack_from(payload, offset)
+            offset += TENSOR_HEADER.size
+            if dtype_code >= len(DTYPES) or ndim > MAX_DIMS:
+                raise ProtocolError("Bad tensor header")
+
+            shape = struct.unpack_from('<%dI' % ndim, payload, offset)
+            offset += 4 * ndim
+            specs.append((DTYPES[dtype_code], shape))
+        offset += _padding(offset)
+    except struct.error as e:
+        raise ProtocolError("Truncated message header") from e
+
+    tensors = []
+    for dtype, shape in specs:
+        numel = 1
+        for dim in shape:
+            numel *= dim
+        n_bytes = numel * torch.empty((), dtype=dtype).element_size()
+
+        if offset + n_bytes > len(payload):
+            raise ProtocolError("Truncated tensor data")
+
+        if numel == 0:
+            tensors.append(torch.empty(shape, dtype=dtype))
+        else:
+            tensor = torch.frombuffer(
+                payload, dtype=dtype, count=numel, offset=offset
+            )
+            tensors.append(tensor.view(shape))
+        offset += n_bytes + _padding(n_bytes)
+
+    return seqnum, weight, tensors
+
+
+def encode_model(avg, seqnum):
+    """Encode a model broadcast (MSG_MODEL)."""
+    return encode_tensors(seqnum, 0.0, [avg])
+
+
+def decode_model(payload):
+    seqnum, _, tensors = decode_tensors(payload)
+    if len(tensors) != 1:
+        raise ProtocolError("Model message must hold one tensor")
+
+    return {'avg': tensors[0], 'seqnum': seqnum}
+
+
+def encode_update(value, weight, seqnum):
+    """Encode a weighted update sent upstream (MSG_UPDATE)."""
+    return encode_tensors(seqnum, weight, [value])
+
+
+def decode_update(payload):
+    seqnum, weight, tensors = decode_tensors(payload)
+    if len(tensors) != 1:
+        raise ProtocolError("Update message must hold one tensor")
+
+    return {'value': tensors[0], 'weight': weight, 'seqnum': seqnum}
+
+
+def encode_ack(seqnum):
+    """Encode the acknowledgement of model `seqnum` (MSG_ACK)."""
+    return encode_tensors(seqnum, 0.0, [])
+
+
+def decode_ack(payload):
+    seqnum, _, tensors = decode_tensors(payload)
+    if tensors:
+        raise ProtocolError("Ack message must hold no tensors")
+
+    return seqnum
+
+
+def encode_hello(client_id, seqnum, n_tenants=0):
+    """Encode the first frame of a connection (MSG_HELLO): the client ID its
+    session is kept under, the model version it already holds and, in the
+    weight field, the number of tenants that send updates over it (0 for a
+    plain client).
+    """
+    client_id = bytearray(client_id.encode('utf-8'))
+    if not 0 < len(client_id) <= MAX_CLIENT_ID_SIZE:
+        raise ValueError("Client ID must be 1 to %d bytes of UTF-8"
+                         % MAX_CLIENT_ID_SIZE)
+    if not 0 <= n_tenants <= MAX_TENANTS:
+        raise ValueError("At most %d tenants per connection" % MAX_TENANTS)
+
+    return encode_tensors(
+        seqnum, float(n_tenants),
+        [torch.frombuffer(client_id, dtype=torch.uint8)]
+    )
+
+
+def decode_hello(payload):
+    """Return (client_id, seqnum, n_tenants) from a MSG_HELLO payload."""
+    seqnum, n_tenants, tensors = decode_tensors(payload)
+    if (len(tensors) != 1 or tensors[0].dtype != torch.uint8
+            or tensors[0].dim() != 1
+            or not 0 < tensors[0].numel() <= MAX_CLIENT_ID_SIZE):
+        raise ProtocolError("Hello message must hold one client ID")
+    if not (0 <= n_tenants <= MAX_TENANTS and n_tenants == int(n_tenants)):
+        raise ProtocolError("Bad tenant count: " + str(n_tenants))
+
+    try:
+        client_id = bytes(tensors[0].numpy()).decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise ProtocolError("Client ID is not UTF-8") from e
+
+    return client_id, seqnum, int(n_tenants)
+
+
+def encode_tenant(tenant, msg_type, buffers):
+    """Wrap the frame (`msg_type`, `buffers`) as sent by `tenant`.
+
+    Return (MSG_TENANT, buffers).
+    """
+    return MSG_TENANT, [TENANT_HEADER.pack(tenant, msg_type)] + buffers
+
+
+def decode_tenant(payload):
+    """Return (tenant, msg_type, payload) of the frame a MSG_TENANT payload
+    wraps. The wrapped payload is a view of `payload`.
+    """
+    try:
+        tenant, msg_type = TENANT_HEADER.unpack_from(payload)
+    except struct.error as e:
+        raise ProtocolError("Truncated tenant header") from e
+
+    return tenant, msg_type, memoryview(payload)[TENANT_HEADER.size:]
@@ -0,0 +1,292 @@
+import math
+
+import torch
+
+import codec
+from framing import (
+    ProtocolError, MSG_UPDATE, MSG_DELTA, MSG_SPARSE_DELTA, MSG_TENANT
+)
+
+# Tensors carried by each update frame (all 1-D, `size` = model size):
+#
+#   MSG_UPDATE        value (float32, size)
+#   MSG_DELTA         delta (size) [, scale]
+#   MSG_SPARSE_DELTA  indices (int32, k) | values (k) [, scale]
+#
+# Deltas are taken against the model the sender received for the update's
+# seqnum. Delta and sparse values are float32, float16 or int8; int8 values
+# are followed by a float32 scale of shape (1,), and mean `values * scale`.
+#
+# MSG_MODEL_DELTA frames (broadcasts) carry the step from one model version
+# to the next: an int64 tensor (base seqnum, kind), then the tensors of a
+# MSG_DELTA or MSG_SPARSE_DELTA kind.
+SCHEMES = ['none', 'fp16', 'int8', 'topk', 'topk-fp16', 'topk-int8']
+
+KIND_NAMES = {
+    MSG_UPDATE: 'update',
+    MSG_DELTA: 'delta',
+    MSG_SPARSE_DELTA: 'sparse delta',
+}
+
+_VALUE_DTYPES = (torch.float32, torch.float16, torch.int8)
+
+
+class Compressor:
+    """Encode a sender's model as an update for the node above.
+
+    With scheme 'none' the whole model is sent, as before. The other schemes
+    send the difference to the reference model, the average the sender
+    received and trained from:
+
+    - 'fp16', 'int8': every element, quantized (int8 with one scale);
+    - 'topk', 'topk-fp16', 'topk-int8': only the `topk_ratio` largest
+      elements with their indices, optionally quantized.
+
+    Whatever is lost to sparsification or quantization is kept as a residual
+    and added to the next delta (error feedback), so small coordinates are
+    delayed rather than dropped. Senders that track the receiver's copy
+    themselves turn this off.
+    """
+
+    def __init__(self, scheme='none', topk_ratio=0.01, error_feedback=True):
+        if scheme not in SCHEMES:
+            raise ValueError("Unknown compression scheme: " + scheme)
+        if not 0 < topk_ratio <= 1:
+            raise ValueError("topk_ratio must be in (0, 1]")
+
+        self.scheme = scheme
+        self.topk_ratio = topk_ratio
+        self.error_feedback = error_feedback
+        self.sparse = scheme.startswith('topk')
+        self.quantization = scheme.rpartition('-')[2]
+        if self.quantization not in ('fp16', 'int8'):
+            self.quantization = None
+
+        self.residual = None
+
+    def compress(self, value, reference):
+        """Return (msg_type, tensors) for `value` relative to `reference`."""
+        if self.scheme == 'none':
+            return MSG_UPDATE, [value]
+
+        delta = torch.sub(value, reference)
+        if self.residual is not None:
+            delta.add_(self.residual)
+
+        if self.sparse:
+            k = max(1, int(delta.numel() * self.topk_ratio))
+            indices = delta.abs().topk(k, sorted=False).indices
+            quantized = _quantize(delta[indices], self.quantization)
+            delta[indices] -= _dequantize(quantized)
+            msg_type = MSG_SPARSE_DELTA
+            tensors = [indices.to(torch.int32)] + quantized
+        else:
+            quantized = _quantize(delta, self.quantization)
+            delta.sub_(_dequantize(quantized))
+            msg_type = MSG_DELTA
+            tensors = quantized
+
+        if self.error_feedback:
+            # What was not sent goes out with the next update
+            self.residual = delta
+        return msg_type, tensors
+
+    def encode(self, value, reference, weight, seqnum):
+        """Compress and encode an update. Return (msg_type, buffers) for
+        `send_frame`.
+        """
+        msg_type, tensors = self.compress(value, reference)
+        return msg_type, codec.encode_tensors(seqnum, weight, tensors)
+
+
+def _quantize(values, quantization):
+    if quantization == 'fp16':
+        return [values.half()]
+    if quantization == 'int8':
+        scale = values.abs().max() / 127
+        if scale == 0:
+            scale = torch.ones(())
+        quantized = torch.round(values / scale).clamp_(-127, 127)
+        return [quantized.to(torch.int8), scale.reshape(1).float()]
+    return [values]
+
+
+def _dequantize(quantized):
+    if len(quantized) == 2:
+        values, scale = quantized
+        return values.float() * scale
+    return quantized[0].float()
+
+
+def decode_update(msg_type, payload, size, n_tenants=0):
+    """Decode and check an update frame of any kind, possibly wrapped in a
+    MSG_TENANT frame from a connection that declared `n_tenants`.
+
+    Return a dict with 'kind' (the frame type), 'tensors', 'weight',
+    'seqnum', for MSG_UPDATE, 'value' and, for a tenant's update, 'tenant'.
+    Tensors share memory with the payload.
+    """
+    tenant = None
+    if msg_type == MSG_TENANT:
+        tenant, msg_type, payload = codec.decode_tenant(payload)
+        if tenant >= n_tenants:
+            raise ProtocolError("No tenant %d on this connection" % tenant)
+
+    if msg_type not in KIND_NAMES:
+        raise ProtocolError("Unexpected message type: " + str(msg_type))
+
+    seqnum, weight, tensors = codec.decode_tensors(payload)
+    _check_tensors(msg_type, tensors, size)
+
+    data_rcv = {
+        'kind': msg_type,
+        'tensors': tensors,
+        'weight': weight,
+        'seqnum': seqnum,
+    }
+    if msg_type == MSG_UPDATE:
+        data_rcv['value'] = tensors[0]
+    if tenant is not None:
+        data_rcv['tenant'] = tenant
+
+    return data_rcv
+
+
+def _check_tensors(kind, tensors, size):
+    if kind == MSG_UPDATE:
+        _check(len(tensors) == 1
+               and tensors[0].shape == (size,)
+               and tensors[0].dtype == torch.float32)
+    elif kind == MSG_DELTA:
+        _check(len(tensors) in (1, 2) and tensors[0].shape == (size,))
+        _check_values(tensors)
+    else:
+        _check(len(tensors) in (2, 3)
+               and tensors[0].dtype == torch.int32
+               and tensors[0].dim() == 1
+               and tensors[0].shape[0] <= size
+               and tensors[1].shape == tensors[0].shape)
+        _check_values(tensors[1:])
+        indices = tensors[0]
+        if indices.numel() > 0:
+            _check(indices.min() >= 0 and indices.max() < size)
+
+
+def _check_values(tensors):
+    values = tensors[0]
+    _check(values.dtype in _VALUE_DTYPES)
+    if values.dtype == torch.int8:
+        _check(len(tensors) == 2
+               and tensors[1].shape == (1,)
+               and tensors[1].dtype == torch.float32)
+    else:
+        _check(len(tensors) == 1)
+
+
+def _check(condition):
+    if not condition:
+        raise ProtocolError("Malformed update")
+
+
+def accumulate(accumulator, data_rcv, shard=None, round_id=None,
+               reference=None, scale=1.0):
+    """Add an update of any kind to `accumulator` without densifying it.
+
+    Dicts without 'kind' are plain updates with a 'value'. The update goes
+    to round `round_id`, by default its own seqnum. To add an update taken
+    against another model than the round's (a stale one), pass `scale` to
+    weigh its delta down and, for whole models, the `reference` it was
+    trained from: the model is then added as a delta against it.
+
+    Return False if the round is not the accumulator's current one, or if
+    the update is invalid: its weight is not finite and positive, or its
+    values are not finite. Weights are self-reported, and one bad update
+    would otherwise poison the whole round.
+    """
+    kind = data_rcv.get('kind', MSG_UPDATE)
+    weight = data_rcv['weight']
+    if round_id is None:
+        round_id = data_rcv['seqnum']
+    if not is_valid_update(data_rcv):
+        return False
+
+    if kind == MSG_UPDATE:
+        if reference is None:
+            return accumulator.add(round_id, data_rcv['value'], weight, shard)
+
+        delta = torch.sub(data_rcv['value'], reference)
+        return accumulator.add_delta(
+            round_id, delta, weight, shard, scale=scale
+        )
+
+    tensors = data_rcv['tensors']
+    if kind == MSG_DELTA:
+        values = tensors[0]
+        if len(tensors) == 2:
+            scale *= tensors[1].item()
+        return accumulator.add_delta(
+            round_id, values, weight, shard, scale=scale
+        )
+
+    indices, values = tensors[:2]
+    if len(tensors) == 3:
+        scale *= tensors[2].item()
+    return accumulator.add_sparse_delta(
+        round_id, indices, values, weight, shard, scale=scale
+    )
+
+
+def is_valid_update(data_rcv):
+    """Return whether an update's weight is finite and positive and its
+    floating-point tensors hold only finite values.
+    """
+    weight = float(data_rcv['weight'])
+    if not (math.isfinite(weight) and weight > 0):
+        return False
+
+    if 'value' in data_rcv:
+        tensors = [data_rcv['value']]
+    else:
+        tensors = data_rcv['tensors']
+    return all(
+        bool(torch.isfinite(tensor).all())
+        for tensor in tensors if tensor.is_floating_point()
+    )
+
+
+def apply_delta(model, kind, tensors):
+    """Add a MSG_DELTA or MSG_SPARSE_DELTA delta to `model` in place."""
+    if kind == MSG_DELTA:
+        model.add_(_dequantize(tensors))
+    else:
+        model.index_add_(0, tensors[0].long(), _dequantize(tensors[1:]))
+
+
+def encode_model_delta(base_seqnum, seqnum, kind, tensors):
+    """Encode the step from model `base_seqnum` to `seqnum`
+    (MSG_MODEL_DELTA).
+    """
+    step = torch.tensor([base_seqnum, kind], dtype=torch.int64)
+    return codec.encode_tensors(seqnum, 0.0, [step] + tensors)
+
+
+def decode_model_delta(payload, size):
+    """Decode and check a MSG_MODEL_DELTA payload.
+
+    Return a dict with 'base', 'seqnum', 'kind' and 'tensors', which share
+    memory with the payload.
+    """
+    seqnum, _, tensors = codec.decode_tensors(payload)
+    _check(len(tensors) > 1
+           and tensors[0].shape == (2,)
+           and tensors[0].dtype == torch.int64)
+    base, kind = tensors[0].tolist()
+    _check(kind in (MSG_DELTA, MSG_SPARSE_DELTA))
+    _check_tensors(kind, tensors[1:], size)
+
+    return {
+        'base': base,
+        'seqnum': seqnum,
+        'kind': kind,
+        'tensors': tensors[1:],
+    }
@@ -0,0 +1,199 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+
+from utils import logger, print_msg
+from codec import encode_hello
+from framing import (
+    FrameReader, send_frame, send_frame_async, MSG_CLOSE, MSG_HELLO
+)
+
+
+class UpstreamConnection:
+    """A connection to the node above that survives network failures.
+
+    Every connection starts with a MSG_HELLO frame carrying `client_id`,
+    the model version `held_seqnum()` returns and, for a multi-client, its
+    `n_tenants`. The upper node keys the session by that ID instead of the
+    address, so a reconnecting peer keeps its place in the round, and it
+    resends only the steps from the version the peer holds (nothing if it
+    is up to date).
+
+    `frames` yields the frames received and reconnects whenever the
+    connection fails, with exponential backoff (`initial_delay` doubled up
+    to `max_delay`, with jitter) between attempts. A frame sent while the
+    connection is down is dropped: a blip costs that message, not a
+    restart.
+
+    `frames_async`, `connect_async` and `send_async` are the coroutine
+    versions for asyncio servers; there, the caller serializes sends.
+    """
+
+    def __init__(self, host, port, client_id, held_seqnum,
+                 initial_delay=0.5, max_delay=30.0, n_tenants=0):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.held_seqnum = held_seqnum
+        self.n_tenants = n_tenants
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+
+        self.sock = None
+        self.n_connects = 0
+        self._closed = False
+        self._send_lock = threading.Lock()
+
+    def _delays(self):
+        """Yield the waits before each new attempt, with jitter."""
+        delay = self.initial_delay
+        while True:
+            yield delay * random.uniform(0.5, 1.0)
+            delay = min(delay * 2.0, self.max_delay)
+
+    def _connected(self, sock):
+        """Publish a greeted socket. Return it."""
+        with self._send_lock:
+            self.sock = sock
+        self.n_connects += 1
+        if self.n_connects == 1:
+            print_msg("Connection established")
+        else:
+            logger.info("Reconnected to %s:%d", self.host, self.port)
+        return sock
+
+    def _failed(self, error, delay):
+        logger.warning("Cannot connect to %s:%d (%s), retrying in %.1f s",
+                       self.host, self.port, error, delay)
+
+    def _drop(self, sock):
+        """Forget a failed socket, unless already replaced."""
+        with self._send_lock:
+            if self.sock is sock:
+                self.sock = None
+        sock.close()
+
+    def connect(self):
+        """Block until connected and greeted. Return the socket."""
+        for delay in self._delays():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.connect((self.host, self.port))
+                send_frame(sock, MSG_HELLO, *encode_hello(
+                    self.client_id, self.held_seqnum(), self.n_tenants
+                ))
+            except OSError as e:
+                sock.close()
+                self._failed(e, delay)
+                time.sleep(delay)
+                continue
+
+            return self._connected(sock)
+
+    async def connect_async(self, loop):
+        """Coroutine version of `connect`."""
+        for delay in self._delays():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, (self.host, self.port))
+                await send_frame_async(
+                    loop, sock, MSG_HELLO,
+                    *encode_hello(self.client_id, self.held_seqnum(),
+                                  self.n_tenants)
+                )
+            except OSError as e:
+                sock.close()
+                self._failed(e, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            return self._connected(sock)
+
+    def frames(self):
+        """Yield (msg_type, payload) forever, reconnecting as needed. The
+        payload is only valid until the next frame.
+        """
+        while not self._closed:
+            sock = self.sock or self.connect()
+            reader = FrameReader(sock)
+            try:
+                while True:
+                    yield reader.recv_frame()
+            except OSError as e:
+                if self._closed:
+                    return
+                logger.warning("Connection to %s:%d lost (%s)",
+                               self.host, self.port, e)
+                self._drop(sock)
+
+    async def frames_async(self, loop):
+        """Coroutine version of `frames`."""
+        while not self._closed:
+            sock = self.sock or await self.connect_async(loop)
+            reader = FrameReader(sock)
+            try:
+                while True:
+                    yield await reader.recv_frame_async(loop)
+            except OSError as e:
+                if self._closed:
+                    return
+                logger.warning("Connection to %s:%d lost (%s)",
+                               self.host, self.port, e)
+                self._drop(sock)
+
+    def send(self, msg_type, *buffers):
+        """Send one frame. Return False if it was dropped because the
+        connection is down; `frames` reconnects.
+        """
+        with self._send_lock:
+            sock = self.sock
+            if sock is None:
+                return False
+            try:
+                send_frame(sock, msg_type, *buffers)
+                return True
+            except OSError:
+                # Wakes the reader, which reconnects
+                shutdown_quietly(sock)
+                return False
+
+    async def send_async(self, loop, msg_type, *buffers):
+        """Coroutine version of `send`."""
+        sock = self.sock
+        if sock is None:
+            return False
+        try:
+            await send_frame_async(loop, sock, msg_type, *buffers)
+            return True
+        except OSError:
+            shutdown_quietly(sock)
+            return False
+
+    def close(self):
+        """Say goodbye and stop reconnecting."""
+        self._closed = True
+        with self._send_lock:
+            sock = self.sock
+            self.sock = None
+        if sock is None:
+            return
+
+        try:
+            send_frame(sock, MSG_CLOSE)
+        except OSError:
+            pass
+        shutdown_quietly(sock)
+        sock.close()
+
+
+def shutdown_quietly(sock):
+    """Shut a socket down for both directions, waking any thread blocked on
+    it, without closing it.
+    """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
@@ -0,0 +1,146 @@
+"""MNIST as preprocessed tensors, cached on disk, in batches and shards.
+
+The first `load_mnist` converts the dataset once, scaled to [0, 1] as
+ToTensor would, and saves it as .npy files under <root>/MNIST/cache.
+Every later call memory-maps them, so loading takes no decoding and the
+processes of one host share the pages. `BatchLoader` slices batches out of
+the tensors with no per-sample Python, in a new order every pass, and
+`shard_indices` gives each client its own part of the data.
+"""
+import os
+import tempfile
+
+import numpy as np
+import torch
+
+ROOT = './data'
+# The shard split must be the same in every process, so shards are
+# disjoint
+SHARD_SEED = 0
+
+
+def _cache_paths(root, train):
+    directory = os.path.join(root, 'MNIST', 'cache')
+    name = 'train' if train else 'test'
+    return (os.path.join(directory, name + '-images.npy'),
+            os.path.join(directory, name + '-labels.npy'))
+
+
+def _save(path, array):
+    """Write an .npy file, replacing it atomically.
+
+    Processes started together may all build the cache: each writes its
+    own temporary file, so they never write into the same one, and the
+    last to finish replaces the identical files of the others.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=os.path.basename(path) + '.',
+        suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, array)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def build_cache(root=ROOT, train=True):
+    """Convert the torchvision MNIST files under `root` into the cache."""
+    import torchvision
+
+    dataset = torchvision.datasets.MNIST(root=root, train=train)
+    images_path, labels_path = _cache_paths(root, train)
+    os.makedirs(os.path.dirname(images_path), exist_ok=True)
+    # The labels go last: they mark the cache complete
+    _save(images_path,
+          dataset.data.unsqueeze(1).float().div_(255).numpy())
+    _save(labels_path, dataset.targets.numpy())
+
+
+def load_mnist(train=True, root=ROOT):
+    """Return MNIST images, [n, 1, 28, 28] float32 in [0, 1], and int64
+    labels, building the cache first if need be. The images are mapped
+    copy-on-write from the cache file.
+    """
+    images_path, labels_path = _cache_paths(root, train)
+    if not os.path.exists(labels_path):
+        build_cache(root, train)
+
+    images = np.load(images_path, mmap_mode='c')
+    labels = np.load(labels_path)
+    return torch.from_numpy(images), torch.from_numpy(labels)
+
+
+def split_shards(labels, n_shards, non_iid, generator):
+    """Split the dataset indices into `n_shards`: at random, or, if
+    `non_iid`, as two runs of label-sorted data each, so a shard holds
+    only a few labels.
+    """
+    order = torch.randperm(len(labels), generator=generator)
+    if not non_iid:
+        return list(torch.tensor_split(order, n_shards))
+
+    order = order[torch.argsort(labels[order], stable=True)]
+    pieces = torch.tensor_split(order, 2 * n_shards)
+    assignment = torch.randperm(2 * n_shards, generator=generator)
+    return [
+        torch.cat([pieces[assignment[2 * shard]],
+                   pieces[assignment[2 * shard + 1]]])
+        for shard in range(n_shards)
+    ]
+
+
+def shard_indices(labels, shard, n_shards, non_iid=False):
+    """Return the indices of shard `shard` of `n_shards`, the same in every
+    process, or None for the whole dataset.
+    """
+    if n_shards <= 1:
+        return None
+    if not 0 <= shard < n_shards:
+        raise ValueError("Shard {} of {}".format(shard, n_shards))
+
+    generator = torch.Generator().manual_seed(SHARD_SEED)
+    return split_shards(labels, n_shards, non_iid, generator)[shard]
+
+
+class BatchLoader:
+    """Iterate over (data, target) batches of a dataset held in tensors.
+
+    Each pass goes over the samples in `indices` (default: all) once, in a
+    new random order if `shuffle`, so successive rounds train on different
+    batches. Batches are gathered with one indexing op each; without
+    shuffle or indices they are plain slices, with no copy at all.
+    """
+
+    def __init__(self, images, labels, batch_size=100, indices=None,
+                 shuffle=True, generator=None):
+        self.images = images
+        self.labels = labels
+        self.batch_size = batch_size
+        self.indices = indices
+        self.shuffle = shuffle
+        self.generator = generator
+
+    def __len__(self):
+        n_samples = len(self.labels if self.indices is None
+                        else self.indices)
+        return -(-n_samples // self.batch_size)
+
+    def __iter__(self):
+        indices = self.indices
+        if self.shuffle:
+            n_samples = len(self.labels if indices is None else indices)
+            order = torch.randperm(n_samples, generator=self.generator)
+            indices = order if indices is None else indices[order]
+
+        if indices is None:
+            for start in range(0, len(self.labels), self.batch_size):
+                stop = start + self.batch_size
+                yield self.images[start:stop], self.labels[start:stop]
+            return
+
+        for start in range(0, len(indices), self.batch_size):
+            batch = indices[start:start + self.batch_size]
+            yield self.images[batch], self.labels[batch]
@@ -0,0 +1,183 @@
+import collections
+import queue
+import threading
+import time
+
+from framing import send_frame
+from metrics import registry
+
+DELIVERY_SECONDS = registry.histogram(
+    'fl_broadcast_delivery_seconds',
+    "Time from queueing a broadcast for a connection to having sent it"
+)
+DROPPED = registry.counter(
+    'fl_broadcast_dropped_total',
+    "Broadcasts replaced by a newer one before being sent"
+)
+
+
+class _Outbox:
+    """Frames waiting to be sent on one connection."""
+
+    def __init__(self, conn, addr, max_pending):
+        self.conn = conn
+        self.addr = addr
+        # (item, time queued)
+        self.items = collections.deque(maxlen=max_pending)
+        # Last model version the peer acknowledged
+        self.acked = None
+        # Queued for, or held by, a writer
+        self.busy = False
+
+
+class Broadcaster:
+    """Send frames to many connections from a pool of writer threads.
+
+    `send` and `broadcast` only queue an item and return; callers may hold
+    their own locks while calling them. By default an item is one frame,
+    (msg_type, buffers), encoded once by the caller and queued as is for
+    every connection. With `render(item, acked)`, the writer turns the item
+    into the list of frames to send on a connection, given the last version
+    that connection acknowledged (see `ack`); `ModelHistory.frames` renders
+    model versions as deltas this way.
+
+    Each connection has a bounded outbox (`max_pending` items, 1 by
+    default) and is handled by at most one writer at a time, so frames on a
+    connection never interleave. When a client is too slow to take an item
+    before the next one is queued, the oldest waiting item is dropped: a
+    client that falls behind only ever gets the latest model, and a slow
+    link ties up one writer instead of the whole broadcast.
+
+    `on_error(conn, addr)` is called from a writer thread when a send to a
+    registered connection fails; the connection is unregistered first.
+    Writers are started with the first queued item.
+    """
+
+    def __init__(self, on_error=None, render=None, n_writers=8,
+                 max_pending=1):
+        self.on_error = on_error
+        self.render = render
+        self.n_writers = n_writers
+        self.max_pending = max_pending
+        self.n_dropped = 0
+
+        self._outboxes = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._n_busy = 0
+        self._ready = queue.SimpleQueue()
+        self._writers = []
+
+    def add(self, conn, addr, item=None, acked=None):
+        """Register a connection, optionally queueing a first item (e.g. the
+        current model) before any later broadcast can reach it. `acked` is
+        the version the peer already holds, if it said so when connecting.
+        """
+        with self._lock:
+            outbox = self._outboxes.get(conn)
+            if outbox is None:
+                outbox = _Outbox(conn, addr, self.max_pending)
+                outbox.acked = acked
+                self._outboxes[conn] = outbox
+            if item is not None:
+                self._enqueue(outbox, item)
+
+    def remove(self, conn):
+        """Unregister a connection and drop its waiting items."""
+        with self._lock:
+            outbox = self._outboxes.pop(conn, None)
+            if outbox is not None:
+                outbox.items.clear()
+
+    def ack(self, conn, seqnum):
+        """Record the last model version a connection acknowledged."""
+        with self._lock:
+            outbox = self._outboxes.get(conn)
+            if outbox is not None:
+                outbox.acked = seqnum
+
+    def send(self, conn, item):
+        """Queue an item for one registered connection."""
+        with self._lock:
+            outbox = self._outboxes.get(conn)
+            if outbox is not None:
+                self._enqueue(outbox, item)
+
+    def broadcast(self, item):
+        """Queue one item for every registered connection."""
+        with self._lock:
+            for outbox in self._outboxes.values():
+                self._enqueue(outbox, item)
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued item has been sent or dropped. Return
+        False on timeout.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._n_busy == 0, timeout)
+
+    def _enqueue(self, outbox, item):
+        """Queue an item. The caller must hold `_lock`."""
+        if len(outbox.items) == outbox.items.maxlen:
+            self.n_dropped += 1
+            DROPPED.inc()
+        outbox.items.append((item, time.perf_counter()))
+
+        if not outbox.busy:
+            outbox.busy = True
+            self._n_busy += 1
+            self._ready.put(outbox)
+
+        if not self._writers:
+            for _ in range(self.n_writers):
+                writer = threading.Thread(target=self._write_forever)
+                writer.daemon = True
+                writer.start()
+                self._writers.append(writer)
+
+    def _write_forever(self):
+        while True:
+            outbox = self._ready.get()
+            with self._lock:
+                if not outbox.items:
+                    self._release(outbox)
+                    continue
+                item, queued_time = outbox.items.popleft()
+                acked = outbox.acked
+
+            if self.render is None:
+                frames = [item]
+            else:
+                frames = self.render(item, acked)
+
+            try:
+                for msg_type, buffers in frames:
+                    send_frame(outbox.conn, msg_type, *buffers)
+                DELIVERY_SECONDS.observe(time.perf_counter() - queued_time)
+                failed = False
+            except (OSError, ConnectionError):
+                failed = True
+
+            with self._lock:
+                # Sends to removed connections are expected to fail
+                report = failed and self._outboxes.get(outbox.conn) is outbox
+                if report:
+                    del self._outboxes[outbox.conn]
+                if failed:
+                    outbox.items.clear()
+
+                if outbox.items:
+                    # Back of the line: one item per turn keeps it fair
+                    self._ready.put(outbox)
+                else:
+                    self._release(outbox)
+
+            if report and self.on_error is not None:
+                self.on_error(outbox.conn, outbox.addr)
+
+    def _release(self, outbox):
+        """The caller must hold `_lock`."""
+        outbox.busy = False
+        self._n_busy -= 1
+        if self._n_busy == 0:
+            self._idle.notify_all()
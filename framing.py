@@ -0,0 +1,172 @@
+import socket
+import struct
+
+from metrics import registry
+
+# Every message on the wire is a fixed-size header followed by the payload:
+#
+#   magic (2 bytes) | version (1 byte) | type (1 byte) | length (8 bytes)
+#
+# The receiver reads exactly the header, then exactly `length` bytes, so
+# back-to-back messages in one TCP segment are never merged or lost.
+MAGIC = b'FL'
+VERSION = 3
+HEADER = struct.Struct('!2sBBQ')
+
+# Message types (payload formats are defined in codec.py)
+MSG_CLOSE = 2
+MSG_MODEL = 3
+MSG_UPDATE = 4
+MSG_DELTA = 5
+MSG_SPARSE_DELTA = 6
+MSG_ACK = 7
+MSG_MODEL_DELTA = 8
+MSG_HELLO = 9
+MSG_TENANT = 10
+
+MSG_NAMES = {
+    MSG_CLOSE: 'close',
+    MSG_MODEL: 'model',
+    MSG_UPDATE: 'update',
+    MSG_DELTA: 'delta',
+    MSG_SPARSE_DELTA: 'sparse_delta',
+    MSG_ACK: 'ack',
+    MSG_MODEL_DELTA: 'model_delta',
+    MSG_HELLO: 'hello',
+    MSG_TENANT: 'tenant',
+}
+
+# Refuse to allocate a receive buffer for absurd lengths (corrupt stream)
+MAX_PAYLOAD_SIZE = 1 << 30
+
+
+class ProtocolError(ConnectionError):
+    """Raised when the peer sends something that is not a valid frame."""
+
+
+def _byte_counters(name, help):
+    return {
+        msg_type: registry.counter(name, help, type=msg_name)
+        for msg_type, msg_name in MSG_NAMES.items()
+    }
+
+
+# Whole frames, header included, by message type
+_BYTES_RECEIVED = _byte_counters(
+    'fl_bytes_received_total', "Bytes of frames received"
+)
+_BYTES_SENT = _byte_counters('fl_bytes_sent_total', "Bytes of frames sent")
+
+
+class FrameReader:
+    """Read frames from a socket into a reusable receive buffer."""
+
+    def __init__(self, sock, buffer_size=1 << 16):
+        self.sock = sock
+        self._header = bytearray(HEADER.size)
+        self._buffer = bytearray(buffer_size)
+
+    def recv_frame(self):
+        """Block until one whole frame is read.
+
+        Return (msg_type, payload). The payload is a memoryview into the
+        reader's buffer and is only valid until the next call.
+        """
+        self._recv_exactly(memoryview(self._header))
+        msg_type, payload = self._parse_header()
+        self._recv_exactly(payload)
+        _count_received(msg_type, payload)
+
+        return msg_type, payload
+
+    async def recv_frame_async(self, loop):
+        """Coroutine version of `recv_frame` for non-blocking sockets."""
+        await self._recv_exactly_async(loop, memoryview(self._header))
+        msg_type, payload = self._parse_header()
+        await self._recv_exactly_async(loop, payload)
+        _count_received(msg_type, payload)
+
+        return msg_type, payload
+
+    def _parse_header(self):
+        """Validate the header, return (msg_type, view to receive into)."""
+        magic, version, msg_type, length = HEADER.unpack(self._header)
+
+        if magic != MAGIC or version != VERSION:
+            raise ProtocolError(
+                "Bad frame header: " + repr(bytes(self._header))
+            )
+        if length > MAX_PAYLOAD_SIZE:
+            raise ProtocolError("Frame too large: " + str(length) + " bytes")
+
+        if length > len(self._buffer):
+            self._buffer = bytearray(length)
+
+        return msg_type, memoryview(self._buffer)[:length]
+
+    def _recv_exactly(self, view):
+        """Fill the whole view from the socket."""
+        while view.nbytes > 0:
+            n_bytes = self.sock.recv_into(view)
+            if n_bytes == 0:
+                raise ConnectionResetError("Connection closed by peer")
+            view = view[n_bytes:]
+
+    async def _recv_exactly_async(self, loop, view):
+        while view.nbytes > 0:
+            n_bytes = await loop.sock_recv_into(self.sock, view)
+            if n_bytes == 0:
+                raise ConnectionResetError("Connection closed by peer")
+            view = view[n_bytes:]
+
+
+def _count_received(msg_type, payload):
+    counter = _BYTES_RECEIVED.get(msg_type)
+    if counter is not None:
+        counter.inc(HEADER.size + payload.nbytes)
+
+
+def send_frame(sock, msg_type, *buffers):
+    """Send one frame whose payload is the concatenation of the buffers.
+
+    The buffers are handed to the kernel as they are (no concatenation copy)
+    where `sendmsg` is available.
+    """
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+    length = sum(view.nbytes for view in views)
+    header = HEADER.pack(MAGIC, VERSION, msg_type, length)
+    _send_all(sock, [memoryview(header)] + views)
+    _BYTES_SENT[msg_type].inc(HEADER.size + length)
+
+
+async def send_frame_async(loop, sock, msg_type, *buffers):
+    """Coroutine version of `send_frame` for non-blocking sockets."""
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+    length = sum(view.nbytes for view in views)
+    await loop.sock_sendall(
+        sock, HEADER.pack(MAGIC, VERSION, msg_type, length)
+    )
+    for view in views:
+        if view.nbytes > 0:
+            await loop.sock_sendall(sock, view)
+    _BYTES_SENT[msg_type].inc(HEADER.size + length)
+
+
+def _send_all(sock, views):
+    """Send all views, resuming after partial writes."""
+    if not hasattr(socket.socket, 'sendmsg'):
+        # Windows has no sendmsg
+        for view in views:
+            sock.sendall(view)
+        return
+
+    views = [view for view in views if view.nbytes > 0]
+    while views:
+        n_bytes = sock.sendmsg(views)
+        while n_bytes > 0:
+            if n_bytes >= views[0].nbytes:
+                n_bytes -= views[0].nbytes
+                views.pop(0)
+            else:
+                views[0] = views[0][n_bytes:]
+                n_bytes = 0
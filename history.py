@@ -0,0 +1,128 @@
+import collections
+import threading
+
+from codec import encode_model
+from compression import Compressor, apply_delta, encode_model_delta
+from framing import MSG_MODEL, MSG_MODEL_DELTA, MSG_UPDATE
+
+
+class ModelHistory:
+    """The last few global model versions, for delta broadcasts.
+
+    Each version keeps its model, encoded once as a full MSG_MODEL frame,
+    and, when the previous version is known, the encoded MSG_MODEL_DELTA
+    step from it. `frames(acked, seqnum)` returns what a connection that
+    acknowledged `acked` needs to reach `seqnum`: the chain of steps when it
+    is in the window and smaller than the model, the full model otherwise.
+
+    A node that computes the models itself calls `advance`, which compresses
+    the step with `compression` (see compression.py). The versions are then
+    the models clients can rebuild from the steps, which may differ from
+    the exact average by the compression error; the next step carries that
+    error along, and the node must take clients' deltas against
+    `latest_model`. A node that forwards models calls `add_model` and
+    `add_step` with what it received.
+    """
+
+    def __init__(self, model, seqnum, compression='none', topk_ratio=0.01,
+                 max_versions=8):
+        self.compressor = Compressor(
+            compression, topk_ratio, error_feedback=False
+        )
+        # seqnum -> (model, full frame, step frame from the previous one)
+        self._versions = collections.OrderedDict()
+        self._max_versions = max_versions
+        self._lock = threading.Lock()
+
+        self.add_model(seqnum, model)
+
+    @property
+    def latest_seqnum(self):
+        with self._lock:
+            return next(reversed(self._versions))
+
+    @property
+    def latest_model(self):
+        with self._lock:
+            return self._versions[next(reversed(self._versions))][0]
+
+    def model(self, seqnum):
+        """Return the model of version `seqnum`, or None if not kept."""
+        with self._lock:
+            version = self._versions.get(seqnum)
+            return None if version is None else version[0]
+
+    def advance(self, seqnum, target):
+        """Add version `seqnum`, stepping from the latest model towards
+        `target` with the configured compression. Return the new model.
+        """
+        base_seqnum = self.latest_seqnum
+        base = self.latest_model
+
+        kind, tensors = self.compressor.compress(target, base)
+        if kind == MSG_UPDATE:
+            return self.add_model(seqnum, target.clone())
+
+        model = base.clone()
+        apply_delta(model, kind, tensors)
+        return self.add_step(base_seqnum, seqnum, kind, tensors, model)
+
+    def add_model(self, seqnum, model):
+        """Add version `seqnum` without a step. `model` must not be modified
+        afterwards.
+        """
+        self._add(seqnum, model, None)
+        return model
+
+    def add_step(self, base_seqnum, seqnum, kind, tensors, model):
+        """Add version `seqnum`, the result of applying the step (`kind`,
+        `tensors`) to version `base_seqnum`. Neither `model` nor `tensors`
+        may be modified afterwards.
+        """
+        step = (
+            MSG_MODEL_DELTA,
+            encode_model_delta(base_seqnum, seqnum, kind, tensors),
+            base_seqnum
+        )
+        self._add(seqnum, model, step)
+        return model
+
+    def _add(self, seqnum, model, step):
+        full = (MSG_MODEL, encode_model(model, seqnum))
+        with self._lock:
+            self._versions.pop(seqnum, None)
+            self._versions[seqnum] = (model, full, step)
+            while len(self._versions) > self._max_versions:
+                self._versions.popitem(last=False)
+
+    def frames(self, acked, seqnum):
+        """Return the [(msg_type, buffers)] taking a connection from
+        version `acked` (None if unknown) to `seqnum`, or to the latest
+        version if `seqnum` is no longer kept.
+        """
+        with self._lock:
+            if seqnum not in self._versions:
+                seqnum = next(reversed(self._versions))
+            if acked == seqnum:
+                return []
+
+            _, full, step = self._versions[seqnum]
+            full_size = _size(full)
+
+            steps = []
+            steps_size = 0
+            while step is not None and steps_size < full_size:
+                steps.append(step[:2])
+                steps_size += _size(step)
+                if step[2] == acked:
+                    steps.reverse()
+                    return steps if steps_size < full_size else [full]
+                if step[2] not in self._versions:
+                    break
+                step = self._versions[step[2]][2]
+
+            return [full]
+
+
+def _size(frame):
+    return sum(memoryview(buffer).nbytes for buffer in frame[1])
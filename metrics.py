@@ -0,0 +1,240 @@
+import bisect
+import http.server
+import os
+import threading
+import time
+
+# Seconds, from sub-millisecond decodes to slow rounds
+TIME_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Counter:
+    """A value that only goes up."""
+
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge(Counter):
+    """A value that goes up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, with their sum."""
+
+    kind = 'histogram'
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self)
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield (name + '_bucket', labels + (('le', _format(bound)),),
+                   cumulative)
+        yield name + '_sum', labels, total
+        yield name + '_count', labels, cumulative
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start_time)
+
+
+class Registry:
+    """Named metrics of this process, rendered in the Prometheus text
+    format.
+
+    `counter`, `gauge` and `histogram` return the metric for a name and
+    label values, creating it on first use, so modules can look their
+    metrics up once at import time and update them without the registry.
+    Updates take a per-metric lock only.
+    """
+
+    def __init__(self):
+        # name -> (kind, help, {labels: metric})
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, **labels):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def _get(self, metric_class, name, help, labels, *args):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = (metric_class.kind, help, {})
+                self._families[name] = family
+            elif family[0] != metric_class.kind:
+                raise ValueError(name + " is already a " + family[0])
+
+            metric = family[2].get(key)
+            if metric is None:
+                metric = metric_class(*args)
+                family[2][key] = metric
+            return metric
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            families = [
+                (name, kind, help, list(metrics.items()))
+                for name, (kind, help, metrics)
+                in sorted(self._families.items())
+            ]
+
+        lines = []
+        for name, kind, help, metrics in families:
+            lines.append('# HELP ' + name + ' ' + help)
+            lines.append('# TYPE ' + name + ' ' + kind)
+            for labels, metric in metrics:
+                for sample_name, sample_labels, value in metric.samples(
+                        name, labels):
+                    lines.append(sample_name + _format_labels(sample_labels)
+                                 + ' ' + _format(value))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve `render()` at http://host:port/metrics from a daemon
+        thread. Return the HTTP server.
+        """
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4'
+                )
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def dump(self, path):
+        """Write `render()` to a file, replacing it atomically."""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+    def dump_every(self, path, interval=10.0):
+        """Dump to `path` every `interval` seconds from a daemon thread."""
+        def dump_forever():
+            while True:
+                time.sleep(interval)
+                self.dump(path)
+
+        thread = threading.Thread(target=dump_forever)
+        thread.daemon = True
+        thread.start()
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n') + '"'
+        for key, value in labels
+    ) + '}'
+
+
+registry = Registry()
+
+
+def add_arguments(parser):
+    """Add the metrics options to an argparse parser."""
+    parser.add_argument(
+        '--metrics-port', type=int, default=0,
+        help="serve metrics at http://127.0.0.1:<port>/metrics "
+             "(default: 0, off)"
+    )
+    parser.add_argument(
+        '--metrics-file',
+        help="also write the metrics to this file every 10 s"
+    )
+
+
+def start(args):
+    """Export the metrics as parsed `add_arguments` options ask."""
+    if args.metrics_port:
+        registry.serve(args.metrics_port)
+    if args.metrics_file:
+        registry.dump_every(args.metrics_file)
@@ -0,0 +1,162 @@
+import asyncio
+import itertools
+import socket
+import threading
+from multiprocessing.connection import wait
+from multiprocessing.reduction import recv_handle, send_handle
+
+import torch.multiprocessing
+
+from utils import logger
+from accumulator import ShardedAccumulator
+from codec import decode_ack
+from compression import accumulate, decode_update
+from framing import FrameReader, MSG_ACK, MSG_CLOSE
+
+
+class AggregationWorkerPool:
+    """Worker processes that receive, decode and accumulate updates.
+
+    The coordinator keeps accepting connections and hands each socket to a
+    worker (round-robin). Workers read and decode frames on their own event
+    loop and add the updates (full, delta or sparse, see compression.py)
+    into their shard of a shared-memory `ShardedAccumulator`, so decoding and
+    summing scale with the number of cores instead of sharing one GIL. The
+    coordinator only reduces the shards at round close and sends broadcasts
+    on its own copy of each socket.
+
+    Workers report ('update', client_addr, tenant, seqnum, weight),
+    ('ack', client_addr, seqnum) and ('closed', client_addr) events, read
+    with `events`, where `client_addr` is what `dispatch` was given and
+    `tenant` is None unless the update came from a multi-client's tenant.
+
+    Passing sockets between processes needs a Unix platform.
+    """
+
+    def __init__(self, size, round_id, n_workers, max_weight=0.0):
+        context = torch.multiprocessing.get_context('spawn')
+
+        self.accumulator = ShardedAccumulator(
+            size, round_id, n_shards=n_workers, context=context,
+            max_weight=max_weight
+        )
+        self.processes = []
+        self._handoffs = []
+        self._event_conns = []
+        self._next_worker = itertools.count()
+        # Connection threads dispatch concurrently; a worker must get each
+        # address and its descriptor back to back
+        self._dispatch_lock = threading.Lock()
+
+        for index in range(n_workers):
+            handoff, worker_handoff = context.Pipe()
+            event_conn, worker_event_conn = context.Pipe(duplex=False)
+
+            process = context.Process(
+                target=_worker_main,
+                args=(index, size, self.accumulator,
+                      worker_handoff, worker_event_conn)
+            )
+            process.daemon = True
+            process.start()
+
+            # Only the worker keeps its ends
+            worker_handoff.close()
+            worker_event_conn.close()
+
+            self.processes.append(process)
+            self._handoffs.append(handoff)
+            self._event_conns.append(event_conn)
+
+    def dispatch(self, client_conn, client_addr, n_tenants=0):
+        """Hand a connected client's socket, with the number of tenants
+        it multiplexes, to the next worker.
+
+        The worker gets its own descriptor for reading; the caller keeps
+        `client_conn` for sending. Safe to call from several threads.
+        """
+        with self._dispatch_lock:
+            index = next(self._next_worker) % len(self.processes)
+            self._handoffs[index].send((client_addr, n_tenants))
+            send_handle(
+                self._handoffs[index],
+                client_conn.fileno(),
+                self.processes[index].pid
+            )
+
+    def events(self):
+        """Yield worker events forever."""
+        while self._event_conns:
+            for event_conn in wait(self._event_conns):
+                try:
+                    yield event_conn.recv()
+                except EOFError:
+                    logger.error("Aggregation worker exited")
+                    self._event_conns.remove(event_conn)
+
+    def shut_down(self):
+        for handoff in self._handoffs:
+            handoff.close()
+        for process in self.processes:
+            process.join(timeout=1.0)
+
+
+def _worker_main(index, size, accumulator, handoff, event_conn):
+    asyncio.run(_serve_worker(index, size, accumulator, handoff, event_conn))
+
+
+async def _serve_worker(index, size, accumulator, handoff, event_conn):
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    tasks = set()
+
+    def on_handoff():
+        try:
+            client_addr, n_tenants = handoff.recv()
+            fd = recv_handle(handoff)
+        except (EOFError, OSError):
+            # The coordinator is gone
+            loop.remove_reader(handoff.fileno())
+            stopped.set_result(None)
+            return
+
+        client_conn = socket.socket(fileno=fd)
+        client_conn.setblocking(False)
+        task = loop.create_task(_serve_connection(
+            loop, index, size, accumulator, event_conn,
+            client_conn, client_addr, n_tenants
+        ))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    loop.add_reader(handoff.fileno(), on_handoff)
+    await stopped
+
+
+async def _serve_connection(loop, index, size, accumulator, event_conn,
+                            client_conn, client_addr, n_tenants):
+    """Read one client's updates into this worker's accumulator shard."""
+    reader = FrameReader(client_conn)
+    try:
+        while True:
+            msg_type, payload = await reader.recv_frame_async(loop)
+            if msg_type == MSG_CLOSE:
+                break
+
+            if msg_type == MSG_ACK:
+                event_conn.send(('ack', client_addr, decode_ack(payload)))
+                continue
+
+            data_rcv = decode_update(msg_type, payload, size, n_tenants)
+            if accumulate(accumulator, data_rcv, shard=index):
+                event_conn.send((
+                    'update', client_addr, data_rcv.get('tenant'),
+                    data_rcv['seqnum'], data_rcv['weight']
+                ))
+            else:
+                logger.debug("Outdated update from %s dropped", client_addr)
+    except (OSError, ConnectionError):
+        pass
+    finally:
+        client_conn.close()
+        event_conn.send(('closed', client_addr))
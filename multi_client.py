@@ -0,0 +1,170 @@
+import argparse
+import time
+
+import torch
+
+from utils import logger
+from client import Client, TRAIN_SECONDS
+from codec import encode_tenant
+from compression import SCHEMES, Compressor
+from data import load_mnist, split_shards
+import metrics
+from vectorized import VectorizedTrainer
+
+
+class MultiClient(Client):
+    """K virtual clients hosted in one process, behind one connection.
+
+    Instead of K processes, each with its own NeuralNet, optimizer and
+    MNIST copy, the tenants share one in-memory copy of the training set,
+    split into a shard each, and train together in vectorized passes (see
+    vectorized.py). Every model received is trained by all tenants.
+
+    The connection is shared, but not the updates: each tenant's model is
+    sent on its own, wrapped in a MSG_TENANT frame, with its own
+    compressor (and error feedback residual). The edge counts every tenant
+    as a participant of its round, as it would K separate clients, so
+    robust aggregation, `--buffer-size` and staleness see each of them.
+    """
+
+    def __init__(self, server_ip, server_port, n_tenants=16,
+                 n_steps=101, batch_size=100, learning_rate=0.0001,
+                 chunk_size=64, non_iid=False, seed=0, compression='none',
+                 topk_ratio=0.01, **kwargs):
+        self.n_tenants = n_tenants
+        self.n_steps = n_steps
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.compressors = [
+            Compressor(compression, topk_ratio) for _ in range(n_tenants)
+        ]
+
+        super().__init__(server_ip, server_port, non_iid=non_iid,
+                         compression=compression, topk_ratio=topk_ratio,
+                         **kwargs)
+
+    def set_up_training(self):
+        """Load the training set once and split it among the tenants."""
+        images, labels = load_mnist(train=True)
+        shards = split_shards(
+            labels, self.n_tenants, self.non_iid,
+            torch.Generator().manual_seed(self.seed)
+        )
+        self.trainer = VectorizedTrainer(
+            images, labels, shards, self.n_steps, self.batch_size,
+            self.learning_rate, self.chunk_size, self.seed
+        )
+
+    def train(self):
+        with self._key_lock:
+            old_seqnum = self.seqnum
+
+        while True:
+            with self._model_received:
+                # Wake up as soon as a new model arrives
+                while old_seqnum == self.seqnum:
+                    self._model_received.wait()
+
+                reference = self.server_avg
+                old_seqnum = self.seqnum
+
+            start_time = time.time()
+            models = self.trainer.train([
+                (tenant, reference) for tenant in range(self.n_tenants)
+            ])
+            train_time = time.time() - start_time
+
+            TRAIN_SECONDS.observe(train_time)
+            logger.info("Trained %d clients in %.2f s", self.n_tenants,
+                        train_time)
+
+            for tenant, value in enumerate(models):
+                sent = self.send_to_server({
+                    'tenant': tenant,
+                    'value': value,
+                    'weight': 1,
+                    'seqnum': old_seqnum,
+                    'reference': reference
+                })
+                if not sent:
+                    # The other tenants' updates would be dropped too
+                    break
+
+    def send_to_server(self, data):
+        """Send a tenant's trained update to the server over the shared
+        connection. Return False if the server is unreachable.
+        """
+        tenant = data['tenant']
+        msg_type, buffers = self.compressors[tenant].encode(
+            data['value'], data['reference'], data['weight'], data['seqnum']
+        )
+        self.startSendTime = time.time()
+        if not self.server.send(*encode_tenant(tenant, msg_type, buffers)):
+            logger.warning("Server unreachable, updates for model %d "
+                           "dropped", data['seqnum'])
+            return False
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Many virtual clients in one process"
+    )
+    parser.add_argument('server_ip', nargs='?', default='localhost')
+    parser.add_argument('server_port', nargs='?', type=int, default=4001)
+    parser.add_argument(
+        '--tenants', type=int, default=16,
+        help="virtual clients to host (default: 16)"
+    )
+    parser.add_argument(
+        '--local-steps', type=int, default=101,
+        help="SGD steps per tenant and model (default: 101)"
+    )
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--learning-rate', type=float, default=0.0001)
+    parser.add_argument(
+        '--chunk-size', type=int, default=64,
+        help="tenants trained together in one vectorized pass "
+             "(default: 64)"
+    )
+    parser.add_argument(
+        '--non-iid', action='store_true',
+        help="give each tenant two runs of label-sorted data instead of a "
+             "random shard"
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--compression', choices=SCHEMES, default='none',
+        help="how updates are sent to the edge server (default: none, the "
+             "whole model)"
+    )
+    parser.add_argument(
+        '--topk-ratio', type=float, default=0.01,
+        help="fraction of the delta sent by the topk schemes "
+             "(default: 0.01)"
+    )
+    parser.add_argument(
+        '--client-id',
+        help="session ID at the edge server, kept across reconnections "
+             "(default: random)"
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    metrics.start(args)
+
+    client = MultiClient(
+        args.server_ip, args.server_port,
+        n_tenants=args.tenants, n_steps=args.local_steps,
+        batch_size=args.batch_size, learning_rate=args.learning_rate,
+        chunk_size=args.chunk_size, non_iid=args.non_iid, seed=args.seed,
+        compression=args.compression, topk_ratio=args.topk_ratio,
+        client_id=args.client_id
+    )
+    client.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,953 @@
+import argparse
+import itertools
+import socket
+import threading
+import time
+
+import torch
+
+from utils import UPDATE_LOG_EVERY, logger, print_msg
+from checkpoint import Checkpointer, load_checkpoint
+from codec import encode_ack, decode_ack, decode_hello, decode_model
+from compression import (
+    SCHEMES, KIND_NAMES, Compressor, apply_delta, decode_model_delta,
+    decode_update
+)
+from connection import UpstreamConnection, shutdown_quietly
+from fanout import Broadcaster
+from framing import (
+    FrameReader, ProtocolError, MSG_ACK, MSG_CLOSE, MSG_HELLO,
+    MSG_MODEL_DELTA
+)
+from history import ModelHistory
+from accumulator import ShardedAccumulator
+from aggregators import AGGREGATORS, RobustAccumulator
+import metrics
+from metrics import COUNT_BUCKETS, registry
+from mp_aggregation import AggregationWorkerPool
+from params import FlatState, neural_net_schema
+from scheduler import RoundScheduler
+from server_opt import OPTIMIZERS, ServerOptimizer
+from staleness import StalenessPolicy, accumulate_stale
+
+# Seconds a new connection has to send its MSG_HELLO
+HELLO_TIMEOUT = 10.0
+
+DECODE_SECONDS = registry.histogram(
+    'fl_decode_seconds', "Time to decode a received message",
+    message='update'
+)
+MODEL_DECODE_SECONDS = registry.histogram(
+    'fl_decode_seconds', "Time to decode a received message",
+    message='model'
+)
+ACCUMULATE_SECONDS = registry.histogram(
+    'fl_accumulate_seconds', "Time to add one update to the open round"
+)
+REDUCE_SECONDS = registry.histogram(
+    'fl_reduce_seconds', "Time to reduce a closed round into its average"
+)
+ROUND_RESPONDERS = registry.histogram(
+    'fl_round_responders', "Connections that responded, per closed round",
+    COUNT_BUCKETS
+)
+UPDATE_STALENESS = registry.histogram(
+    'fl_update_staleness', "Versions published since an accepted update's "
+    "model", (0, 1, 2, 4, 8, 16, 32)
+)
+UPDATES_ACCEPTED = registry.counter(
+    'fl_updates_total', "Updates received", outcome='accepted'
+)
+UPDATES_DROPPED = registry.counter(
+    'fl_updates_total', "Updates received", outcome='dropped'
+)
+CLIENTS = registry.gauge('fl_clients', "Connected clients")
+UPPER_REPLY_SECONDS = registry.histogram(
+    'fl_upper_reply_seconds',
+    "Time from sending an update upstream to the next model"
+)
+
+
+def participant(client_id, tenant=None):
+    """Name a round participant: a client, or one tenant of a
+    multi-client.
+    """
+    if tenant is None:
+        return client_id
+    return '%s/%d' % (client_id, tenant)
+
+
+class AggregationNode:
+    """A node of the aggregation tree.
+
+    Every node serves the connections below it (clients or other nodes):
+    it sums their weighted updates into rounds and broadcasts them the
+    global model. The root, started without an upper server, closes each
+    round into a new model version. Any other node is itself a client of
+    the node above: it sends each round's average upstream with the total
+    weight of its round, so weights add up the same way at every tier,
+    and forwards the models it receives. Trees of any depth are built by
+    pointing nodes at each other, keeping the root's fan-in bounded.
+
+    Connections are sessions keyed by the client ID sent in their MSG_HELLO
+    (see connection.py): a client that reconnects replaces its old
+    connection, keeps its update in the round and is sent only the steps
+    from the version it holds. A multi-client's connection carries the
+    updates of each of its tenants, which count as separate participants.
+    """
+
+    def __init__(self, port, upper_server_ip=None, upper_server_port=None,
+                 n_workers=0, train_weight=0, compression='none',
+                 downlink_compression='none', topk_ratio=0.01,
+                 buffer_size=0, max_staleness=0, staleness_exponent=0.5,
+                 client_id=None, checkpoint_path=None, checkpoint_every=1,
+                 aggregator='mean', trim_ratio=0.1, clip_norm=0.0,
+                 max_updates=256, max_weight=0.0, server_optimizer='none',
+                 server_lr=1.0, server_momentum=0.9, server_beta2=0.99,
+                 server_epsilon=1e-3):
+        if n_workers > 0 and max_staleness > 0:
+            raise ValueError("Aggregation workers only take current updates")
+        robust = aggregator != 'mean' or clip_norm > 0
+        if n_workers > 0 and robust:
+            raise ValueError("Aggregation workers only sum updates; robust "
+                             "aggregation needs them in one process")
+
+        self.upper_server_ip = upper_server_ip
+        self.upper_server_port = upper_server_port
+        self.upper = None
+        # Our session at the upper server, stable across restarts
+        if client_id is None:
+            client_id = socket.gethostname() + ":" + str(port)
+        self.client_id = client_id
+        self.is_root = upper_server_ip is None
+
+        if self.is_root and compression != 'none':
+            raise ValueError("The root sends no updates to compress")
+        if not self.is_root and downlink_compression != 'none':
+            raise ValueError("Only the root compresses broadcasts; other "
+                             "nodes forward them as received")
+        if not self.is_root and server_optimizer != 'none':
+            raise ValueError("Only the root steps the model; other nodes "
+                             "send their average upstream")
+
+        self.port = port
+        self.socket = None
+        self.client_conns = {}
+        # Client ID -> tenants multiplexed over its connection, if any
+        self.client_tenants = {}
+        self.clients_responded = set()
+
+        # Resume from the last checkpoint: the root goes on closing rounds
+        # from its version, other nodes serve their cached model to
+        # reconnecting clients until a newer one arrives
+        checkpoint = load_checkpoint(checkpoint_path)
+
+        # Only the root's first version needs NeuralNet's initial weights.
+        # Aggregating needs only the layout of its state, so other nodes
+        # build the model on the meta device for its layout alone.
+        if self.is_root and checkpoint is None:
+            from DDP.model.model import NeuralNet
+            self.model = NeuralNet()
+            self.state = FlatState(self.model)
+        else:
+            self.model = None
+            self.state = FlatState.from_schema(neural_net_schema())
+        self.sum = torch.zeros(self.state.size)
+        # Model version, one more for every round the root closes. Other
+        # nodes have none until the first model arrives from above.
+        self.seqnum = 0 if self.is_root else -1
+
+        if checkpoint is not None:
+            self.seqnum, tensors = checkpoint
+            if tensors[0].numel() != self.state.size:
+                raise ValueError("Checkpoint " + checkpoint_path
+                                 + " is not of this model")
+            self.state.load(tensors[0])
+            logger.info("Resumed model %d from %s", self.seqnum,
+                        checkpoint_path)
+
+        # Rounds close once `buffer_size` updates are in, or, if 0, when
+        # every connection responded. Stale updates count as `policy`
+        # allows.
+        self.buffer_size = buffer_size
+        self.n_buffered = 0
+        self.policy = StalenessPolicy(max_staleness, staleness_exponent)
+
+        # Broadcast versions: computed by the root, possibly with downlink
+        # compression, and forwarded as received by the other nodes. Our
+        # clients hold these models, so they are the reference of their
+        # deltas and ours. Never modified in place.
+        self.history = ModelHistory(
+            self.state.snapshot(), self.seqnum,
+            downlink_compression, topk_ratio,
+            max_versions=max(8, max_staleness + 1)
+        )
+        self.global_model = self.history.latest_model
+        self.compressor = Compressor(compression, topk_ratio)
+        # At the root, the round average is a step towards the next version
+        self.server_optimizer = ServerOptimizer(
+            server_optimizer, server_lr, server_momentum, server_beta2,
+            server_epsilon
+        )
+        if checkpoint is not None and self.is_root:
+            self.server_optimizer.load_state(tensors[1:])
+        elif checkpoint is not None and len(tensors) > 1:
+            self.compressor.residual = tensors[1]
+
+        self.checkpointer = None
+        if checkpoint_path is not None:
+            self.checkpointer = Checkpointer(checkpoint_path)
+        self.checkpoint_every = checkpoint_every
+
+        # With workers, updates are received and summed in other processes
+        if n_workers > 0:
+            self.pool = AggregationWorkerPool(
+                self.state.size, self.seqnum, n_workers, max_weight
+            )
+            self.accumulator = self.pool.accumulator
+            # (client ID, session number) -> connection read by a worker
+            self._dispatched = {}
+            self._n_sessions = itertools.count()
+        elif robust:
+            # Every update of the round is kept, up to `max_updates`, and
+            # aggregated by a rule that sees them all
+            self.pool = None
+            self.accumulator = RobustAccumulator(
+                self.state.size, self.seqnum, aggregator, trim_ratio,
+                clip_norm, capacity=max_updates, max_weight=max_weight
+            )
+        else:
+            self.pool = None
+            self.accumulator = ShardedAccumulator(
+                self.state.size, self.seqnum, max_weight=max_weight
+            )
+
+        # Optional training on this node, contributing like one more client
+        self.trainer = None
+        if train_weight > 0:
+            # Imported here: nodes that only aggregate never load the
+            # dataset
+            from data import BatchLoader, load_mnist
+            from trainer import BackgroundTrainer
+
+            self.dl = BatchLoader(*load_mnist(), batch_size=100)
+            self.trainer = BackgroundTrainer(
+                self.dl, self.add_training_result, weight=train_weight
+            )
+
+        self._key_lock = threading.Lock()
+        self.scheduler = RoundScheduler(self._key_lock)
+        self.broadcaster = Broadcaster(
+            on_error=self.handle_send_error, render=self.history.frames
+        )
+
+        self.set_up()
+
+        # Statistics
+        self.startSendTime_upper = time.time()
+        self.latency_upper = 0
+
+    def __del__(self):
+        self.shut_down()
+
+    def handle_request(self, client_conn, peer_addr):
+        """Handle request from clients."""
+        reader = FrameReader(client_conn)
+        try:
+            client_addr, n_tenants = self.greet_client(client_conn, reader)
+        except OSError as e:
+            logger.info("No hello from %s: %s", peer_addr, e)
+            client_conn.close()
+            return
+
+        if self.pool is not None:
+            # A worker process reads this client from now on
+            self.dispatch_client(client_conn, client_addr, n_tenants)
+            return
+
+        while True:
+            try:
+                msg_type, payload = reader.recv_frame()
+
+                if msg_type == MSG_CLOSE:
+                    self.remove_client(client_addr, client_conn)
+                    client_conn.close()
+                    return
+
+                if msg_type == MSG_ACK:
+                    self.broadcaster.ack(client_conn, decode_ack(payload))
+                    continue
+
+                with DECODE_SECONDS.time():
+                    data_rcv = decode_update(
+                        msg_type, payload, self.state.size, n_tenants
+                    )
+
+                logger.debug("Received %s from %s: seqnum %d, weight %s",
+                             KIND_NAMES[data_rcv['kind']], client_addr,
+                             data_rcv['seqnum'], data_rcv['weight'],
+                             every=UPDATE_LOG_EVERY)
+
+                accepted = self.add_update(client_addr, data_rcv)
+                self.report_update(client_addr, accepted)
+            except OSError:
+                # Also when a reconnection of the client shut this one down
+                self.remove_client(client_addr, client_conn)
+                client_conn.close()
+                return
+
+    def greet_client(self, client_conn, reader):
+        """Read a new connection's MSG_HELLO and register the connection
+        under the client ID, in place of any previous one of the client.
+        Return the client ID and the number of tenants it multiplexes.
+        """
+        client_conn.settimeout(HELLO_TIMEOUT)
+        msg_type, payload = reader.recv_frame()
+        client_conn.settimeout(None)
+        if msg_type != MSG_HELLO:
+            raise ProtocolError("Expected a hello, got message type "
+                                + str(msg_type))
+        client_id, acked, n_tenants = decode_hello(payload)
+
+        with self._key_lock:
+            old_conn = self.client_conns.get(client_id)
+            if old_conn is not None:
+                # Its reader sees the connection end and closes it
+                self.broadcaster.remove(old_conn)
+                shutdown_quietly(old_conn)
+
+            self.client_conns[client_id] = client_conn
+            self.client_tenants[client_id] = n_tenants
+            CLIENTS.set(len(self.client_conns))
+            self.scheduler.notify()
+
+            # Queued before any later broadcast can reach the client, as
+            # steps from the version it holds, or nothing if up to date
+            self.broadcaster.add(
+                client_conn, client_id, self.seqnum, acked=acked
+            )
+
+            logger.info("%s %s", client_id,
+                        "connected" if old_conn is None else "reconnected")
+
+        return client_id, n_tenants
+
+    def dispatch_client(self, client_conn, client_addr, n_tenants=0):
+        """Hand a greeted connection over to the aggregation workers."""
+        session = (client_addr, next(self._n_sessions))
+        self._dispatched[session] = client_conn
+        self.pool.dispatch(client_conn, session, n_tenants)
+
+    def add_update(self, client_addr, data_rcv):
+        """Add a client's update, or one of its tenants', to the current
+        round.
+
+        The update, of any kind, is added to this thread's accumulator
+        shard; `_key_lock` is only taken for the bookkeeping. Return False
+        if the update is too stale.
+        """
+        round_id = self.seqnum
+        with ACCUMULATE_SECONDS.time():
+            staleness = accumulate_stale(
+                self.accumulator, self.history, self.policy, data_rcv,
+                round_id
+            )
+        if staleness is None:
+            # Outdated, drop
+            return False
+
+        UPDATE_STALENESS.observe(staleness)
+        self.record_update(
+            participant(client_addr, data_rcv.get('tenant')), round_id
+        )
+        return True
+
+    def record_update(self, participant, seqnum):
+        """Count an update that is already in round `seqnum`."""
+        with self._key_lock:
+            if seqnum == self.seqnum:
+                self.clients_responded.add(participant)
+                self.n_buffered += 1
+                self.scheduler.notify()
+
+    def add_training_result(self, value, weight):
+        """Add the background trainer's model to the round open now."""
+        accepted = self.add_update(
+            'trainer',
+            {'value': value, 'weight': weight, 'seqnum': self.seqnum}
+        )
+        self.report_update('trainer', accepted)
+
+    def handle_worker_events(self):
+        """Follow the aggregation workers' updates and disconnections."""
+        # Workers know connections by the session `dispatch_client` gave
+        for event in self.pool.events():
+            if event[0] == 'update':
+                _, (client_addr, _), tenant, seqnum, _ = event
+                self.record_update(participant(client_addr, tenant), seqnum)
+                self.report_update(client_addr, True)
+            elif event[0] == 'ack':
+                _, session, seqnum = event
+                client_conn = self._dispatched.get(session)
+                if client_conn is not None:
+                    self.broadcaster.ack(client_conn, seqnum)
+            elif event[0] == 'closed':
+                session = event[1]
+                client_conn = self._dispatched.pop(session, None)
+                if client_conn is not None:
+                    self.remove_client(session[0], client_conn)
+                    client_conn.close()
+
+    def report_update(self, client_addr, accepted):
+        """Count and log the outcome of `add_update`."""
+        if not accepted:
+            UPDATES_DROPPED.inc()
+            logger.debug("Outdated update from %s dropped", client_addr,
+                         every=UPDATE_LOG_EVERY)
+            return
+
+        UPDATES_ACCEPTED.inc()
+        logger.debug("Current number of clients responded: %d, "
+                     "updates: %d, round open for %d ms",
+                     len(self.clients_responded), self.n_buffered,
+                     int((time.time() - self.scheduler.round_start_time)
+                         * 1000), every=UPDATE_LOG_EVERY)
+
+    def participants(self, client_id):
+        """The round participants behind a connection: the client, or
+        each tenant of a multi-client.
+        """
+        n_tenants = self.client_tenants.get(client_id, 0)
+        if n_tenants == 0:
+            return [client_id]
+        return [participant(client_id, tenant)
+                for tenant in range(n_tenants)]
+
+    def all_responded(self):
+        # The trainer may be among the responders but is never waited for
+        return all(
+            self.clients_responded.issuperset(self.participants(client_id))
+            for client_id in self.client_conns
+        )
+
+    def round_complete(self):
+        if self.buffer_size > 0:
+            return self.n_buffered >= self.buffer_size
+        return self.all_responded()
+
+    def has_clients(self):
+        return len(self.client_conns) > 0
+
+    def close_round(self):
+        """Average the round and return what it produces: at the root, the
+        new model version to broadcast, {'avg', 'seqnum'}; elsewhere, the
+        update for the upper server, {'value', 'weight', 'seqnum',
+        'reference'}. Return None if the round's total weight is not
+        positive. The caller must hold `_key_lock`.
+        """
+        round_id = self.seqnum
+        next_round_id = round_id + 1 if self.is_root else round_id
+        # Deltas were taken against the model of the round being closed
+        with REDUCE_SECONDS.time():
+            _, total_weight = self.accumulator.reduce(
+                next_round_id, out=self.sum, reference=self.global_model
+            )
+        if total_weight <= 0:
+            # Nothing to average, and dividing would send NaN on. Callers
+            # check the weight first, so only weights cancelling out get
+            # here.
+            self.accumulator.reset(round_id)
+            return None
+
+        ROUND_RESPONDERS.observe(len(self.clients_responded))
+        self.clients_responded = set()
+        self.n_buffered = 0
+        self.seqnum = next_round_id
+        torch.div(self.sum, total_weight, out=self.state.vector)
+
+        if not self.is_root:
+            # Weighed upstream by everything summed into it
+            return {
+                'value': self.state.snapshot(),
+                'weight': total_weight,
+                'seqnum': round_id,
+                'reference': self.global_model
+            }
+
+        self.server_optimizer.step(self.global_model, self.state.vector)
+        self.global_model = self.history.advance(
+            self.seqnum, self.state.vector
+        )
+        return {
+            'avg': self.global_model,
+            'seqnum': self.seqnum
+        }
+
+    def end_round(self, all_responded):
+        """End the round the scheduler let close. Return what `close_round`
+        returns, or None if nothing was summed into the round. The caller
+        must hold `_key_lock`.
+
+        Whether the round is empty is the accumulator's call: an update
+        counted by `record_update` after its round closed is not in it.
+        """
+        data = None
+        if self.accumulator.total_weight > 0:
+            data = self.close_round()
+        self.scheduler.end_round(all_responded, empty=data is None)
+        if data is None:
+            self.clients_responded = set()
+            self.n_buffered = 0
+        return data
+
+    def finish_round(self, data):
+        """Pass on what `close_round` returned: broadcast the new model at
+        the root, send the update upstream elsewhere.
+        """
+        if not self.is_root:
+            self.send_to_upper_server(data)
+            return
+
+        self.broadcast_to_clients(data)
+        self.save_checkpoint()
+
+        if self.trainer is not None:
+            self.trainer.submit(data['avg'])
+
+    def receive_model(self, msg_type, payload):
+        """Decode a model from the upper server, sent whole or as a step
+        from the current one, and add it to `history`.
+
+        Return {'avg', 'seqnum'}, with a model that no longer shares memory
+        with the payload, or None if the step does not start from the
+        current model.
+        """
+        if msg_type == MSG_MODEL_DELTA:
+            step = decode_model_delta(payload, self.state.size)
+            if step['base'] != self.seqnum:
+                return None
+
+            model = self.global_model.clone()
+            apply_delta(model, step['kind'], step['tensors'])
+            self.history.add_step(
+                step['base'], step['seqnum'], step['kind'],
+                [tensor.clone() for tensor in step['tensors']], model
+            )
+            return {'avg': model, 'seqnum': step['seqnum']}
+
+        data_rcv = decode_model(payload)
+        model = self.history.add_model(
+            data_rcv['seqnum'], data_rcv['avg'].clone()
+        )
+        return {'avg': model, 'seqnum': data_rcv['seqnum']}
+
+    def set_global_model(self, data_rcv):
+        """Adopt the new average from the upper server and start a new
+        round. The caller must hold `_key_lock`.
+        """
+        self.global_model = data_rcv['avg']
+        self.state.load(self.global_model)
+        self.accumulator.reset(data_rcv['seqnum'])
+        self.n_buffered = 0
+        self.seqnum = data_rcv['seqnum']
+        self.save_checkpoint()
+
+    def save_checkpoint(self):
+        """Hand the current version, with the residual of our compressed
+        updates or, at the root, the server optimizer state, to the
+        background checkpoint writer, every `checkpoint_every` versions.
+        """
+        if (self.checkpointer is None
+                or self.seqnum % self.checkpoint_every != 0):
+            return
+
+        tensors = [self.global_model]
+        if self.is_root:
+            tensors.extend(self.server_optimizer.state())
+        elif self.compressor.residual is not None:
+            tensors.append(self.compressor.residual)
+        self.checkpointer.submit(self.seqnum, tensors)
+
+    def broadcast_to_clients(self, data):
+        """Queue model data for all clients.
+
+        The broadcaster's writers send each client the steps from the last
+        version it acknowledged, or the whole model, as encoded once by
+        `history`; nothing here waits for a client.
+        """
+        self.broadcaster.broadcast(data['seqnum'])
+
+    def handle_send_error(self, client_conn, client_addr):
+        """Drop a client the broadcaster failed to send to. Its reader sees
+        the connection end and closes it.
+        """
+        shutdown_quietly(client_conn)
+        self.remove_client(client_addr, client_conn)
+
+    def remove_client(self, client_addr, client_conn):
+        """Remove a client's connection, unless the client already
+        reconnected on another one. An update the client sent stays in the
+        round, so a client back within the round need not send it again.
+        """
+        with self._key_lock:
+            if self.client_conns.get(client_addr) is not client_conn:
+                return
+
+            del self.client_conns[client_addr]
+            self.client_tenants.pop(client_addr, None)
+            CLIENTS.set(len(self.client_conns))
+            self.broadcaster.remove(client_conn)
+            self.scheduler.notify()
+
+            logger.info("Client %s disconnected.", client_addr)
+
+    def encode_update(self, data):
+        """Compress the round's update against the model it started from.
+
+        Return (msg_type, buffers).
+        """
+        return self.compressor.encode(
+            data['value'], data['reference'], data['weight'], data['seqnum']
+        )
+
+    def send_to_upper_server(self, data):
+        """Send aggregated update to upper server."""
+        logger.debug("Sent data: seqnum %d, weight %s, value %s",
+                     data['seqnum'], data['weight'], data['value'])
+        msg_type, buffers = self.encode_update(data)
+        self.startSendTime_upper = time.time()
+        if not self.upper.send(msg_type, *buffers):
+            logger.warning("Upper server unreachable, update for model %d "
+                           "dropped", data['seqnum'])
+
+    def ack_upper_server(self, seqnum):
+        """Tell the upper server which model we hold."""
+        self.upper.send(MSG_ACK, *encode_ack(seqnum))
+
+    def aggregate_on_schedule(self):
+        """Close a round as soon as the scheduler allows, and pass it on."""
+        while True:
+            with self._key_lock:
+                all_responded = self.scheduler.wait_for_round(
+                    self.round_complete, self.has_clients
+                )
+
+                data = self.end_round(all_responded)
+                if data is None:
+                    continue
+                wait_time = self.scheduler.wait_times[-1]
+
+            logger.info("Round closed after %d ms%s", int(wait_time*1000),
+                        " (all responded)" if all_responded else "")
+            self.finish_round(data)
+
+    def wait_for_clients(self):
+        """Wait for clients' request for connection and provide worker thread
+        serving the client.
+        """
+        while True:
+            # Wait for client
+            client_conn, (client_ip, client_port) = self.socket.accept()
+
+            # Provide worker thread to greet and serve client; it is
+            # registered once it said who it is
+            worker_thread = threading.Thread(
+                target=self.handle_request,
+                args=(client_conn, client_ip + ":" + str(client_port))
+            )
+            worker_thread.daemon = True
+            worker_thread.start()
+
+    def wait_for_upper_server(self):
+        """Wait receive new avg."""
+        # Reconnects and resumes our session as needed
+        for msg_type, payload in self.upper.frames():
+            # Receive input parameter from server
+            self.latency_upper = time.time() - self.startSendTime_upper
+            with MODEL_DECODE_SECONDS.time():
+                data_rcv = self.receive_model(msg_type, payload)
+            if data_rcv is None:
+                # Steps will be sent from the version we have
+                self.ack_upper_server(self.seqnum)
+                continue
+
+            self.report_upper_model(data_rcv)
+
+            with self._key_lock:
+                self.set_global_model(data_rcv)
+            self.ack_upper_server(data_rcv['seqnum'])
+
+            # Send number to all clients
+            self.broadcast_to_clients(data_rcv)
+
+            if self.trainer is not None:
+                self.trainer.submit(data_rcv['avg'])
+
+    def report_upper_model(self, data_rcv):
+        UPPER_REPLY_SECONDS.observe(self.latency_upper)
+        logger.info("Received model %d from upper server %s:%s: "
+                    "time=%d ms", data_rcv['seqnum'], self.upper_server_ip,
+                    self.upper_server_port, int(self.latency_upper*1000))
+        logger.debug("Model %d: %s", data_rcv['seqnum'], data_rcv['avg'])
+
+    def set_up(self):
+        """Set up socket and, below the root, connection to upper server."""
+        self.set_up_socket()
+        if not self.is_root:
+            self.set_up_conn_to_upper_server()
+
+    def set_up_socket(self):
+        """Set up socket."""
+        print_msg("Starting server.")
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        self.socket.bind(('', self.port))
+        self.socket.listen(100)
+
+        print_msg("Server started.")
+        print_msg("------------------------------------")
+
+    def set_up_conn_to_upper_server(self):
+        """Set up connection to server, waiting for it if need be."""
+        print_msg("Creating connection to upper server")
+
+        self.upper = UpstreamConnection(
+            self.upper_server_ip, self.upper_server_port, self.client_id,
+            lambda: self.seqnum
+        )
+        self.upper.connect()
+
+    def run(self):
+        """Call this method to run the node."""
+        client_wait_thread = threading.Thread(
+            target=self.wait_for_clients
+        )
+        client_wait_thread.daemon = True
+        client_wait_thread.start()
+
+        if not self.is_root:
+            upper_thread = threading.Thread(
+                target=self.wait_for_upper_server
+            )
+            upper_thread.daemon = True
+            upper_thread.start()
+
+        if self.trainer is not None:
+            self.trainer.start()
+            self.trainer.submit(self.global_model)
+
+        if self.pool is not None:
+            worker_events_thread = threading.Thread(
+                target=self.handle_worker_events
+            )
+            worker_events_thread.daemon = True
+            worker_events_thread.start()
+
+        self.aggregate_on_schedule()
+
+    def shut_down(self):
+        """Properly shut down the node."""
+        print_msg("Shutting down server.")
+
+        if self.upper is not None:
+            self.upper.close()
+
+        self.socket.close()
+        if self.pool is not None:
+            self.pool.shut_down()
+        if self.checkpointer is not None:
+            self.checkpointer.flush()
+
+
+def add_node_arguments(parser):
+    """Add the options every node takes to an argparse parser."""
+    parser.add_argument(
+        '--workers', type=int, default=0,
+        help="receive and aggregate updates in this many worker processes "
+             "(Unix only; default: 0, threads in this process)"
+    )
+    parser.add_argument(
+        '--train-weight', type=float, default=0,
+        help="train on this node's MNIST copy in the background and add "
+             "the result to the next round with this weight (default: 0, "
+             "no training)"
+    )
+    parser.add_argument(
+        '--compression', choices=SCHEMES, default='none',
+        help="how updates are sent to the upper server (default: none, the "
+             "whole model)"
+    )
+    parser.add_argument(
+        '--downlink-compression', choices=SCHEMES, default='none',
+        help="at the root, broadcast each new model as a compressed step "
+             "from the version a client acknowledged (default: none, the "
+             "whole model)"
+    )
+    parser.add_argument(
+        '--topk-ratio', type=float, default=0.01,
+        help="fraction of each delta or step sent by the topk schemes "
+             "(default: 0.01)"
+    )
+    parser.add_argument(
+        '--buffer-size', type=int, default=0,
+        help="close a round as soon as this many updates are in, instead "
+             "of waiting for every connection (default: 0, wait)"
+    )
+    parser.add_argument(
+        '--max-staleness', type=int, default=0,
+        help="accept updates trained from up to this many versions back, "
+             "weighed down by staleness (default: 0, current version only)"
+    )
+    parser.add_argument(
+        '--staleness-exponent', type=float, default=0.5,
+        help="stale updates count (1 + staleness) ** -exponent "
+             "(default: 0.5)"
+    )
+    parser.add_argument(
+        '--client-id',
+        help="session ID at the upper server, kept across reconnections "
+             "(default: <hostname>:<port>)"
+    )
+    parser.add_argument(
+        '--checkpoint', metavar='PATH',
+        help="save the model version to this file in the background, and "
+             "resume from it on start (default: none)"
+    )
+    parser.add_argument(
+        '--checkpoint-every', type=int, default=1,
+        help="save every this many versions (default: 1)"
+    )
+    parser.add_argument(
+        '--aggregator', choices=list(AGGREGATORS), default='mean',
+        help="how a round's updates are combined: their weighted mean, or "
+             "per coordinate their trimmed mean or median, each update "
+             "counting once whatever its weight (default: mean)"
+    )
+    parser.add_argument(
+        '--trim-ratio', type=float, default=0.1,
+        help="fraction of the smallest and of the largest values dropped "
+             "per coordinate by trimmed-mean (default: 0.1)"
+    )
+    parser.add_argument(
+        '--clip-norm', type=float, default=0.0,
+        help="scale each update's change to the model down to at most "
+             "this L2 norm (default: 0, no clipping)"
+    )
+    parser.add_argument(
+        '--max-updates', type=int, default=256,
+        help="with a robust aggregator or clipping, updates kept per round; "
+             "more are dropped (default: 256)"
+    )
+    parser.add_argument(
+        '--max-weight', type=float, default=0.0,
+        help="cap the weight each update reports at this (default: 0, no "
+             "cap)"
+    )
+    parser.add_argument(
+        '--server-optimizer', choices=OPTIMIZERS, default='none',
+        help="at the root, step from the current model along the round's "
+             "average change with momentum (FedAvgM) or Adam (FedAdam) "
+             "(default: none, the average is the new model)"
+    )
+    parser.add_argument(
+        '--server-lr', type=float, default=1.0,
+        help="learning rate of the server optimizer (default: 1.0; around "
+             "0.01 suits adam)"
+    )
+    parser.add_argument(
+        '--server-momentum', type=float, default=0.9,
+        help="momentum, or Adam's beta1, of the server optimizer "
+             "(default: 0.9)"
+    )
+    parser.add_argument(
+        '--server-beta2', type=float, default=0.99,
+        help="Adam's beta2 (default: 0.99)"
+    )
+    parser.add_argument(
+        '--server-epsilon', type=float, default=1e-3,
+        help="Adam's epsilon, bounding its steps (default: 0.001)"
+    )
+
+
+def node_options(args):
+    """Return the keyword arguments of AggregationNode from parsed
+    `add_node_arguments` options.
+    """
+    return {
+        'n_workers': args.workers,
+        'train_weight': args.train_weight,
+        'compression': args.compression,
+        'downlink_compression': args.downlink_compression,
+        'topk_ratio': args.topk_ratio,
+        'buffer_size': args.buffer_size,
+        'max_staleness': args.max_staleness,
+        'staleness_exponent': args.staleness_exponent,
+        'client_id': args.client_id,
+        'checkpoint_path': args.checkpoint,
+        'checkpoint_every': args.checkpoint_every,
+        'aggregator': args.aggregator,
+        'trim_ratio': args.trim_ratio,
+        'clip_norm': args.clip_norm,
+        'max_updates': args.max_updates,
+        'max_weight': args.max_weight,
+        'server_optimizer': args.server_optimizer,
+        'server_lr': args.server_lr,
+        'server_momentum': args.server_momentum,
+        'server_beta2': args.server_beta2,
+        'server_epsilon': args.server_epsilon,
+    }
+
+
+def parse_address(address):
+    """Parse 'host:port' for argparse."""
+    host, _, port = address.rpartition(':')
+    try:
+        return host or 'localhost', int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected host:port, got " + repr(address)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Aggregation node at any tier: the root without "
+                    "--upper, an intermediate or edge node with it"
+    )
+    parser.add_argument('port', type=int)
+    parser.add_argument(
+        '--upper', type=parse_address, metavar='HOST:PORT',
+        help="the node above this one (default: none, this is the root)"
+    )
+    parser.add_argument(
+        '--mode', choices=['thread', 'asyncio'], default='thread',
+        help="serve clients with one thread each or, below the root, with "
+             "an asyncio event loop (default: thread)"
+    )
+    add_node_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    metrics.start(args)
+
+    if args.mode == 'asyncio':
+        if args.upper is None:
+            parser.error("--mode asyncio needs --upper")
+
+        from async_edge_server import AsyncEdgeServer
+        node = AsyncEdgeServer(
+            args.upper[0], args.upper[1], args.port, **node_options(args)
+        )
+    elif args.upper is None:
+        node = AggregationNode(args.port, **node_options(args))
+    else:
+        node = AggregationNode(
+            args.port, args.upper[0], args.upper[1], **node_options(args)
+        )
+    node.run()
+
+
+if __name__ == '__main__':
+    main()
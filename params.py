@@ -0,0 +1,85 @@
+import torch
+
+
+def neural_net_schema():
+    """Return the (name, shape) of NeuralNet's floating-point state
+    (DDP/model/model.py), in state_dict order, for nodes that only
+    aggregate and lay their vectors out from it.
+
+    With PyTorch 2.0 or newer, the model is built on the meta device, so
+    its tensors have shapes but no memory and are never initialized.
+    """
+    from DDP.model.model import NeuralNet
+
+    meta = torch.device('meta')
+    if hasattr(meta, '__enter__'):
+        with meta:
+            model = NeuralNet()
+    else:
+        model = NeuralNet()
+    return [
+        (name, tuple(tensor.shape))
+        for name, tensor in model.state_dict().items()
+        if tensor.is_floating_point()
+    ]
+
+
+class FlatState:
+    """Keep all floating-point state of a model in one contiguous vector.
+
+    Every parameter and floating-point buffer (including BatchNorm running
+    mean and variance) is rebound as a view into `self.vector`, so the model
+    trains and evaluates as usual while aggregation works on the whole model
+    with single vectorized ops. Integer buffers such as BatchNorm's
+    `num_batches_tracked` are per-node counters and stay out of the vector.
+    """
+
+    def __init__(self, model):
+        entries = [
+            (name, tensor)
+            for name, tensor in model.state_dict(keep_vars=True).items()
+            if tensor.is_floating_point()
+        ]
+
+        self.vector = torch.cat(
+            [tensor.detach().reshape(-1) for _, tensor in entries]
+        )
+        self.schema = []
+
+        offset = 0
+        for name, tensor in entries:
+            numel = tensor.numel()
+            tensor.data = self.vector[offset:offset + numel].view_as(tensor)
+            self.schema.append((name, tuple(tensor.shape), offset))
+            offset += numel
+
+    @classmethod
+    def from_schema(cls, schema):
+        """Return a FlatState without a model: a zero vector laid out as
+        `schema`, a list of (name, shape), for nodes that only aggregate.
+        """
+        state = cls.__new__(cls)
+        state.schema = []
+
+        offset = 0
+        for name, shape in schema:
+            state.schema.append((name, tuple(shape), offset))
+            numel = 1
+            for dim in shape:
+                numel *= dim
+            offset += numel
+
+        state.vector = torch.zeros(offset)
+        return state
+
+    @property
+    def size(self):
+        return self.vector.numel()
+
+    def snapshot(self):
+        """Return a copy of the current state vector."""
+        return self.vector.clone()
+
+    def load(self, vector):
+        """Overwrite the model state with the given flat vector."""
+        self.vector.copy_(vector)
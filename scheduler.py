@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import threading
+import time
+
+from metrics import registry
+
+ROUND_SECONDS = registry.histogram(
+    'fl_round_seconds', "Time from a round's start to its close"
+)
+ROUND_CLOSES = {
+    reason: registry.counter(
+        'fl_round_closes_total', "Closed rounds, by reason", reason=reason
+    )
+    for reason in ('complete', 'deadline', 'empty')
+}
+
+
+class RoundScheduler:
+    """Decide when an aggregation round closes.
+
+    A round closes as soon as every connected participant has responded or
+    when the adaptive deadline expires, whichever comes first. Waiters are
+    woken by `notify` instead of polling, so an early close costs no idle
+    time. The deadline halves (down to `min_delay`) after rounds where
+    everybody responded and grows (up to `max_delay`) otherwise.
+
+    The scheduler shares the owner's lock: `notify` and `wait_for_round` must
+    be called with it held. Times come from `clock`, which a simulation
+    (see simulator.py) replaces with virtual time; it then checks the
+    deadline itself and only calls `end_round`.
+    """
+
+    def __init__(self, lock, delay_time=10.0, min_delay=5.0, max_delay=30.0,
+                 history_size=1000, clock=time.time):
+        self.condition = threading.Condition(lock)
+        self.clock = clock
+        self.delay_time = delay_time
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.round_start_time = clock()
+
+        # Metrics: how long each round waited, and why it closed
+        self.wait_times = collections.deque(maxlen=history_size)
+        self.n_early_closes = 0
+        self.n_deadline_closes = 0
+        self.n_empty_rounds = 0
+
+        self._event = None
+
+    def notify(self):
+        """Wake the waiter: an update arrived or a participant came or left."""
+        self.condition.notify_all()
+        if self._event is not None:
+            self._event.set()
+
+    def wait_for_round(self, all_responded, has_participants):
+        """Block until the round can close.
+
+        Both arguments are callables evaluated with the lock held. Return
+        True if everybody responded, False if the deadline expired.
+        """
+        while True:
+            if not has_participants():
+                # Nobody to wait for: the deadline starts with the first one
+                self.round_start_time = self.clock()
+                self.condition.wait()
+                continue
+
+            if all_responded():
+                return True
+
+            remaining = self.round_start_time + self.delay_time - self.clock()
+            if remaining <= 0:
+                return False
+
+            self.condition.wait(remaining)
+
+    async def wait_for_round_async(self, all_responded, has_participants):
+        """Coroutine version of `wait_for_round` for single-threaded event
+        loop servers, where no lock needs to be held.
+        """
+        if self._event is None:
+            self._event = asyncio.Event()
+
+        while True:
+            self._event.clear()
+
+            if not has_participants():
+                self.round_start_time = self.clock()
+                await self._event.wait()
+                continue
+
+            if all_responded():
+                return True
+
+            remaining = self.round_start_time + self.delay_time - self.clock()
+            if remaining <= 0:
+                return False
+
+            try:
+                await asyncio.wait_for(self._event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def end_round(self, all_responded, empty=False):
+        """Record the closed round, adapt the deadline and start a new one."""
+        now = self.clock()
+        self.wait_times.append(now - self.round_start_time)
+        if not empty:
+            ROUND_SECONDS.observe(now - self.round_start_time)
+
+        if empty:
+            ROUND_CLOSES['empty'].inc()
+            self.n_empty_rounds += 1
+            self.delay_time = min([self.delay_time * 2.0, self.max_delay])
+        elif all_responded:
+            ROUND_CLOSES['complete'].inc()
+            self.n_early_closes += 1
+            self.delay_time = max([self.delay_time / 2.0, self.min_delay])
+        else:
+            ROUND_CLOSES['deadline'].inc()
+            self.n_deadline_closes += 1
+            self.delay_time = min([self.delay_time * 1.1, self.max_delay])
+
+        self.round_start_time = now
+
+    def stats(self):
+        """Return a summary of the recorded round wait times."""
+        wait_times = list(self.wait_times)
+        return {
+            'rounds': len(wait_times),
+            'last_wait': wait_times[-1] if wait_times else 0.0,
+            'mean_wait': (
+                sum(wait_times) / len(wait_times) if wait_times else 0.0
+            ),
+            'max_wait': max(wait_times) if wait_times else 0.0,
+            'early_closes': self.n_early_closes,
+            'deadline_closes': self.n_deadline_closes,
+            'empty_rounds': self.n_empty_rounds,
+            'delay_time': self.delay_time,
+        }
@@ -0,0 +1,81 @@
+import torch
+
+from utils import logger
+
+# none: the new model is the round's average (FedAvg)
+# momentum: heavy-ball momentum on the averaged change (FedAvgM)
+# adam: Adam on the averaged change (FedAdam)
+OPTIMIZERS = ('none', 'momentum', 'adam')
+
+
+class ServerOptimizer:
+    """Turn the root's round average into the next model version.
+
+    The change from the current model to the average is a pseudo-gradient
+    (its opposite), stepped along with momentum or Adam at
+    `learning_rate`, as in Adaptive Federated Optimization (Reddi et al.,
+    2021). With 'none', or 'momentum' at learning rate 1 and momentum 0,
+    the average is the new model.
+
+    The optimizer state lasts across rounds and is replaced on each step,
+    never modified in place, so `state()` can be checkpointed as is.
+    """
+
+    def __init__(self, name='none', learning_rate=1.0, momentum=0.9,
+                 beta2=0.99, epsilon=1e-3):
+        if name not in OPTIMIZERS:
+            raise ValueError("Unknown server optimizer: " + name)
+        self.name = name
+        self.learning_rate = learning_rate
+        self.momentum = momentum
+        self.beta2 = beta2
+        self.epsilon = epsilon
+
+        # First and, for Adam, second moment of the averaged change
+        self.moments = []
+
+    def step(self, model, average):
+        """Replace `average`, in place, by the next model after `model`,
+        which is left untouched.
+        """
+        if self.name == 'none':
+            return
+
+        change = average.sub_(model)
+        if self.name == 'momentum':
+            if self.moments:
+                velocity = torch.add(change, self.moments[0],
+                                     alpha=self.momentum)
+            else:
+                velocity = change.clone()
+            self.moments = [velocity]
+            step = velocity
+        else:
+            if self.moments:
+                first, second = self.moments
+            else:
+                first = torch.zeros_like(change)
+                # As in FedAdam, starting from epsilon squared keeps the
+                # first steps from blowing up
+                second = torch.full_like(change, self.epsilon ** 2)
+            first = torch.lerp(first, change, 1 - self.momentum)
+            second = torch.lerp(second, change.square(), 1 - self.beta2)
+            self.moments = [first, second]
+            step = first / second.sqrt().add_(self.epsilon)
+
+        torch.add(model, step, alpha=self.learning_rate, out=average)
+
+    def state(self):
+        """Return the optimizer state as a list of tensors."""
+        return self.moments
+
+    def load_state(self, tensors):
+        """Restore `state()`, unless it was saved by another optimizer."""
+        n_moments = {'none': 0, 'momentum': 1, 'adam': 2}[self.name]
+        if not tensors:
+            return
+        if len(tensors) != n_moments:
+            logger.warning("Saved server optimizer state does not match "
+                           "'%s', starting afresh", self.name)
+            return
+        self.moments = list(tensors)
@@ -0,0 +1,579 @@
+"""Deterministic, in-process simulation of the aggregation tree.
+
+A root, M edges and N clients run in one process on a virtual clock, so
+what-if experiments (round policies, staleness, compression, slow clients,
+slow links) take minutes instead of hours of wall-clock rounds. The root
+and edges are real aggregation nodes (node.py) without sockets: updates go
+through their accumulators, staleness policy, history and scheduler, and
+the edges' updates and the root's broadcasts are encoded and decoded as on
+the wire. Only the transport and the clients are simulated:
+
+- each link has a latency and a bandwidth per tier; a message takes the
+  latency plus its size over the bandwidth, and messages on one link
+  arrive in order, but transfers do not slow each other down;
+- a client trains for `--local-steps` SGD steps on its shard of MNIST,
+  taking `--step-time` virtual seconds per step, times a random factor in
+  [0.5, 1.5) and `--slow-factor` for the slow ones. Training itself runs
+  for many clients at once, each with its own model (vectorized.py).
+
+Everything random is drawn from `--seed`, so a run is reproducible.
+
+    python simulator.py --edges 4 --clients 1000 --rounds 30
+"""
+import argparse
+import heapq
+import itertools
+import json
+import time
+
+import torch
+
+import codec
+from aggregators import AGGREGATORS
+from compression import SCHEMES, decode_update
+from data import load_mnist, split_shards
+from node import AggregationNode
+from params import FlatState
+from scheduler import RoundScheduler
+from server_opt import OPTIMIZERS
+from vectorized import VectorizedTrainer
+from DDP.model.model import NeuralNet
+
+
+class VirtualClock:
+    """Simulated seconds since the start, advanced by the event loop."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Link:
+    """A simulated network link: `latency` seconds plus the transfer time at
+    `bandwidth` bytes per second.
+    """
+
+    def __init__(self, latency, bandwidth):
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def delay(self, n_bytes):
+        return self.latency + n_bytes / self.bandwidth
+
+
+def parse_link(value):
+    """Parse '<latency ms>:<Mbit/s>' for argparse."""
+    try:
+        latency, bandwidth = value.split(':')
+        return Link(float(latency) / 1000, float(bandwidth) * 1e6 / 8)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected <latency ms>:<Mbit/s>, got " + repr(value)
+        )
+
+
+class SimulatedNode(AggregationNode):
+    """An aggregation node without sockets, driven by a Simulation.
+
+    Connections below it are registered by ID only, and its scheduler runs
+    on the simulation's clock; the simulation checks the round deadline
+    and ends rounds through `end_round`.
+    """
+
+    def __init__(self, clock, port, upper_server_ip=None,
+                 upper_server_port=None, **kwargs):
+        super().__init__(port, upper_server_ip, upper_server_port, **kwargs)
+        self.scheduler = RoundScheduler(self._key_lock, clock=clock)
+        # Bumped when a round ends, so earlier deadline events are ignored
+        self.n_rounds = 0
+
+    def set_up(self):
+        pass
+
+    def shut_down(self):
+        pass
+
+    def connect(self, client_id):
+        self.client_conns[client_id] = client_id
+
+
+class Evaluator:
+    """Accuracy and loss of a flat model vector on a test set."""
+
+    def __init__(self, images, labels, batch_size=1000):
+        self.images = images
+        self.labels = labels
+        self.batch_size = batch_size
+        self.model = NeuralNet()
+        self.state = FlatState(self.model)
+
+    def evaluate(self, vector):
+        self.state.load(vector)
+        self.model.eval()
+
+        n_correct = 0
+        total_loss = 0.0
+        with torch.no_grad():
+            for start in range(0, len(self.labels), self.batch_size):
+                images = self.images[start:start + self.batch_size]
+                labels = self.labels[start:start + self.batch_size]
+                output = self.model(images)
+                total_loss += float(torch.nn.functional.cross_entropy(
+                    output, labels, reduction='sum'
+                ))
+                n_correct += int((output.argmax(1) == labels).sum())
+        return n_correct / len(self.labels), total_loss / len(self.labels)
+
+
+def _size(buffers):
+    return sum(memoryview(buffer).nbytes for buffer in buffers)
+
+
+class Simulation:
+    """Clients, edges and a root, run event by event on a virtual clock."""
+
+    def __init__(self, args):
+        torch.manual_seed(args.seed)
+        generator = torch.Generator().manual_seed(args.seed)
+
+        self.args = args
+        self.generator = generator
+        self.clock = VirtualClock()
+        # (time, order, callback, args); the order keeps ties first-in,
+        # first-out
+        self.events = []
+        self._order = itertools.count()
+        # Link key -> arrival of the last message, to keep messages in order
+        self._arrivals = {}
+
+        node_options = {
+            'topk_ratio': args.topk_ratio,
+            'max_staleness': args.max_staleness,
+            'staleness_exponent': args.staleness_exponent,
+            'trim_ratio': args.trim_ratio,
+            'clip_norm': args.clip_norm,
+            'max_weight': args.max_weight,
+            'max_updates': max(args.clients, args.edges),
+        }
+        self.root = SimulatedNode(
+            self.clock, 0, client_id='root',
+            downlink_compression=args.downlink_compression,
+            buffer_size=args.root_buffer_size,
+            aggregator=args.root_aggregator,
+            server_optimizer=args.server_optimizer,
+            server_lr=args.server_lr, server_momentum=args.server_momentum,
+            server_beta2=args.server_beta2,
+            server_epsilon=args.server_epsilon, **node_options
+        )
+        self.edges = [
+            SimulatedNode(
+                self.clock, edge + 1, 'root', 0,
+                client_id='edge' + str(edge), compression=args.compression,
+                buffer_size=args.buffer_size, aggregator=args.aggregator,
+                **node_options
+            )
+            for edge in range(args.edges)
+        ]
+        # Last version each edge and client acknowledged
+        self.edge_acked = [None] * args.edges
+        self.client_acked = [None] * args.clients
+
+        for edge in self.edges:
+            self.root.connect(edge.client_id)
+        for client in range(args.clients):
+            self.edge_of(client).connect(self.client_id(client))
+
+        n_slow = int(args.clients * args.slow_fraction)
+        slow = set(torch.randperm(args.clients, generator=generator)
+                   [:n_slow].tolist())
+        self.speeds = [
+            args.slow_factor if client in slow else 1.0
+            for client in range(args.clients)
+        ]
+
+        images, labels = load_mnist(train=True)
+        self.trainer = VectorizedTrainer(
+            images, labels,
+            split_shards(labels, args.clients, args.non_iid, generator),
+            args.local_steps, args.batch_size, args.learning_rate,
+            args.chunk_size, args.seed
+        )
+        self.evaluator = Evaluator(*load_mnist(train=False))
+
+        # Client -> (seqnum, model) it trains from, and the trained model
+        # once computed. Training is computed lazily, for all waiting jobs
+        # at once, when the first of them is due.
+        self.jobs = {}
+        self.waiting = []
+        self.results = {}
+        # Client -> newest (seqnum, model) received while training
+        self.received = {}
+        self.update_size = _size(codec.encode_update(
+            self.root.global_model, 1, 0
+        ))
+
+        self.n_trained = 0
+        self.training_time = 0.0
+        # Tier -> [accepted, dropped]
+        self.updates = {'edge': [0, 0], 'root': [0, 0]}
+        self.n_bytes = {'client_up': 0, 'client_down': 0,
+                        'edge_up': 0, 'edge_down': 0}
+        self.evaluations = []
+
+    def client_id(self, client):
+        return 'client' + str(client)
+
+    def edge_of(self, client):
+        return self.edges[client % len(self.edges)]
+
+    def schedule(self, delay, callback, *args):
+        heapq.heappush(self.events, (
+            self.clock.now + delay, next(self._order), callback, args
+        ))
+
+    def deliver(self, key, link, n_bytes, callback, *args):
+        """Call `callback(*args)` when a message of `n_bytes` sent now
+        over `link` arrives, after every earlier message with this key.
+        """
+        arrival = max(self.clock.now + link.delay(n_bytes),
+                      self._arrivals.get(key, 0.0))
+        self._arrivals[key] = arrival
+        self.schedule(arrival - self.clock.now, callback, *args)
+
+    def run(self):
+        """Simulate until the root published `--rounds` versions or the
+        virtual clock reached `--max-time`.
+        """
+        self.evaluate()
+        for edge in range(len(self.edges)):
+            self.send_model(edge, self.root.seqnum)
+        for node in [self.root] + self.edges:
+            self.schedule_deadline(node)
+
+        while (self.events and self.root.seqnum < self.args.rounds
+               and self.clock.now < self.args.max_time
+               and not self.reached_target()):
+            self.clock.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+
+        if self.evaluations[-1]['seqnum'] != self.root.seqnum:
+            self.evaluate()
+
+    def reached_target(self):
+        target = self.args.target_accuracy
+        return (target is not None
+                and self.evaluations[-1]['accuracy'] >= target)
+
+    def schedule_deadline(self, node):
+        scheduler = node.scheduler
+        self.schedule(
+            scheduler.round_start_time + scheduler.delay_time
+            - self.clock.now,
+            self.deadline, node, node.n_rounds
+        )
+
+    def deadline(self, node, n_rounds):
+        if n_rounds == node.n_rounds:
+            self.end_round(node, False)
+
+    def end_round(self, node, all_responded):
+        node.n_rounds += 1
+        data = node.end_round(all_responded)
+        self.schedule_deadline(node)
+        if data is None:
+            return
+
+        if node.is_root:
+            self.publish(data['seqnum'])
+        else:
+            self.send_update(self.edges.index(node), data)
+
+    def add_update(self, node, tier, client_id, data_rcv):
+        accepted = node.add_update(client_id, data_rcv)
+        node.report_update(client_id, accepted)
+        self.updates[tier][0 if accepted else 1] += 1
+        if node.round_complete():
+            self.end_round(node, True)
+
+    def evaluate(self):
+        accuracy, loss = self.evaluator.evaluate(self.root.global_model)
+        self.evaluations.append({
+            'seqnum': self.root.seqnum,
+            'time': self.clock.now,
+            'accuracy': accuracy,
+            'loss': loss,
+            'bytes': sum(self.n_bytes.values()),
+        })
+        print("version {:>4}  time {:>9.1f} s  accuracy {:.4f}  "
+              "loss {:.4f}".format(self.root.seqnum, self.clock.now,
+                                   accuracy, loss))
+
+    # Root
+
+    def publish(self, seqnum):
+        if seqnum % self.args.eval_every == 0:
+            self.evaluate()
+        for edge in range(len(self.edges)):
+            self.send_model(edge, seqnum)
+
+    def send_model(self, edge, seqnum):
+        frames = [
+            (msg_type, bytearray().join(buffers))
+            for msg_type, buffers in self.root.history.frames(
+                self.edge_acked[edge], seqnum
+            )
+        ]
+        n_bytes = sum(len(payload) for _, payload in frames)
+        self.n_bytes['edge_down'] += n_bytes
+        self.deliver(('edge_down', edge), self.args.edge_link, n_bytes,
+                     self.receive_model, edge, frames)
+
+    def receive_update(self, edge, msg_type, payload):
+        data_rcv = decode_update(msg_type, payload, self.root.state.size)
+        self.add_update(self.root, 'root', self.edges[edge].client_id,
+                        data_rcv)
+
+    def receive_ack(self, edge, seqnum):
+        self.edge_acked[edge] = seqnum
+
+    # Edges
+
+    def receive_model(self, edge, frames):
+        node = self.edges[edge]
+        for msg_type, payload in frames:
+            data_rcv = node.receive_model(msg_type, payload)
+            if data_rcv is None:
+                # Steps will be sent from the version the edge has
+                break
+            node.set_global_model(data_rcv)
+
+        self.deliver(('edge_up', edge), self.args.edge_link, 0,
+                     self.receive_ack, edge, node.seqnum)
+
+        # Clients holding the same version need the same frames
+        sizes = {}
+        model = node.global_model
+        for client in range(edge, self.args.clients, len(self.edges)):
+            acked = self.client_acked[client]
+            if acked not in sizes:
+                sizes[acked] = sum(
+                    _size(buffers) for _, buffers in
+                    node.history.frames(acked, node.seqnum)
+                )
+            if sizes[acked] == 0:
+                continue
+
+            self.n_bytes['client_down'] += sizes[acked]
+            self.deliver(('client_down', client), self.args.client_link,
+                         sizes[acked], self.receive_client_model, client,
+                         node.seqnum, model)
+
+    def send_update(self, edge, data):
+        msg_type, buffers = self.edges[edge].encode_update(data)
+        payload = bytearray().join(buffers)
+        self.n_bytes['edge_up'] += len(payload)
+        self.deliver(('edge_up', edge), self.args.edge_link, len(payload),
+                     self.receive_update, edge, msg_type, payload)
+
+    def receive_client_update(self, client, data):
+        self.add_update(self.edge_of(client), 'edge',
+                        self.client_id(client), data)
+
+    # Clients
+
+    def receive_client_model(self, client, seqnum, model):
+        self.client_acked[client] = seqnum
+        if client in self.jobs:
+            # Trains on the newest model once done
+            self.received[client] = (seqnum, model)
+        else:
+            self.start_training(client, seqnum, model)
+
+    def start_training(self, client, seqnum, model):
+        self.jobs[client] = (seqnum, model)
+        self.waiting.append(client)
+        duration = (
+            self.args.local_steps * self.args.step_time
+            * self.speeds[client]
+            * (0.5 + torch.rand((), generator=self.generator).item())
+        )
+        self.schedule(duration, self.finish_training, client)
+
+    def finish_training(self, client):
+        if client not in self.results:
+            self.train_waiting()
+
+        seqnum, _ = self.jobs.pop(client)
+        data = {
+            'value': self.results.pop(client),
+            'weight': 1,
+            'seqnum': seqnum,
+        }
+        self.n_bytes['client_up'] += self.update_size
+        self.deliver(('client_up', client), self.args.client_link,
+                     self.update_size, self.receive_client_update, client,
+                     data)
+
+        received = self.received.pop(client, None)
+        if received is not None:
+            self.start_training(client, *received)
+
+    def train_waiting(self):
+        start_time = time.perf_counter()
+        jobs = [(client, self.jobs[client][1]) for client in self.waiting]
+        for (client, _), model in zip(jobs, self.trainer.train(jobs)):
+            self.results[client] = model
+        self.training_time += time.perf_counter() - start_time
+        self.n_trained += len(jobs)
+        self.waiting = []
+
+    def summary(self):
+        return {
+            'versions': self.root.seqnum,
+            'virtual_time': self.clock.now,
+            'client_trainings': self.n_trained,
+            'training_seconds': self.training_time,
+            'updates': {
+                tier: {'accepted': accepted, 'dropped': dropped}
+                for tier, (accepted, dropped) in self.updates.items()
+            },
+            'bytes': self.n_bytes,
+            'root_rounds': self.root.scheduler.stats(),
+            'evaluations': self.evaluations,
+        }
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Simulate the aggregation tree on a virtual clock"
+    )
+    parser.add_argument('--edges', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument(
+        '--rounds', type=int, default=20,
+        help="stop once the root published this many versions "
+             "(default: 20)"
+    )
+    parser.add_argument(
+        '--max-time', type=float, default=float('inf'),
+        help="stop at this virtual time, in seconds (default: none)"
+    )
+    parser.add_argument(
+        '--target-accuracy', type=float,
+        help="stop once the root's model reaches this test accuracy "
+             "(default: none)"
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--local-steps', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=0.05)
+    parser.add_argument(
+        '--non-iid', action='store_true',
+        help="give each client two runs of label-sorted data instead of a "
+             "random shard"
+    )
+    parser.add_argument(
+        '--step-time', type=float, default=0.05,
+        help="virtual seconds per local step of a normal client "
+             "(default: 0.05)"
+    )
+    parser.add_argument('--slow-fraction', type=float, default=0.2)
+    parser.add_argument('--slow-factor', type=float, default=5.0)
+    parser.add_argument(
+        '--client-link', type=parse_link, default=parse_link('20:20'),
+        metavar='MS:MBITS',
+        help="latency and bandwidth between clients and edges "
+             "(default: 20:20)"
+    )
+    parser.add_argument(
+        '--edge-link', type=parse_link, default=parse_link('10:1000'),
+        metavar='MS:MBITS',
+        help="latency and bandwidth between edges and the root "
+             "(default: 10:1000)"
+    )
+    parser.add_argument(
+        '--compression', choices=SCHEMES, default='none',
+        help="how edges send their updates (clients send whole models)"
+    )
+    parser.add_argument(
+        '--downlink-compression', choices=SCHEMES, default='none'
+    )
+    parser.add_argument('--topk-ratio', type=float, default=0.01)
+    parser.add_argument(
+        '--buffer-size', type=int, default=0,
+        help="updates that close an edge's round (default: 0, all clients)"
+    )
+    parser.add_argument(
+        '--root-buffer-size', type=int, default=0,
+        help="updates that close the root's round (default: 0, all edges)"
+    )
+    parser.add_argument(
+        '--aggregator', choices=list(AGGREGATORS), default='mean',
+        help="how an edge combines its clients' updates (default: mean)"
+    )
+    parser.add_argument(
+        '--root-aggregator', choices=list(AGGREGATORS), default='mean',
+        help="how the root combines the edges' updates (default: mean)"
+    )
+    parser.add_argument('--trim-ratio', type=float, default=0.1)
+    parser.add_argument(
+        '--clip-norm', type=float, default=0.0,
+        help="clip each update's change to this L2 norm, on every node "
+             "(default: 0, off)"
+    )
+    parser.add_argument(
+        '--max-weight', type=float, default=0.0,
+        help="cap the weight of each update, on every node (default: 0, "
+             "no cap)"
+    )
+    parser.add_argument(
+        '--server-optimizer', choices=OPTIMIZERS, default='none',
+        help="how the root steps along the round's average change "
+             "(default: none, FedAvg)"
+    )
+    parser.add_argument('--server-lr', type=float, default=1.0)
+    parser.add_argument('--server-momentum', type=float, default=0.9)
+    parser.add_argument('--server-beta2', type=float, default=0.99)
+    parser.add_argument('--server-epsilon', type=float, default=1e-3)
+    parser.add_argument('--max-staleness', type=int, default=0)
+    parser.add_argument('--staleness-exponent', type=float, default=0.5)
+    parser.add_argument(
+        '--eval-every', type=int, default=1,
+        help="evaluate every this many versions (default: 1)"
+    )
+    parser.add_argument(
+        '--chunk-size', type=int, default=64,
+        help="clients trained together in one vectorized pass "
+             "(default: 64)"
+    )
+    parser.add_argument('--output', help="write a summary as JSON")
+    return parser
+
+
+def main():
+    args = make_parser().parse_args()
+
+    start_time = time.perf_counter()
+    simulation = Simulation(args)
+    simulation.run()
+    summary = simulation.summary()
+    summary['wall_seconds'] = time.perf_counter() - start_time
+
+    print("{} versions, {} client trainings in {:.1f} s virtual, "
+          "{:.1f} s wall ({:.1f} s training)".format(
+              summary['versions'], summary['client_trainings'],
+              summary['virtual_time'], summary['wall_seconds'],
+              summary['training_seconds']))
+    for tier, counts in summary['updates'].items():
+        print("{:<5} updates: {accepted} accepted, {dropped} dropped".format(
+            tier, **counts))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+from compression import accumulate
+
+
+class StalenessPolicy:
+    """Which updates from older model versions a node accepts, and how much
+    they count.
+
+    An update's staleness is the number of versions published since the
+    model it was trained from. Up to `max_staleness`, its delta is added to
+    the current round scaled by `(1 + staleness) ** -exponent` (the
+    polynomial decay of FedAsync); older updates are dropped. The default,
+    `max_staleness=0`, is the synchronous policy: only updates for the
+    current version count.
+    """
+
+    def __init__(self, max_staleness=0, exponent=0.5):
+        if max_staleness < 0:
+            raise ValueError("max_staleness must be at least 0")
+
+        self.max_staleness = max_staleness
+        self.exponent = exponent
+
+    def scale(self, staleness):
+        """Return the factor for an update's delta, or None to drop it."""
+        if staleness < 0 or staleness > self.max_staleness:
+            return None
+        return (1 + staleness) ** -self.exponent
+
+
+def accumulate_stale(accumulator, history, policy, data_rcv, round_id,
+                     shard=None):
+    """Add an update trained from version data_rcv['seqnum'] to round
+    `round_id`, as `policy` allows.
+
+    A stale update's delta is applied to the current model (FedBuff): whole
+    models are turned into deltas against their version in `history`,
+    delta kinds are added as they are, both scaled down. Return the
+    staleness, or None if the update was dropped.
+    """
+    staleness = round_id - data_rcv['seqnum']
+    scale = policy.scale(staleness)
+    if scale is None:
+        return None
+
+    if staleness == 0:
+        accepted = accumulate(accumulator, data_rcv, shard)
+    else:
+        reference = None
+        if 'value' in data_rcv:
+            reference = history.model(data_rcv['seqnum'])
+            if reference is None:
+                return None
+
+        accepted = accumulate(
+            accumulator, data_rcv, shard, round_id=round_id,
+            reference=reference, scale=scale
+        )
+
+    return staleness if accepted else None
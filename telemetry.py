@@ -0,0 +1,303 @@
+"""Training telemetry, exported in batches off the training loop.
+
+`TelemetryExporter.record` only queues a point. A background thread sends
+the queue in gzip-compressed JSON batches, {"data": [...]}, to the
+backend's /log/create route over one keep-alive connection, once
+`batch_size` points are in or `interval` seconds after the first one. If
+the backend is unreachable or fails (5xx), batches are appended to a spool
+file as JSON lines and sent first once it answers again. A batch the
+backend rejects (any other status) would be rejected again: it is dropped,
+so it cannot hold up the ones after it.
+
+For tests without the backend and MongoDB, run a stub that accepts the
+same requests and counts the points:
+
+    python telemetry.py --port 9000
+"""
+import argparse
+import gzip
+import http.client
+import http.server
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+
+from utils import logger
+from metrics import registry
+
+DEFAULT_URL = 'http://localhost:9000/log/create'
+
+POINTS = {
+    outcome: registry.counter(
+        'fl_telemetry_points_total', "Telemetry points, by outcome",
+        outcome=outcome
+    )
+    for outcome in ('sent', 'spooled', 'dropped')
+}
+
+# What became of a posted batch
+SENT = 'sent'
+REJECTED = 'rejected'
+FAILED = 'failed'
+
+
+class TelemetryExporter:
+    """Queue telemetry points and post them in batches from a daemon
+    thread.
+
+    `record` never blocks: when `max_pending` points are already waiting,
+    new ones are dropped and counted. `close` sends what is left.
+    """
+
+    def __init__(self, url=DEFAULT_URL, batch_size=500, interval=5.0,
+                 spool_path='telemetry.spool', max_pending=100000,
+                 timeout=5.0):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spool_path = spool_path
+        self.timeout = timeout
+
+        self._queue = queue.Queue(max_pending)
+        self._conn = None
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, value):
+        """Queue one point, e.g. a loss value."""
+        try:
+            self._queue.put_nowait(value)
+        except queue.Full:
+            POINTS['dropped'].inc()
+
+    def close(self):
+        """Send the queued points and stop the sender."""
+        self._closed.set()
+        self._thread.join()
+        if self._conn is not None:
+            self._conn.close()
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self.export(batch)
+            elif self._closed.is_set():
+                return
+
+    def _next_batch(self):
+        """Wait for the first point, then collect up to `batch_size` for
+        at most `interval` seconds. Return [] once closed and drained.
+        """
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if self._closed.is_set():
+                timeout = 0
+            elif deadline is None:
+                timeout = 0.5
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+            try:
+                batch.append(self._queue.get(timeout=max(timeout, 0)))
+            except queue.Empty:
+                if batch or self._closed.is_set():
+                    break
+                continue
+
+            if deadline is None:
+                deadline = time.monotonic() + self.interval
+        return batch
+
+    def export(self, batch):
+        """Post a batch, after the spooled ones; spool it on failure."""
+        if not self._send_spool():
+            self._spool(batch)
+            return
+
+        outcome = self._post(batch)
+        if outcome == FAILED:
+            self._spool(batch)
+        else:
+            _count(batch, outcome)
+
+    def _post(self, batch):
+        """POST one batch. Return SENT, REJECTED if the backend answered
+        with a status that retrying would not change, or FAILED if it was
+        unreachable or answered 5xx.
+        """
+        body = gzip.compress(json.dumps({'data': batch}).encode('utf-8'))
+        headers = {
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+        }
+        # A kept-alive connection may have been closed by the backend in
+        # the meantime: try once more on a new one
+        for attempt in range(2):
+            try:
+                if self._conn is None:
+                    self._conn = http.client.HTTPConnection(
+                        self.host, self.port, timeout=self.timeout
+                    )
+                self._conn.request('POST', self.path, body, headers)
+                response = self._conn.getresponse()
+                response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self._conn.close()
+                self._conn = None
+                if attempt == 1:
+                    logger.warning("Telemetry backend unreachable: %s", e)
+                    return FAILED
+
+        if response.status >= 500:
+            logger.warning("Telemetry backend answered %d",
+                           response.status)
+            return FAILED
+        if response.status >= 300:
+            logger.warning("Telemetry backend rejected a batch of %d "
+                           "points (%d), dropped", len(batch),
+                           response.status)
+            return REJECTED
+        return SENT
+
+    def _spool(self, batch):
+        if self.spool_path is None:
+            POINTS['dropped'].inc(len(batch))
+            return
+        with open(self.spool_path, 'a') as file:
+            file.write(json.dumps(batch) + '\n')
+        POINTS['spooled'].inc(len(batch))
+
+    def _send_spool(self):
+        """Send the spooled batches, if any, dropping those the backend
+        rejects. Return False if some could not be sent; they stay in the
+        spool.
+        """
+        if self.spool_path is None or not os.path.exists(self.spool_path):
+            return True
+
+        with open(self.spool_path) as file:
+            batches = [json.loads(line) for line in file if line.strip()]
+
+        for i, batch in enumerate(batches):
+            outcome = self._post(batch)
+            if outcome == FAILED:
+                _rewrite_spool(self.spool_path, batches[i:])
+                return False
+            _count(batch, outcome)
+
+        os.remove(self.spool_path)
+        return True
+
+
+def _count(batch, outcome):
+    POINTS['sent' if outcome == SENT else 'dropped'].inc(len(batch))
+
+
+def _rewrite_spool(path, batches):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        for batch in batches:
+            file.write(json.dumps(batch) + '\n')
+    os.replace(temp_path, path)
+
+
+class StubBackend:
+    """A local stand-in for the backend's /log/create route, for tests.
+
+    It accepts single points and batches, form-encoded or JSON, optionally
+    gzip-compressed, and keeps the points in `points`.
+    """
+
+    def __init__(self, port=0, host='127.0.0.1'):
+        self.points = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(
+                    int(self.headers.get('Content-Length', 0))
+                )
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+
+                if self.headers.get('Content-Type', '').startswith(
+                        'application/json'):
+                    data = json.loads(body)['data']
+                else:
+                    data = float(urllib.parse.parse_qs(
+                        body.decode('utf-8'))['data'][0])
+                stub.add(data if isinstance(data, list) else [data])
+
+                reply = b'{"success": true}'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.url = 'http://{}:{}/log/create'.format(host, self.port)
+
+    def add(self, points):
+        with self._lock:
+            self.points.extend(points)
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_arguments(parser):
+    """Add the telemetry options to an argparse parser."""
+    parser.add_argument(
+        '--telemetry-url',
+        help="post training losses in batches to this backend route, "
+             "e.g. " + DEFAULT_URL + " (default: off)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stub telemetry backend, counting the points posted"
+    )
+    parser.add_argument('--port', type=int, default=9000)
+    args = parser.parse_args()
+
+    stub = StubBackend(args.port)
+    stub.start()
+    print("Stub backend at " + stub.url)
+    n_points = 0
+    while True:
+        time.sleep(5)
+        if len(stub.points) != n_points:
+            n_points = len(stub.points)
+            print("{} points received".format(n_points))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import torch
+
+from utils import logger
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+
+class BackgroundTrainer:
+    """Server-side training, kept off the round-close path.
+
+    Every model passed to `submit` is trained for `n_batches` batches on a
+    private NeuralNet in a background thread, and the result is handed to
+    `contribute(value, weight)`, which adds it as one more participant of the
+    round that is open when training finishes (usually the next one). Models
+    submitted while training is in progress replace each other, so the
+    trainer always starts from the latest global model.
+    """
+
+    def __init__(self, dataloader, contribute, weight=1, n_batches=101,
+                 learning_rate=0.0001):
+        self.dataloader = dataloader
+        self.contribute = contribute
+        self.weight = weight
+        self.n_batches = n_batches
+
+        self.model = NeuralNet()
+        self.state = FlatState(self.model)
+        self.optimizer = torch.optim.SGD(
+            self.model.parameters(), learning_rate
+        )
+        self.criterion = torch.nn.CrossEntropyLoss()
+
+        self.last_train_time = 0.0
+        self._pending = None
+        self._condition = threading.Condition()
+
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, avg):
+        """Train on a snapshot of the global model next."""
+        with self._condition:
+            self._pending = avg
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                avg = self._pending
+                self._pending = None
+
+            self.state.load(avg)
+            self.model.train()
+
+            train_loss = 0.0
+            start_time = time.time()
+            for i, (data, target) in enumerate(self.dataloader):
+                if i >= self.n_batches:
+                    break
+
+                output = self.model(data)
+                loss = self.criterion(output, target)
+                self.optimizer.zero_grad()
+                loss.backward()
+                self.optimizer.step()
+
+                train_loss += loss.item() / self.n_batches
+            self.last_train_time = time.time() - start_time
+
+            logger.info("Current loss value: %s", train_loss)
+            logger.info("Training time: %.2f s", self.last_train_time)
+
+            self.contribute(self.state.snapshot(), self.weight)
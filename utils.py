@@ -1,6 +1,139 @@
-from datetime import datetime
-
-
-def print_msg(msg):
-    current_date_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print('[' + str(current_date_time) + '] ' + msg)
+import os
+import queue
+import sys
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVEL_NAMES = {
+    'DEBUG': DEBUG,
+    'INFO': INFO,
+    'WARNING': WARNING,
+    'ERROR': ERROR,
+    'OFF': OFF,
+}
+
+# Records logged once per update (the hot path of every node) keep one in
+# this many
+UPDATE_LOG_EVERY = 100
+
+
+def format_msg(msg, timestamp=None):
+    if timestamp is None:
+        timestamp = datetime.now()
+    current_date_time = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    return '[' + str(current_date_time) + '] ' + msg
+
+
+def print_msg(msg):
+    print(format_msg(msg))
+
+
+def tensor_summary(tensor):
+    """Describe a tensor by shape and norm instead of dumping its values."""
+    return ('Tensor(shape=' + str(tuple(tensor.shape))
+            + ', norm=' + '{:.4g}'.format(float(tensor.float().norm()))
+            + ')')
+
+
+class Logger:
+    """Leveled logger that formats and writes from a background thread.
+
+    Callers only check the level, apply sampling and enqueue, so logging
+    from inside a critical section costs next to nothing. Tensor arguments
+    are replaced by `tensor_summary` at call time (the tensor may be reused
+    before the writer runs). `every=n` keeps one record out of n per call
+    site. Records are dropped, and counted, if the queue is full.
+    """
+
+    def __init__(self, level=INFO, stream=None, max_queue_size=10000):
+        self.level = level
+        self.stream = stream
+        self.n_dropped = 0
+
+        self._queue = queue.Queue(max_queue_size)
+        self._counts = defaultdict(int)
+        self._writer = threading.Thread(target=self._write_forever)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, msg, *args, every=1):
+        if level < self.level:
+            return
+
+        if every > 1:
+            # Racy increments only make sampling approximate
+            self._counts[msg] += 1
+            if self._counts[msg] % every != 1:
+                return
+
+        args = tuple(
+            tensor_summary(arg) if _is_tensor(arg) else arg for arg in args
+        )
+        try:
+            self._queue.put_nowait((datetime.now(), msg, args))
+        except queue.Full:
+            self.n_dropped += 1
+
+    def debug(self, msg, *args, every=1):
+        self.log(DEBUG, msg, *args, every=every)
+
+    def info(self, msg, *args, every=1):
+        self.log(INFO, msg, *args, every=every)
+
+    def warning(self, msg, *args, every=1):
+        self.log(WARNING, msg, *args, every=every)
+
+    def error(self, msg, *args, every=1):
+        self.log(ERROR, msg, *args, every=every)
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        self._queue.join()
+
+    def _write_forever(self):
+        while True:
+            lines = [self._format(*self._queue.get())]
+            n_records = 1
+            # Write whatever else is already waiting in one go
+            while True:
+                try:
+                    lines.append(self._format(*self._queue.get_nowait()))
+                    n_records += 1
+                except queue.Empty:
+                    break
+
+            stream = self.stream if self.stream is not None else sys.stdout
+            try:
+                stream.write('\n'.join(lines) + '\n')
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+
+            for _ in range(n_records):
+                self._queue.task_done()
+
+    @staticmethod
+    def _format(timestamp, msg, args):
+        if args:
+            msg = msg % args
+        return format_msg(msg, timestamp)
+
+
+def _is_tensor(value):
+    return hasattr(value, 'shape') and hasattr(value, 'norm')
+
+
+# Level is read from the LOG_LEVEL environment variable (default INFO)
+logger = Logger(
+    LEVEL_NAMES.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), INFO)
+)
@@ -0,0 +1,97 @@
+"""Local training of many clients' models at once, for hosts that emulate
+many devices (multi_client.py) and for the simulator (simulator.py).
+
+Needs torch.func (PyTorch 2.0 or newer).
+"""
+import torch
+from torch.func import functional_call, grad, vmap
+
+from params import FlatState
+from DDP.model.model import NeuralNet
+
+
+class VectorizedTrainer:
+    """Local SGD for many clients at once.
+
+    The clients' models are rows of one matrix, laid out like the vector
+    of FlatState, and torch.func.vmap runs NeuralNet over all rows at once,
+    each on the client's own batches, `chunk_size` clients at a time.
+    BatchNorm running statistics are kept per client like the parameters.
+    Each client draws its batches from its shard (see data.py) with its own
+    generator, so results do not depend on which clients happen to train
+    together.
+    """
+
+    def __init__(self, images, labels, shards, n_steps, batch_size,
+                 learning_rate, chunk_size, seed):
+        self.images = images
+        self.labels = labels
+        self.shards = shards
+        self.n_steps = n_steps
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        self.chunk_size = chunk_size
+        self.generators = [
+            torch.Generator().manual_seed(seed * len(shards) + client)
+            for client in range(len(shards))
+        ]
+
+        self.model = NeuralNet()
+        self.model.train()
+        self.schema = FlatState(self.model).schema
+        self.parameter_names = {
+            name for name, _ in self.model.named_parameters()
+        }
+
+        def loss(params, buffers, data, target):
+            output = functional_call(self.model, (params, buffers), (data,))
+            return torch.nn.functional.cross_entropy(output, target)
+
+        self._gradients = vmap(grad(loss))
+
+    def views(self, vectors):
+        """Split [clients, size] vectors into parameter and buffer views,
+        batched along the first dimension.
+        """
+        params = {}
+        buffers = {}
+        for name, shape, offset in self.schema:
+            numel = 1
+            for dim in shape:
+                numel *= dim
+            view = vectors[:, offset:offset + numel].view(-1, *shape)
+            if name in self.parameter_names:
+                params[name] = view
+            else:
+                buffers[name] = view
+        return params, buffers
+
+    def batches(self, client):
+        """Return the dataset indices of a client's next local steps."""
+        shard = self.shards[client]
+        picks = torch.randint(
+            len(shard), (self.n_steps, self.batch_size),
+            generator=self.generators[client]
+        )
+        return shard[picks]
+
+    def train(self, jobs):
+        """Train each (client, model) pair. Return the trained models."""
+        results = []
+        for start in range(0, len(jobs), self.chunk_size):
+            chunk = jobs[start:start + self.chunk_size]
+            vectors = torch.stack([model for _, model in chunk])
+            params, buffers = self.views(vectors)
+            indices = torch.stack([self.batches(client)
+                                   for client, _ in chunk])
+
+            for step in range(self.n_steps):
+                batch = indices[:, step]
+                gradients = self._gradients(
+                    params, buffers, self.images[batch], self.labels[batch]
+                )
+                for name, gradient in gradients.items():
+                    params[name].sub_(gradient, alpha=self.learning_rate)
+
+            results.extend(vectors.unbind())
+        return results